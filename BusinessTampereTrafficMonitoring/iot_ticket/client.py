@@ -47,5 +47,30 @@ class Client(iotticket.client.Client):
         except Exception as err:
             print(f"[IoT Ticket Client] Failed to write data: {err}", file=sys.stderr)
 
+    def post_lane_statistics(self, *, device_id: str, lane: str, queue_length: float, dwell_time, timestamp: float):
+        """
+        Send the average queue length and dwell time of a lane to IoT Ticket, as the
+        data tags "<lane>_queue_length" and "<lane>_dwell_time".
+
+        Required keyword arguments:
+        ===========================
+        device_id:      Device ID for the camera (defined in IoT Ticket) (str)
+        lane:           Lane ID (str)
+        queue_length:   Average number of cars on the lane (float)
+        dwell_time:     Average time the cars spent on the lane in seconds, None if not known (float)
+        timestamp:      Unix timestamp in seconds (end of the averaging period) (float)
+        """
+        time_ms = int(1000 * timestamp)
+        values = [datanodesvalue(name=f"{lane}_queue_length", dataType="double", ts=time_ms, v=queue_length,
+                                 unit="cars")]
+        if dwell_time is not None:
+            values.append(datanodesvalue(name=f"{lane}_dwell_time", dataType="double", ts=time_ms, v=dwell_time,
+                                         unit="s"))
+        for nv in values:
+            try:
+                client.writedata(device_id, nv)
+            except Exception as err:
+                print(f"[IoT Ticket Client] Failed to write data: {err}", file=sys.stderr)
+
 
 client = Client(IOT_TICKET_URL, IOT_TICKET_USER, IOT_TICKET_PASS)
@@ -1,42 +1,128 @@
 import json
 import threading
+import time
 
 from BusinessTampereTrafficMonitoring.object_detector.object_detector import ObjectDetector
+from BusinessTampereTrafficMonitoring.object_detector.tracker import DWELL_TIME
+from BusinessTampereTrafficMonitoring.object_detector.tracker import LANE_COUNTS
+from BusinessTampereTrafficMonitoring.object_detector.tracker import LaneStatistics
+from BusinessTampereTrafficMonitoring.stream_reader.log import log_to_file
 from BusinessTampereTrafficMonitoring.traffic_lights.api_client import TrafficLightAPIClient
+from BusinessTampereTrafficMonitoring.traffic_lights.event_bus import CYCLE_COMPLETED
+from BusinessTampereTrafficMonitoring.traffic_lights.event_bus import LIGHT_CHANGED
+from BusinessTampereTrafficMonitoring.traffic_lights.event_queue import LightChangeQueue
+from BusinessTampereTrafficMonitoring.traffic_lights.poll_schedule import AdaptivePollSchedule
+from BusinessTampereTrafficMonitoring.traffic_lights.sharded_poller import ShardedPoller
 
+LIGHT_CHANGE_POLL_INTERVAL = 2.0
 
-with open("config.json", "r") as configfile:
-    CONFIG = json.load(configfile)
 
-# Read monitored devices from config, get rid of duplicates
-monitored_devices = set(lane["intersection_id"] for lane in CONFIG["lanes"])
+def main():
+    started = time.monotonic()
+    log_to_file()
+    with open("config.json", "r") as configfile:
+        config = json.load(configfile)
 
-traffic_light_client = TrafficLightAPIClient(
-    url="http://trafficlights.tampere.fi/api/v1/deviceState/",
-    monitored_devices=list(monitored_devices),
-    db="sqlite:///:memory:",
-)
+    # Read monitored devices from config, get rid of duplicates
+    light_events = config.get("light_events", {})
+    camera_devices = set(lane["intersection_id"] for lane in config["lanes"])
+    # intersections without cameras are polled for cycle statistics only
+    monitored_devices = camera_devices | set(light_events.get("devices", []))
 
-object_detector = ObjectDetector(
-    video_location=CONFIG["camera_url"],
-    config=CONFIG
-)
+    traffic_light_client = TrafficLightAPIClient(
+        url="http://trafficlights.tampere.fi/api/v1/deviceState/",
+        monitored_devices=list(monitored_devices),
+        db="sqlite:///:memory:",
+    )
 
-video_reading = threading.Thread(
-    target=object_detector.stream_reader.read_stream,
-    args=tuple(),
-    daemon=True
-)
-video_reading.start()
+    object_detector = ObjectDetector(config=config)
 
-LIGHT_CHANGE_POLL_INTERVAL = 2.0
-light_watching = threading.Thread(
-    target=traffic_light_client.listen_for_light_change_events,
-    args=(LIGHT_CHANGE_POLL_INTERVAL, object_detector.detect_by_signal_group_and_time),
-    daemon=True
-)
-light_watching.start()
-
-# Stop the system when user presses enter
-input()
-print("Shutting down..")
+    for stream_reader in object_detector.stream_readers.values():
+        video_reading = threading.Thread(
+            target=stream_reader.read_stream,
+            args=tuple(),
+            daemon=True
+        )
+        video_reading.start()
+
+    if object_detector.background is not None:
+        background_detection = threading.Thread(target=object_detector.background.run, daemon=True)
+        background_detection.start()
+
+    # The counts of every tracked frame are averaged and sent to IoT Ticket once per report interval
+    if object_detector.lane_trackers:
+        lane_statistics = LaneStatistics(
+            object_detector.post_lane_statistics,
+            window=config.get("detector", {}).get("tracking", {}).get("report_interval", 60.0),
+        )
+        object_detector.events.subscribe(LANE_COUNTS, lane_statistics.add_counts)
+        object_detector.events.subscribe(DWELL_TIME, lane_statistics.add_dwell_time)
+
+    for lane_tracker in object_detector.lane_trackers.values():
+        tracking = threading.Thread(target=lane_tracker.run, daemon=True)
+        tracking.start()
+
+    # Light changes are handled by a pool of workers, so that polling is never blocked by
+    # detection and simultaneous light changes share a model batch
+    light_changes = LightChangeQueue(
+        object_detector.detect_by_signal_group_and_time,
+        workers=light_events.get("workers", 4),
+        capacity=light_events.get("queue_size", 32),
+        max_delay=light_events.get("max_delay", 60.0),
+    )
+
+    # Poll densely around the predicted changes of the monitored signal groups
+    schedule = None
+    poll_interval = light_events.get("poll_interval", LIGHT_CHANGE_POLL_INTERVAL)
+    adaptive_polling = light_events.get("adaptive_polling", {})
+    if adaptive_polling.get("enabled", False):
+        schedule = AdaptivePollSchedule(
+            min_interval=adaptive_polling.get("min_interval", 0.2),
+            max_interval=adaptive_polling.get("max_interval", 4.0),
+            margin=adaptive_polling.get("margin", 0.5),
+            # never more requests than polling every poll_interval
+            budget_interval=poll_interval,
+            max_saved_polls=adaptive_polling.get("max_saved_polls", 10),
+            # the devices monitored only for cycle statistics are polled like without a schedule
+            untracked_interval=poll_interval,
+            signal_groups={(lane["intersection_id"], signal_group)
+                           for lane in config["lanes"] for signal_group in lane["signal_groups"]},
+        )
+
+    # One poller feeds both the detection and the database
+    def on_light_change(device, signal_group, epoch_time, status):
+        if device in camera_devices:
+            light_changes.put(device, signal_group, epoch_time, status)
+
+    traffic_light_client.events.subscribe(LIGHT_CHANGED, on_light_change)
+    traffic_light_client.events.subscribe(CYCLE_COMPLETED, traffic_light_client.store_later)
+
+    # the model has been warmed up, light changes can be handled without delay
+    print(f"[main] Started in {time.monotonic() - started:.2f} s", flush=True)
+    # Many intersections are polled in several processes, the events are published in this one
+    poller = traffic_light_client
+    sharding = light_events.get("sharding", {})
+    if sharding.get("enabled", False):
+        poller = ShardedPoller(
+            traffic_light_client,
+            workers=sharding.get("workers", 4),
+            restart_delay=sharding.get("restart_delay", 1.0),
+        )
+    light_watching = threading.Thread(
+        target=poller.poll,
+        args=(poll_interval, schedule),
+        daemon=True
+    )
+    light_watching.start()
+
+    # Stop the system when user presses enter
+    input()
+    print("Shutting down..")
+    poller.stop_polling()
+    light_changes.stop()
+    object_detector.stop()
+
+
+# Camera processes are started with the spawn method, which imports this module again
+if __name__ == "__main__":
+    main()
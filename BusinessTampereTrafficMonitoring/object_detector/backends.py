@@ -0,0 +1,351 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from abc import ABC
+from abc import abstractmethod
+
+import numpy as np
+
+# Detection parameters shared by all backends
+MAX_BOXES = 50
+IOU_THRESHOLD = 0.5
+SCORE_THRESHOLD = 0.5
+
+
+class DetectorBackend(ABC):
+    """
+    Runs YOLOv4 on a batch of letterboxed images. Backends import their
+    runtime in load(), so only the selected one has to be installed.
+    """
+    def __init__(self, model_path: str, input_size: int):
+        """
+        # Parameters:
+          model_path: Path of the model file (str)
+          input_size: Width and height of the model input (int)
+        """
+        self.model_path = model_path
+        self.input_size = input_size
+
+    @abstractmethod
+    def load(self):
+        """
+        Loads the model. Has to be called before infer().
+        """
+
+    @abstractmethod
+    def infer(self, batch):
+        """
+        # Parameters:
+          batch: Images scaled to [0, 1] (numpy.ndarray of float32 and shape (N, S, S, 3))
+        # Returns:
+          Boxes (x0, y0, x1, y1) relative to the input size, scores, classes and
+          the number of valid detections of each image, as returned by YOLOv4
+          (Tuple[numpy.ndarray of shape (N, MAX_BOXES, 4), numpy.ndarray of shape (N, MAX_BOXES),
+                 numpy.ndarray of shape (N, MAX_BOXES), numpy.ndarray of N ints])
+        """
+
+    def warmup(self, batch_size: int = 1):
+        """
+        Runs the model once so that graph building, memory allocation and
+        kernel selection are not paid for by the first real detection.
+        """
+        self.infer(np.zeros((batch_size, self.input_size, self.input_size, 3), dtype=np.float32))
+
+
+def file_hash(path: str) -> str:
+    """
+    # Returns:
+      SHA-256 of the file contents (str)
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as weights:
+        for chunk in iter(lambda: weights.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TensorFlowBackend(DetectorBackend):
+    """
+    tf2_yolov4 Keras model built from the pretrained weights (yolov4.h5).
+
+    With an artifact directory, the model is compiled into a SavedModel on the
+    first start, keyed by the weights hash and the input shape, and later starts
+    load the SavedModel instead of building the model and loading the weights.
+    """
+    def __init__(self, model_path: str, input_size: int, artifact_dir=None):
+        """
+        # Parameters:
+          model_path: Path of the Keras weights (str)
+          input_size: Width and height of the model input (int)
+          artifact_dir: Directory of compiled models, None to always build the model (str)
+        """
+        super().__init__(model_path, input_size)
+        self.artifact_dir = artifact_dir
+        self.model = None
+        self.detect = None
+
+    def build(self):
+        """
+        # Returns:
+          Keras model with the pretrained weights (tf.keras.Model)
+        """
+        from tf2_yolov4.anchors import YOLOV4_ANCHORS
+        from tf2_yolov4.model import YOLOv4
+
+        model = YOLOv4(
+            input_shape=(self.input_size, self.input_size, 3),
+            anchors=YOLOV4_ANCHORS,
+            num_classes=80,
+            training=False,
+            yolo_max_boxes=MAX_BOXES,
+            yolo_iou_threshold=IOU_THRESHOLD,
+            yolo_score_threshold=SCORE_THRESHOLD,
+        )
+        model.load_weights(self.model_path)
+        return model
+
+    def artifact_path(self) -> str:
+        """
+        # Returns:
+          Path of the compiled model for the weights and the input shape (str)
+        """
+        key = f"{file_hash(self.model_path)[:16]}-{self.input_size}x{self.input_size}-{MAX_BOXES}" \
+              f"-{IOU_THRESHOLD}-{SCORE_THRESHOLD}"
+        return os.path.join(self.artifact_dir, f"yolov4-{key}")
+
+    def __compile(self, model, path):
+        """
+        Saves a function with a fixed input signature as a SavedModel. The directory
+        is written under a temporary name and renamed, so a partial artifact is never loaded.
+        """
+        import tensorflow as tf
+
+        module = tf.Module()
+        module.model = model
+
+        @tf.function(input_signature=[tf.TensorSpec([None, self.input_size, self.input_size, 3], tf.float32)])
+        def detect(batch):
+            boxes, scores, classes, valid_detections = module.model(batch, training=False)
+            return {"boxes": boxes, "scores": scores, "classes": classes, "valid_detections": valid_detections}
+
+        module.detect = detect
+        os.makedirs(self.artifact_dir, exist_ok=True)
+        temporary = tempfile.mkdtemp(dir=self.artifact_dir)
+        try:
+            tf.saved_model.save(module, temporary)
+            os.replace(temporary, path)
+        except OSError:
+            # another process saved the same artifact first
+            shutil.rmtree(temporary, ignore_errors=True)
+
+    def load(self):
+        if self.artifact_dir is None:
+            self.model = self.build()
+            return
+        import tensorflow as tf
+
+        path = self.artifact_path()
+        if not os.path.isdir(path):
+            print(f"[object_detector] Compiling the model to {path}", flush=True)
+            self.__compile(self.build(), path)
+        self.detect = tf.saved_model.load(path).detect
+
+    def infer(self, batch):
+        if self.detect is None:
+            return self.model.predict(batch)
+        outputs = self.detect(batch)
+        return tuple(outputs[name].numpy() for name in ("boxes", "scores", "classes", "valid_detections"))
+
+
+class ONNXRuntimeBackend(DetectorBackend):
+    """
+    Model exported with the convert tool to ONNX, in float32, float16 or int8.
+    The non-maximum suppression is part of the exported graph.
+    """
+    def load(self):
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(self.model_path, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # float16 models take float16 input
+        self.input_dtype = np.float16 if model_input.type == "tensor(float16)" else np.float32
+
+    def infer(self, batch):
+        outputs = self.session.run(None, {self.input_name: batch.astype(self.input_dtype, copy=False)})
+        return tuple(outputs)
+
+
+def quantize(values, scale, zero_point, dtype):
+    """
+    Converts real values to the integer representation of a quantized tensor.
+    """
+    info = np.iinfo(dtype)
+    return np.clip(np.round(values / scale + zero_point), info.min, info.max).astype(dtype)
+
+
+def dequantize(values, scale, zero_point):
+    """
+    Converts a quantized tensor back to real values.
+    """
+    return (values.astype(np.float32) - zero_point) * scale
+
+
+def _suppress(boxes, iou_threshold, limit):
+    """
+    Greedy non-maximum suppression of boxes sorted by decreasing score.
+    # Returns:
+      Indices of the kept boxes, at most limit (List[int])
+    """
+    x0, y0, x1, y1 = boxes.T
+    width = (np.minimum(x1[:, None], x1) - np.maximum(x0[:, None], x0)).clip(0)
+    height = (np.minimum(y1[:, None], y1) - np.maximum(y0[:, None], y0)).clip(0)
+    intersection = width * height
+    area = (x1 - x0) * (y1 - y0)
+    union = area[:, None] + area - intersection
+    overlapping = np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0) > iou_threshold
+    kept = []
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    for i in range(len(boxes)):
+        if suppressed[i]:
+            continue
+        kept.append(i)
+        if len(kept) == limit:
+            break
+        suppressed |= overlapping[i]
+    return kept
+
+
+def non_max_suppression(boxes, scores, max_boxes=MAX_BOXES, iou_threshold=IOU_THRESHOLD,
+                        score_threshold=SCORE_THRESHOLD):
+    """
+    NumPy version of the last layer of YOLOv4 (tf.image.combined_non_max_suppression):
+    the boxes of each class are suppressed separately and the max_boxes best
+    boxes of all classes are kept.
+    # Parameters:
+      boxes: Boxes (x0, y0, x1, y1) of every anchor relative to the input size (numpy.ndarray of shape (N, A, 4))
+      scores: Score of every class of every anchor (numpy.ndarray of shape (N, A, classes))
+      max_boxes: Maximum number of detections of an image (int)
+      iou_threshold: Boxes of the same class overlapping a better box more than this are suppressed (float)
+      score_threshold: Minimum score of a detection (float)
+    # Returns:
+      Boxes, scores, classes and the number of valid detections of each image, padded
+      with zeros to max_boxes like the output of YOLOv4
+      (Tuple[numpy.ndarray of shape (N, max_boxes, 4), numpy.ndarray of shape (N, max_boxes),
+             numpy.ndarray of shape (N, max_boxes), numpy.ndarray of N ints])
+    """
+    boxes = np.clip(np.asarray(boxes, dtype=np.float32), 0.0, 1.0)
+    scores = np.asarray(scores, dtype=np.float32)
+    out_boxes = np.zeros((len(boxes), max_boxes, 4), dtype=np.float32)
+    out_scores = np.zeros((len(boxes), max_boxes), dtype=np.float32)
+    out_classes = np.zeros((len(boxes), max_boxes), dtype=np.float32)
+    valid_detections = np.zeros(len(boxes), dtype=np.int32)
+    for i in range(len(boxes)):
+        anchors, classes = np.nonzero(scores[i] > score_threshold)
+        detected_anchors, detected_classes = [], []
+        for cls in np.unique(classes):
+            candidates = anchors[classes == cls]
+            candidates = candidates[np.argsort(-scores[i, candidates, cls], kind="stable")]
+            kept = candidates[_suppress(boxes[i, candidates], iou_threshold, max_boxes)]
+            detected_anchors.append(kept)
+            detected_classes.append(np.full(len(kept), cls))
+        if not detected_anchors:
+            continue
+        detected_anchors = np.concatenate(detected_anchors)
+        detected_classes = np.concatenate(detected_classes)
+        detected_scores = scores[i, detected_anchors, detected_classes]
+        best = np.argsort(-detected_scores, kind="stable")[:max_boxes]
+        count = valid_detections[i] = len(best)
+        out_boxes[i, :count] = boxes[i, detected_anchors[best]]
+        out_scores[i, :count] = detected_scores[best]
+        out_classes[i, :count] = detected_classes[best]
+    return out_boxes, out_scores, out_classes, valid_detections
+
+
+class TFLiteBackend(DetectorBackend):
+    """
+    Model exported with the convert tool to TensorFlow Lite, in float32,
+    float16 or int8. Uses tflite_runtime or ai_edge_litert when installed, TensorFlow otherwise.
+    The model is exported without the non-maximum suppression, which is not a TensorFlow
+    Lite builtin, and the suppression is done with NumPy.
+    """
+    def load(self):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            try:
+                from ai_edge_litert.interpreter import Interpreter
+            except ImportError:
+                import tensorflow as tf
+
+                Interpreter = tf.lite.Interpreter
+
+        self.interpreter = Interpreter(model_path=self.model_path)
+        self.batch_size = None
+
+    def __resize(self, batch_size):
+        model_input = self.interpreter.get_input_details()[0]
+        self.interpreter.resize_tensor_input(model_input["index"], [batch_size, self.input_size, self.input_size, 3])
+        self.interpreter.allocate_tensors()
+        self.batch_size = batch_size
+        self.input_details = self.interpreter.get_input_details()[0]
+        # the converter names the outputs after the Keras model outputs ("...:0" and "...:1"),
+        # i.e. the boxes and the class scores of every anchor
+        self.output_details = sorted(self.interpreter.get_output_details(), key=lambda output: output["name"])
+
+    def infer(self, batch):
+        if len(batch) != self.batch_size:
+            self.__resize(len(batch))
+        scale, zero_point = self.input_details["quantization"]
+        if scale:
+            batch = quantize(batch, scale, zero_point, self.input_details["dtype"])
+        self.interpreter.set_tensor(self.input_details["index"], batch.astype(self.input_details["dtype"], copy=False))
+        self.interpreter.invoke()
+        outputs = []
+        for output in self.output_details:
+            value = self.interpreter.get_tensor(output["index"])
+            scale, zero_point = output["quantization"]
+            outputs.append(dequantize(value, scale, zero_point) if scale else value)
+        boxes, scores = outputs
+        return non_max_suppression(boxes, scores)
+
+
+BACKENDS = {
+    "tensorflow": TensorFlowBackend,
+    "onnxruntime": ONNXRuntimeBackend,
+    "tflite": TFLiteBackend,
+}
+
+
+def create_backend(name: str, model_path: str, input_size: int, **options) -> DetectorBackend:
+    """
+    Creates a detector backend. The model is not loaded yet.
+    # Parameters:
+      name: "tensorflow", "onnxruntime" or "tflite" (str)
+      model_path: Path of the weights (tensorflow) or the converted model (str)
+      input_size: Width and height of the model input (int)
+      options: Keyword arguments for the backend class, for example artifact_dir for tensorflow
+    # Returns:
+      DetectorBackend
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown detector backend: '{name}'")
+    return BACKENDS[name](model_path, input_size, **options)
+
+
+def backend_from_config(detector: dict, input_size: int) -> DetectorBackend:
+    """
+    Creates the backend selected in the detector section of config.json. The options
+    of each backend are given under its name in backend_options, so switching the
+    backend does not pass options the other backends do not take.
+    # Parameters:
+      detector: Detector section of config.json, for example {"backend": "tensorflow", "model": "yolov4.h5",
+                "backend_options": {"tensorflow": {"artifact_dir": "model_cache"}}} (Dict)
+      input_size: Width and height of the model input (int)
+    # Returns:
+      DetectorBackend
+    """
+    name = detector.get("backend", "tensorflow")
+    return create_backend(name, detector.get("model", "yolov4.h5"), input_size,
+                          **detector.get("backend_options", {}).get(name, {}))
@@ -0,0 +1,101 @@
+import os
+import threading
+from functools import partial
+
+from BusinessTampereTrafficMonitoring.object_detector.scheduler import PRIORITY_BACKGROUND
+
+
+def cpu_headroom(max_load: float) -> bool:
+    """
+    # Parameters:
+      max_load: Maximum 1 minute load average per CPU core (float)
+    # Returns:
+      Whether or not the load average is below the limit, True where it can not be read (bool)
+    """
+    try:
+        load = os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return True
+    return load < max_load * (os.cpu_count() or 1)
+
+
+class BackgroundDetector:
+    def __init__(self, stream_readers, rois, scheduler, detection_cache, interval=0.5, every_nth_frame=1,
+                 max_load=0.75, headroom=cpu_headroom):
+        """
+        Detects vehicles on new frames while there are no light changes to handle,
+        so that a light change only has to look up the results. Background images
+        have a lower priority in the inference scheduler than light changes.
+
+        # Parameters:
+          stream_readers: Camera id -> stream reader (Dict[str, StreamReader])
+          rois: Camera id -> region of interest (Dict[str, Region])
+          scheduler: Inference scheduler (InferenceScheduler)
+          detection_cache: Cache where the results are stored (DetectionCache)
+          interval: Time between checks for new frames in seconds (float)
+          every_nth_frame: Detect only every nth new frame (int)
+          max_load: Maximum 1 minute load average per CPU core for background detections (float)
+          headroom: Function telling if there is CPU time for a background detection (Callable[[float], bool])
+        """
+        if every_nth_frame < 1:
+            raise ValueError("every_nth_frame has to be at least one")
+        self.stream_readers = stream_readers
+        self.rois = rois
+        self.scheduler = scheduler
+        self.detection_cache = detection_cache
+        self.interval = interval
+        self.every_nth_frame = every_nth_frame
+        self.max_load = max_load
+        self.headroom = headroom
+        self.submitted = 0
+        self.skipped = 0
+        # camera id -> (timestamp of the latest seen frame, number of new frames seen, latest future)
+        self.__state = {}
+        self.__stopped = threading.Event()
+
+    def step(self):
+        """
+        Submits the newest frame of each camera, if it is new and due for detection.
+        """
+        for camera_id, stream_reader in self.stream_readers.items():
+            try:
+                timestamp, frame = stream_reader.get_timestamped_frame()
+            except LookupError:
+                continue
+            last_timestamp, seen, future = self.__state.get(camera_id, (None, 0, None))
+            if timestamp == last_timestamp:
+                continue
+            seen += 1
+            self.__state[camera_id] = (timestamp, seen, future)
+            if (seen - 1) % self.every_nth_frame != 0:
+                continue
+            # a camera never has more than one background detection queued
+            if (future is not None and not future.done()) or not self.headroom(self.max_load):
+                self.skipped += 1
+                continue
+            oldest = stream_reader.cache.oldest()
+            if oldest is not None:
+                self.detection_cache.evict_before(camera_id, oldest)
+            future = self.detection_cache.get_or_submit(
+                camera_id, timestamp,
+                partial(self.scheduler.submit, self.rois[camera_id].crop(frame), PRIORITY_BACKGROUND))
+            self.__state[camera_id] = (timestamp, seen, future)
+            self.submitted += 1
+
+    def run(self):
+        """
+        Detects new frames until stop() is called.
+        It is intended to be called in a new thread.
+        """
+        while not self.__stopped.wait(self.interval):
+            try:
+                self.step()
+            except RuntimeError as err:
+                # the scheduler has been stopped
+                print(f"[object_detector] Background detection stopped: {err}", flush=True)
+                return
+        print(f"[object_detector] Background detection stopped, {self.submitted} frames detected, "
+              f"{self.skipped} skipped", flush=True)
+
+    def stop(self):
+        self.__stopped.set()
@@ -0,0 +1,46 @@
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+
+import numpy as np
+
+from BusinessTampereTrafficMonitoring.object_detector.lane_index import LaneCount
+
+# Aggregates over the frames of a window, applied to an array of shape (frames, lanes)
+AGGREGATES = {
+    # halves are rounded up
+    "median": lambda counts: np.floor(np.median(counts, axis=0) + 0.5),
+    "max": lambda counts: counts.max(axis=0),
+}
+
+
+class Consensus(NamedTuple):
+    lane_counts: List[LaneCount]
+    # lane id -> difference between the largest and the smallest count of the frames
+    spreads: Dict[str, int]
+    frames: int
+
+
+def consensus(counts_per_frame: List[List[LaneCount]], aggregate: str = "median") -> Consensus:
+    """
+    Combines the lane counts of several frames into one count per lane.
+    # Parameters:
+      counts_per_frame: Counts of the same lanes in each frame (List[List[LaneCount]])
+      aggregate: "median" or "max" (str)
+    # Returns:
+      Combined counts and the spread of the counts of each lane (Consensus)
+    """
+    if aggregate not in AGGREGATES:
+        raise ValueError(f"Unknown aggregate {aggregate}, expected one of {', '.join(AGGREGATES)}")
+    if not counts_per_frame:
+        raise ValueError("No frames to combine")
+    lanes = [lane for lane, _ in counts_per_frame[0]]
+    counts = np.array([[cars for _, cars in frame_counts] for frame_counts in counts_per_frame],
+                      dtype=np.int64).reshape(len(counts_per_frame), len(lanes))
+    combined = AGGREGATES[aggregate](counts)
+    spreads = counts.max(axis=0) - counts.min(axis=0)
+    return Consensus(
+        [LaneCount(lane, int(cars)) for lane, cars in zip(lanes, combined)],
+        {lane.lane_id: int(spread) for lane, spread in zip(lanes, spreads)},
+        len(counts_per_frame),
+    )
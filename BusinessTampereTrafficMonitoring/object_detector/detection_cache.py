@@ -0,0 +1,125 @@
+import threading
+from bisect import bisect_left
+from bisect import insort
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable
+from typing import Hashable
+from typing import Optional
+from typing import Tuple
+
+
+def _reusable(future: Future) -> bool:
+    return not (future.done() and (future.cancelled() or future.exception() is not None))
+
+
+class DetectionCache:
+    def __init__(self, capacity: int):
+        """
+        Least recently used cache of model outputs keyed by camera and frame
+        timestamp. Results are stored as futures, so a frame that is already being
+        detected is not submitted again by a second light change.
+
+        # Parameters:
+          capacity: Maximum number of cached results (int)
+        """
+        if capacity < 1:
+            raise ValueError("Detection cache capacity has to be at least one")
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        # camera id -> timestamps of the cached results of the camera, sorted
+        self.__timestamps = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get_or_submit(self, camera_id: Hashable, timestamp: float, submit: Callable[[], Future]) -> Future:
+        """
+        Returns the cached result for a frame, or calls submit() and caches its result.
+        Failed and cancelled results are not reused.
+
+        # Parameters:
+          camera_id: Camera id (str)
+          timestamp: Timestamp of the frame in the frame cache of the camera (float)
+          submit: Starts the detection for the frame (Callable[[], Future])
+        # Returns:
+          Future of the detection result (concurrent.futures.Future)
+        """
+        key = (camera_id, timestamp)
+        with self.__lock:
+            future = self.__entries.get(key)
+            if future is not None and _reusable(future):
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return future
+            self.misses += 1
+            future = submit()
+            if key not in self.__entries:
+                insort(self.__timestamps.setdefault(camera_id, []), timestamp)
+            self.__entries[key] = future
+            while len(self.__entries) > self.capacity:
+                self.__remove(self.__entries.popitem(last=False)[0])
+            return future
+
+    def __remove(self, key):
+        camera_id, timestamp = key
+        timestamps = self.__timestamps[camera_id]
+        del timestamps[bisect_left(timestamps, timestamp)]
+        if not timestamps:
+            del self.__timestamps[camera_id]
+
+    def nearest(self, camera_id: Hashable, timestamp: float, tolerance: float) -> Optional[Tuple[float, Future]]:
+        """
+        Finds the cached result of the camera's frame closest to timestamp,
+        for example one detected in the background.
+
+        # Parameters:
+          camera_id: Camera id (str)
+          timestamp: UNIX timestamp (float)
+          tolerance: Maximum distance from timestamp to the frame in seconds (float)
+        # Returns:
+          Timestamp of the frame and the future of its result, None if there is
+          no result within the tolerance (Optional[Tuple[float, Future]])
+        """
+        with self.__lock:
+            timestamps = self.__timestamps.get(camera_id, [])
+            # the frames are visited in order of increasing distance from timestamp
+            right = bisect_left(timestamps, timestamp)
+            left = right - 1
+            while left >= 0 or right < len(timestamps):
+                if right == len(timestamps) or \
+                        (left >= 0 and timestamp - timestamps[left] <= timestamps[right] - timestamp):
+                    frame_timestamp = timestamps[left]
+                    left -= 1
+                else:
+                    frame_timestamp = timestamps[right]
+                    right += 1
+                if abs(frame_timestamp - timestamp) > tolerance:
+                    return None
+                future = self.__entries[(camera_id, frame_timestamp)]
+                if _reusable(future):
+                    self.__entries.move_to_end((camera_id, frame_timestamp))
+                    self.hits += 1
+                    return frame_timestamp, future
+            return None
+
+    def evict_before(self, camera_id: Hashable, timestamp: float):
+        """
+        Removes the results of a camera's frames older than timestamp, i.e. frames
+        that have been evicted from the frame cache and can not be requested again.
+
+        # Parameters:
+          camera_id: Camera id (str)
+          timestamp: Timestamp of the oldest frame in the frame cache (float)
+        """
+        with self.__lock:
+            timestamps = self.__timestamps.get(camera_id, [])
+            evicted = bisect_left(timestamps, timestamp)
+            for frame_timestamp in timestamps[:evicted]:
+                del self.__entries[(camera_id, frame_timestamp)]
+            del timestamps[:evicted]
+            if not timestamps:
+                self.__timestamps.pop(camera_id, None)
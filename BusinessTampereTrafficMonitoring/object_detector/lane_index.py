@@ -0,0 +1,153 @@
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Tuple
+
+import numpy as np
+
+from BusinessTampereTrafficMonitoring.tools.geometry import Polygon
+
+
+class Lane(NamedTuple):
+    index: int
+    lane_id: str
+    intersection_id: str
+    camera_id: str
+    signal_groups: Tuple[str, ...]
+    polygon: Polygon
+
+
+class LaneCount(NamedTuple):
+    lane: Lane
+    cars: int
+
+
+def _row_spans(polygon: Polygon, height: int, width: int):
+    """
+    Finds the pixels of a height x width image whose centers are inside a convex polygon,
+    row by row from the half-planes of its edges, without testing every pixel.
+    # Returns:
+      Rows and the first and last column of the pixels inside on each row, rows without
+      pixels inside are left out (Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray])
+    """
+    if len(polygon.vertices) < 3:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    y0 = max(0, int(np.floor(polygon.vertices[:, 1].min())))
+    y1 = min(height, int(np.ceil(polygon.vertices[:, 1].max())) + 1)
+    rows = np.arange(y0, y1)
+    a, b, c = polygon.edges.T
+    # a * (x + 0.5) + b * (y + 0.5) + c >= 0 on every edge, i.e. a * (x + 0.5) >= limit
+    limit = -(b * (rows[:, None] + 0.5) + c)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bound = limit / a - 0.5
+    first = np.ceil(np.where(a > 0, bound, -np.inf).max(axis=1)).clip(0, width)
+    last = np.floor(np.where(a < 0, bound, np.inf).min(axis=1)).clip(-1, width - 1)
+    # horizontal edges do not depend on x
+    inside = np.where(a == 0, limit <= 0, True).all(axis=1) & (first <= last)
+    return rows[inside], first[inside].astype(np.int64), last[inside].astype(np.int64)
+
+
+class LaneIndex:
+    def __init__(self, lanes_config: List[Dict]):
+        """
+        Lane configuration compiled once at startup. The index is never modified
+        after construction, so it can be shared between concurrent detections.
+
+        For each camera there is a label raster: an int16 image where every pixel
+        holds the index of the lane that contains it, or -1. Finding the lane of a
+        detection is a single array lookup.
+
+        # Parameters:
+          lanes_config: The "lanes" list of config.json (List[Dict])
+        """
+        self.lanes = tuple(
+            Lane(
+                index=i,
+                lane_id=lane["lane"],
+                intersection_id=lane["intersection_id"],
+                camera_id=lane["camera_id"],
+                signal_groups=tuple(lane["signal_groups"]),
+                polygon=Polygon(lane["vertices"]),
+            )
+            for i, lane in enumerate(lanes_config)
+        )
+
+        by_signal_group = {}
+        by_camera = {}
+        for lane in self.lanes:
+            by_camera.setdefault(lane.camera_id, []).append(lane)
+            for sgroup in lane.signal_groups:
+                by_signal_group.setdefault((lane.intersection_id, sgroup), []).append(lane)
+        self.__by_signal_group = {key: tuple(lanes) for key, lanes in by_signal_group.items()}
+        self.__by_camera = {key: tuple(lanes) for key, lanes in by_camera.items()}
+        self.__rasters = {camera_id: self.__rasterize(lanes) for camera_id, lanes in self.__by_camera.items()}
+
+    @staticmethod
+    def __rasterize(lanes):
+        """
+        Label raster covering the lanes, from (0, 0) to the bottom right corner of the lanes.
+        Pixels are labeled by their centers, overlapping pixels go to the first lane.
+        """
+        vertices = np.concatenate([lane.polygon.vertices for lane in lanes])
+        if len(vertices) == 0:
+            raster = np.full((0, 0), -1, dtype=np.int16)
+            raster.flags.writeable = False
+            return raster
+        x1, y1 = np.ceil(vertices.max(axis=0)).astype(int) + 1
+        raster = np.full((y1, x1), -1, dtype=np.int16)
+        # the lanes are filled last to first, so overlapping pixels go to the first lane
+        for lane in reversed(lanes):
+            for row, first, last in zip(*_row_spans(lane.polygon, y1, x1)):
+                raster[row, first:last + 1] = lane.index
+        raster.flags.writeable = False
+        return raster
+
+    def lanes_for_signal_group(self, intersection: str, sgroup: str) -> Tuple[Lane, ...]:
+        """
+        # Parameters:
+          intersection: Intersection id, for example "TRE401" (str)
+          sgroup: Signal group id, for example "A" or "RV1" (str)
+        # Returns:
+          Lanes controlled by the signal group (Tuple[Lane, ...])
+        """
+        return self.__by_signal_group.get((intersection, sgroup), ())
+
+    def lanes_for_camera(self, camera_id: str) -> Tuple[Lane, ...]:
+        return self.__by_camera.get(camera_id, ())
+
+    def raster(self, camera_id: str) -> np.ndarray:
+        """
+        # Returns:
+          Read-only label raster of the camera (numpy.ndarray of shape (H, W))
+        """
+        return self.__rasters[camera_id]
+
+    def lookup(self, camera_id: str, points) -> np.ndarray:
+        """
+        # Parameters:
+          camera_id: Camera id (str)
+          points: Coordinates (x, y) in the original video (numpy.ndarray of shape (N, 2))
+        # Returns:
+          Lane index for each point, -1 if the point is not on any lane (numpy.ndarray of N ints)
+        """
+        raster = self.__rasters[camera_id]
+        points = np.floor(np.asarray(points, dtype=np.float64).reshape(-1, 2)).astype(np.int64)
+        height, width = raster.shape
+        valid = (points[:, 0] >= 0) & (points[:, 0] < width) & (points[:, 1] >= 0) & (points[:, 1] < height)
+        indices = np.full(len(points), -1, dtype=np.int64)
+        indices[valid] = raster[points[valid, 1], points[valid, 0]]
+        return indices
+
+    def count(self, camera_id: str, points, lanes) -> List[LaneCount]:
+        """
+        Counts points on the given lanes of a camera.
+        # Parameters:
+          camera_id: Camera id (str)
+          points: Coordinates (x, y) in the original video (numpy.ndarray of shape (N, 2))
+          lanes: Lanes to count (Iterable[Lane])
+        # Returns:
+          Number of points on each lane (List[LaneCount])
+        """
+        indices = self.lookup(camera_id, points)
+        counts = np.bincount(indices[indices >= 0], minlength=len(self.lanes))
+        return [LaneCount(lane, int(counts[lane.index])) for lane in lanes]
@@ -0,0 +1,135 @@
+import threading
+from typing import List
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from BusinessTampereTrafficMonitoring.object_detector.lane_index import LaneCount
+
+
+class MotionGate:
+    def __init__(self, lane_index, rois, transforms, scale=8, threshold=6.0, max_age=60.0):
+        """
+        Skips detections when the lanes look the same as in the last detected frame.
+
+        Frames are compared as grayscale thumbnails of the region of interest,
+        downscaled by scale. A lane has changed when the mean absolute difference
+        of its pixels from the last detected frame exceeds threshold. The reference
+        is the last detected frame, not the previous one, so slow changes add up.
+
+        # Parameters:
+          lane_index: Lanes of all cameras (LaneIndex)
+          rois: Camera id -> region of interest (Dict[str, Region])
+          transforms: Camera id -> frame coordinate transform (Dict[str, FrameTransform])
+          scale: Downscaling factor of the thumbnails (int)
+          threshold: Mean absolute difference in gray levels that counts as a change (float)
+          max_age: Maximum age of reused counts in seconds (float)
+        """
+        if scale < 1:
+            raise ValueError("Thumbnail scale has to be at least one")
+        self.lane_index = lane_index
+        self.rois = rois
+        self.scale = scale
+        self.threshold = threshold
+        self.max_age = max_age
+        self.skipped = 0
+        self.detected = 0
+        # camera id -> lane index of each thumbnail pixel
+        self.__labels = {camera_id: self.__label(camera_id, roi, transforms[camera_id])
+                         for camera_id, roi in rois.items()}
+        # camera id -> (frame timestamp, thumbnail, lane index -> cars) of the last detected frame
+        self.__references = {}
+        self.__lock = threading.Lock()
+
+    def __thumbnail_size(self, roi):
+        return max(1, roi.width // self.scale), max(1, roi.height // self.scale)
+
+    def __label(self, camera_id, roi, transform):
+        """
+        Lane of each thumbnail pixel, looked up at the pixel centers in source coordinates.
+        """
+        width, height = self.__thumbnail_size(roi)
+        ys, xs = np.mgrid[0:height, 0:width]
+        centers = np.column_stack((roi.x0 + (xs.ravel() + 0.5) * roi.width / width,
+                                   roi.y0 + (ys.ravel() + 0.5) * roi.height / height))
+        return self.lane_index.lookup(camera_id, transform.to_source(centers)).reshape(height, width)
+
+    def thumbnail(self, camera_id: str, frame) -> np.ndarray:
+        """
+        # Parameters:
+          camera_id: Camera id (str)
+          frame: Frame from the stream reader of the camera (numpy.ndarray of shape (H, W, 3))
+        # Returns:
+          Grayscale thumbnail of the region of interest (numpy.ndarray of uint8)
+        """
+        region = self.rois[camera_id].crop(frame)
+        small = cv2.resize(region, self.__thumbnail_size(self.rois[camera_id]), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def __changes(self, camera_id, thumbnail, reference, lanes):
+        """
+        Mean absolute difference of each lane from the reference thumbnail.
+        """
+        difference = cv2.absdiff(thumbnail, reference)
+        labels = self.__labels[camera_id]
+        changes = {}
+        for lane in lanes:
+            mask = labels == lane.index
+            # lanes smaller than a thumbnail pixel are always detected
+            changes[lane.lane_id] = float(difference[mask].mean()) if mask.any() else float("inf")
+        return changes
+
+    def check(self, camera_id: str, timestamp: float, thumbnail, lanes) -> Optional[List[LaneCount]]:
+        """
+        Decides whether a frame needs to be detected.
+
+        # Parameters:
+          camera_id: Camera id (str)
+          timestamp: Timestamp of the frame (float)
+          thumbnail: Thumbnail of the frame from thumbnail() (numpy.ndarray)
+          lanes: Lanes to count (Iterable[Lane])
+        # Returns:
+          Counts of the last detected frame if the lanes have not changed,
+          None if the frame has to be detected (Optional[List[LaneCount]])
+        """
+        with self.__lock:
+            reference = self.__references.get(camera_id)
+        changes = {}
+        if reference is None:
+            reason = "no earlier detection"
+        elif abs(timestamp - reference[0]) > self.max_age:
+            reason = f"last detection is {abs(timestamp - reference[0]):.0f} s old"
+        elif any(lane.index not in reference[2] for lane in lanes):
+            reason = "lanes not counted before"
+        else:
+            changes = self.__changes(camera_id, thumbnail, reference[1], lanes)
+            if max(changes.values(), default=0.0) > self.threshold:
+                reason = "lanes changed"
+            else:
+                with self.__lock:
+                    self.skipped += 1
+                self.__log(camera_id, "unchanged, reusing counts", changes)
+                return [LaneCount(lane, reference[2][lane.index]) for lane in lanes]
+        with self.__lock:
+            self.detected += 1
+        self.__log(camera_id, f"{reason}, detecting", changes)
+        return None
+
+    def update(self, camera_id: str, timestamp: float, thumbnail, lane_counts: List[LaneCount]):
+        """
+        Stores a detected frame as the reference of the camera.
+
+        # Parameters:
+          camera_id: Camera id (str)
+          timestamp: Timestamp of the frame (float)
+          thumbnail: Thumbnail of the frame from thumbnail() (numpy.ndarray)
+          lane_counts: Counts on all lanes of the camera (List[LaneCount])
+        """
+        with self.__lock:
+            self.__references[camera_id] = (timestamp, thumbnail, {lane.index: cars for lane, cars in lane_counts})
+
+    def __log(self, camera_id, decision, changes):
+        changes = "".join(f", {lane} {change:.1f}" for lane, change in changes.items())
+        print(f"[object_detector] Motion gate for camera {camera_id}: {decision}{changes} "
+              f"- {self.skipped} skipped, {self.detected} detected", flush=True)
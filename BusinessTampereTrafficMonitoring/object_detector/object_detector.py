@@ -1,45 +1,190 @@
 import os
+import time
 from datetime import datetime
+from functools import partial
 
 import cv2
 import numpy as np
-from tf2_yolov4.anchors import YOLOV4_ANCHORS
-from tf2_yolov4.model import YOLOv4
 
-from BusinessTampereTrafficMonitoring.iot_ticket.client import client as iot_client
-from BusinessTampereTrafficMonitoring.stream_reader.stream_reader import StreamReader
-from BusinessTampereTrafficMonitoring.tools.geometry import point_inside
+from BusinessTampereTrafficMonitoring.object_detector.background import BackgroundDetector
+from BusinessTampereTrafficMonitoring.object_detector.backends import backend_from_config
+from BusinessTampereTrafficMonitoring.object_detector.consensus import AGGREGATES
+from BusinessTampereTrafficMonitoring.object_detector.consensus import consensus
+from BusinessTampereTrafficMonitoring.object_detector.detection_cache import DetectionCache
+from BusinessTampereTrafficMonitoring.object_detector.lane_index import LaneIndex
+from BusinessTampereTrafficMonitoring.object_detector.motion_gate import MotionGate
+from BusinessTampereTrafficMonitoring.object_detector.postprocessing import lower_center_from_bbox
+from BusinessTampereTrafficMonitoring.object_detector.postprocessing import to_source_boxes
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import region_of_interest
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import STRIDE
+from BusinessTampereTrafficMonitoring.object_detector.scheduler import InferenceScheduler
+from BusinessTampereTrafficMonitoring.object_detector.tracker import LaneTracker
+from BusinessTampereTrafficMonitoring.stream_reader.camera_process import CameraProcess
+from BusinessTampereTrafficMonitoring.stream_reader.factory import create_stream_reader
+from BusinessTampereTrafficMonitoring.stream_reader.supervisor import StreamHealth
+from BusinessTampereTrafficMonitoring.traffic_lights.event_bus import EventBus
 from BusinessTampereTrafficMonitoring.traffic_lights.status import Status
 
-ALLOWED_CLASSES = [1, 2, 3, 5, 7]
 
-
-def lower_center_from_bbox(bbox):
-    return (bbox[0] + bbox[2]) / 2, bbox[3]
+def camera_configs(config):
+    """
+    Returns the cameras listed in the configuration. The old single camera
+    format ("camera_url") is used for every camera id found in the lanes.
+    # Parameters:
+      config: Parsed config.json (Dict)
+    # Returns:
+      List of cameras, for example [{"camera_id": "92311e...", "url": "rtsp://..."}] (List[Dict])
+    """
+    if "cameras" in config:
+        return config["cameras"]
+    camera_ids = dict.fromkeys(lane["camera_id"] for lane in config["lanes"])
+    return [{"camera_id": camera_id, "url": config["camera_url"]} for camera_id in camera_ids]
 
 
 class ObjectDetector:
-    def __init__(self, video_location, config):
+    def __init__(self, config):
+        """
+        Opens the video streams of all configured cameras and loads the detection model.
+        Unless "camera_processes" is false in the configuration, each camera is decoded
+        in its own process and frames are shared through shared memory.
+        # Parameters:
+          config: Parsed config.json (Dict)
+        """
         self.config = config
+        self.lane_index = LaneIndex(config["lanes"])
+
+        # camera id -> stream reader
+        self.stream_readers = {}
+        reader_options = config.get("stream_reader", {})
+        for camera in camera_configs(config):
+            if config.get("camera_processes", True):
+                reader = CameraProcess(camera["url"], **reader_options)
+            else:
+                reader = create_stream_reader(camera["url"], **reader_options)
+            self.stream_readers[camera["camera_id"]] = reader
+
+        # Inference is run only on the region of the frame that covers the lanes
+        # of the camera, camera id -> Region (in frame coordinates)
+        self.rois = {}
+        padding = config.get("detector", {}).get("roi_padding", 64)
+        for camera_id, reader in self.stream_readers.items():
+            lanes = self.lane_index.lanes_for_camera(camera_id)
+            vertices = np.concatenate([lane.polygon.vertices for lane in lanes] + [np.empty((0, 2))])
+            self.rois[camera_id] = region_of_interest(
+                reader.get_transform().to_frame(vertices), reader.get_constants(), padding)
 
-        self.stream_reader = StreamReader(video_location)
+        # Regions are letterboxed into a square model input of the same size for all
+        # cameras, so one model serves every camera whatever its resolution
+        self.inference_size = config.get("detector", {}).get("inference_size", 608)
+        if self.inference_size % STRIDE != 0:
+            raise ValueError(f"Inference size has to be a multiple of {STRIDE}")
+        self.backend = backend_from_config(config.get("detector", {}), self.inference_size)
+        batch_size = config.get("detector", {}).get("batch_size", 4)
 
-        # Initializing required constants
-        self.WIDTH, self.HEIGHT = self.stream_reader.get_constants()
+        # The first inference builds and allocates everything it needs, which is
+        # done here instead of delaying the first light change
+        started = time.monotonic()
+        self.backend.load()
+        loaded = time.monotonic()
+        for warmup_batch_size in sorted({1, batch_size}):
+            self.backend.warmup(warmup_batch_size)
+        self.startup_metrics = {"model_load": loaded - started, "warmup": time.monotonic() - loaded}
+        print(f"[object_detector] Model loaded in {self.startup_metrics['model_load']:.2f} s, "
+              f"warm-up took {self.startup_metrics['warmup']:.2f} s", flush=True)
 
-        # Initializing model parameters
-        self.model = YOLOv4(
-            input_shape=(self.HEIGHT, self.WIDTH, 3),
-            anchors=YOLOV4_ANCHORS,
-            num_classes=80,
-            training=False,
-            yolo_max_boxes=50,
-            yolo_iou_threshold=0.5,
-            yolo_score_threshold=0.5,
+        # Detections of simultaneous light changes and cameras are batched together
+        self.scheduler = InferenceScheduler(
+            self.backend,
+            self.inference_size,
+            batch_size=batch_size,
+            max_wait=config.get("detector", {}).get("max_wait", 0.02),
         )
+        # Light changes within the same sampling interval get the same frame,
+        # which is only detected once. Results live as long as their frames.
+        self.detection_cache = DetectionCache(sum(reader.cache.capacity for reader in self.stream_readers.values()))
 
-        # Loading the pretrained weights to the model
-        self.model.load_weights('yolov4.h5')
+        # Counts may be combined from several frames around the light change
+        consensus_config = config.get("detector", {}).get("consensus", {})
+        self.consensus_frames = consensus_config.get("frames", 1)
+        self.consensus_aggregate = consensus_config.get("aggregate", "median")
+        if self.consensus_frames < 1:
+            raise ValueError("Consensus has to use at least one frame")
+        if self.consensus_aggregate not in AGGREGATES:
+            raise ValueError(f"Unknown consensus aggregate {self.consensus_aggregate}")
+
+        # Detections are skipped when the lanes have not changed since the last detected frame
+        self.motion_gate = None
+        motion_gate = config.get("detector", {}).get("motion_gate", {})
+        if motion_gate.get("enabled", False):
+            self.motion_gate = MotionGate(
+                self.lane_index,
+                self.rois,
+                {camera_id: reader.get_transform() for camera_id, reader in self.stream_readers.items()},
+                scale=motion_gate.get("scale", 8),
+                threshold=motion_gate.get("threshold", 6.0),
+                max_age=motion_gate.get("max_age", 60.0),
+            )
+
+        # In continuous mode new frames are detected in the background and light
+        # changes use the result of the nearest detected frame
+        self.background = None
+        background = config.get("detector", {}).get("background", {})
+        if background.get("enabled", False):
+            sample_interval = reader_options.get("sample_interval", 0.5)
+            every_nth_frame = background.get("every_nth_frame", 1)
+            self.background = BackgroundDetector(
+                self.stream_readers,
+                self.rois,
+                self.scheduler,
+                self.detection_cache,
+                interval=sample_interval / 2,
+                every_nth_frame=every_nth_frame,
+                max_load=background.get("max_load", 0.75),
+            )
+            self.background_tolerance = every_nth_frame * sample_interval
+
+        # In tracking mode every sampled frame is counted, detecting only every nth
+        # frame and tracking the vehicles in between. The counts and dwell times are
+        # published to self.events as LANE_COUNTS and DWELL_TIME. camera id -> LaneTracker
+        self.events = EventBus()
+        self.lane_trackers = {}
+        tracking = config.get("detector", {}).get("tracking", {})
+        if tracking.get("enabled", False):
+            for camera_id, reader in self.stream_readers.items():
+                self.lane_trackers[camera_id] = LaneTracker(
+                    camera_id,
+                    reader,
+                    self.rois[camera_id],
+                    self.lane_index,
+                    self.scheduler,
+                    self.detection_cache,
+                    self.inference_size,
+                    detect_every=tracking.get("detect_every", 5),
+                    interval=reader_options.get("sample_interval", 0.5) / 2,
+                    max_age=tracking.get("max_age", 3.0),
+                    iou_threshold=tracking.get("iou_threshold", 0.3),
+                    event_bus=self.events,
+                )
+
+    def stop(self):
+        """
+        Stops the stream readers, background detection, tracking and the inference scheduler.
+        """
+        if self.background is not None:
+            self.background.stop()
+        for lane_tracker in self.lane_trackers.values():
+            lane_tracker.stop()
+        for stream_reader in self.stream_readers.values():
+            stream_reader.stop()
+        self.scheduler.stop()
+
+    def stream_health(self, camera_id) -> StreamHealth:
+        """
+        Health of a video stream: CONNECTING, STREAMING, DEGRADED or DOWN.
+        # Parameters:
+          camera_id: Camera id, as in config.json (str)
+        """
+        return self.stream_readers[camera_id].health
 
     def detect_by_signal_group_and_time(self, intersection, sgroup, epoch_time, light_status):
         """
@@ -59,91 +204,208 @@ class ObjectDetector:
         if light_status == Status.GREEN:
             return
 
-        lanes = self.config["lanes"]
-        lanes = [lane for lane in lanes if sgroup in lane["signal_groups"]]
+        lanes = self.lane_index.lanes_for_signal_group(intersection, sgroup)
 
         if not lanes:
             # No lanes for this signal group are monitored
             return
 
-        frame_at_the_time = self.stream_reader.get_frame(epoch_time)
-        points, boxes = self.detect(frame_at_the_time)
-        lanes = self.process_detections(points, lanes)
-        vehicle_count = self.post_detections(lanes, epoch_time)
-
-        # TODO: put this behind a flag or something
-        self.save_image_for_debugging(frame_at_the_time, sgroup, vehicle_count, boxes, points, epoch_time)
-
-    def detect(self, frame):
-        prediction_frame = np.expand_dims(frame, axis=0) / 255.0
-        boxes, scores, classes, detections = self.model.predict(prediction_frame)
-        boxes = boxes[0] * [self.WIDTH, self.HEIGHT, self.WIDTH, self.HEIGHT]
-        scores = scores[0]
-        classes = classes[0].astype(int)
-        points = []
-        for box, score, cls in zip(boxes, scores, classes):
-            if cls in ALLOWED_CLASSES:
-                points.append(lower_center_from_bbox(box))
-        return points, boxes
-
-    @staticmethod
-    def process_detections(points, lanes):
+        # Lanes for the signal group may be seen by several cameras
+        lanes_by_camera = {}
         for lane in lanes:
-            lane["cars"] = 0
-        # Count detected cars by lane
-        # TODO: this can be optimized
-        for point in points:
-            # point_inside() expects list of tuples, but vertices
-            # that are read from json are lists
-            for lane in lanes:
-                vertices = [tuple(xy) for xy in lane["vertices"]]
-                if point_inside(point, vertices):
-                    lane["cars"] += 1
-                    break
-        return lanes
+            lanes_by_camera.setdefault(lane.camera_id, []).append(lane)
+
+        # Frames of all cameras are submitted before waiting, so they go through the model in one batch.
+        # The lanes are counted from the raw detections, which may be shared with other signal groups.
+        submitted = []
+        for camera_id, camera_lanes in lanes_by_camera.items():
+            stream_reader = self.stream_readers[camera_id]
+            if stream_reader.health == StreamHealth.DOWN:
+                # the cached frames are too old to be matched with the light change
+                print(f"[{datetime.fromtimestamp(epoch_time):%H:%M:%S}] video stream of camera {camera_id} is down, "
+                      "skipping detection")
+                continue
+
+            precomputed = None
+            if self.background is not None and self.consensus_frames == 1:
+                precomputed = self.detection_cache.nearest(camera_id, epoch_time, self.background_tolerance)
+            if precomputed is not None:
+                frame_timestamp, future = precomputed
+                window = [stream_reader.get_timestamped_frame(frame_timestamp)]
+                futures = [future]
+            else:
+                # the frames around the event, the one closest to it is in the middle
+                window = stream_reader.get_timestamped_frames(epoch_time, self.consensus_frames)
+            central = min(range(len(window)), key=lambda i: abs(window[i][0] - epoch_time))
+            frame_timestamp, frame_at_the_time = window[central]
+
+            thumbnail = None
+            if self.motion_gate is not None:
+                thumbnail = self.motion_gate.thumbnail(camera_id, frame_at_the_time)
+                if precomputed is None:
+                    lane_counts = self.motion_gate.check(camera_id, frame_timestamp, thumbnail, camera_lanes)
+                    if lane_counts is not None:
+                        self.post_detections(lane_counts, epoch_time)
+                        continue
+
+            if precomputed is None:
+                oldest = stream_reader.cache.oldest()
+                if oldest is not None:
+                    self.detection_cache.evict_before(camera_id, oldest)
+                roi = self.rois[camera_id]
+                futures = [self.detection_cache.get_or_submit(camera_id, timestamp,
+                                                              partial(self.scheduler.submit, roi.crop(frame)))
+                           for timestamp, frame in window]
+            submitted.append((camera_id, camera_lanes, central, window, thumbnail, futures))
+
+        for camera_id, camera_lanes, central, window, thumbnail, futures in submitted:
+            transform = self.stream_readers[camera_id].get_transform()
+            all_lanes = self.lane_index.lanes_for_camera(camera_id)
+            detections = [self.to_detections(future.result(), transform, self.rois[camera_id]) for future in futures]
+            result = consensus([self.process_detections(points, camera_id, all_lanes) for points, _ in detections],
+                               self.consensus_aggregate)
+            lane_counts = [lane_count for lane_count in result.lane_counts if lane_count.lane in camera_lanes]
+            spreads = result.spreads if result.frames > 1 else None
+            vehicle_count = self.post_detections(lane_counts, epoch_time, spreads)
+
+            frame_timestamp, frame_at_the_time = window[central]
+            if self.motion_gate is not None:
+                self.motion_gate.update(camera_id, frame_timestamp, thumbnail, result.lane_counts)
+
+            # TODO: put this behind a flag or something
+            points, boxes = detections[central]
+            self.save_image_for_debugging(frame_at_the_time, camera_id, transform, sgroup, vehicle_count, boxes,
+                                          points, epoch_time)
+
+    def detect(self, frame, transform, roi):
+        """
+        Detects vehicles in the region of interest of a frame.
+        # Parameters:
+          frame: Frame from a stream reader (numpy.ndarray)
+          transform: Frame coordinate transform of the stream reader (FrameTransform)
+          roi: Region of the frame to run the detection on (Region)
+        # Returns:
+          Lower center points of the vehicles and all detected boxes, in source coordinates
+          (Tuple[numpy.ndarray of shape (N, 2), numpy.ndarray of shape (M, 4)])
+        """
+        return self.to_detections(self.scheduler.predict(roi.crop(frame)), transform, roi)
+
+    def to_detections(self, prediction, transform, roi):
+        """
+        Maps the model output for a region of interest to source coordinates.
+        # Parameters:
+          prediction: Model output for the region (Prediction)
+          transform: Frame coordinate transform of the stream reader (FrameTransform)
+          roi: Region of the frame the detection was run on (Region)
+        # Returns:
+          Lower center points of the vehicles and all detected boxes, in source coordinates
+          (Tuple[numpy.ndarray of shape (N, 2), numpy.ndarray of shape (M, 4)])
+        """
+        boxes, vehicles = to_source_boxes(prediction, transform, roi, self.inference_size)
+        return lower_center_from_bbox(boxes[vehicles]), boxes
+
+    def process_detections(self, points, camera_id, lanes):
+        """
+        Counts detected cars by lane. The counts are returned instead of stored
+        anywhere, so concurrent detections do not interfere with each other.
+        # Parameters:
+          points: Lower center points of the vehicles (numpy.ndarray of shape (N, 2))
+          camera_id: Camera id, as in config.json (str)
+          lanes: Lanes to count the cars on (Iterable[Lane])
+        # Returns:
+          Number of cars per lane (List[LaneCount])
+        """
+        return self.lane_index.count(camera_id, points, lanes)
 
     @staticmethod
-    def post_detections(lanes, epoch_time):
+    def post_detections(lane_counts, epoch_time, spreads=None):
+        """
+        Sends the counts to IoT Ticket.
+        # Parameters:
+          lane_counts: Number of cars per lane (List[LaneCount])
+          epoch_time: Epoch time of the light change in seconds (float)
+          spreads: Lane id -> spread of the counts of a frame window, printed with the counts (Dict[str, int])
+        # Returns:
+          Total number of cars (int)
+        """
+        # the client connects to IoT Ticket when imported
+        from BusinessTampereTrafficMonitoring.iot_ticket.client import client as iot_client
+
         vehicle_count = 0
-        for lane in lanes:
-            lane_id = lane["lane"]
-            cars = lane["cars"]
-            device_id = lane["camera_id"]
-            print(f"[{datetime.fromtimestamp(epoch_time):%H:%M:%S}] {cars} cars detected on lane {lane_id}")
+        for lane, cars in lane_counts:
+            quality = f" (spread {spreads[lane.lane_id]})" if spreads is not None else ""
+            print(f"[{datetime.fromtimestamp(epoch_time):%H:%M:%S}] {cars} cars detected on lane {lane.lane_id}"
+                  f"{quality}")
             iot_client.post_car_count(
-                device_id=device_id,
-                lane=lane_id,
+                device_id=lane.camera_id,
+                lane=lane.lane_id,
                 count=cars,
                 timestamp=epoch_time)
             vehicle_count += cars
         return vehicle_count
 
-    def save_image_for_debugging(self, img, sgroup, vehicle_count, boxes, detections, timestamp):
+    @staticmethod
+    def post_lane_statistics(camera_id, lane_id, epoch_time, queue_length, dwell_time):
+        """
+        Sends the averages of a lane tracked in tracking mode to IoT Ticket.
+        # Parameters:
+          camera_id: Camera id, as in config.json (str)
+          lane_id: Lane id (str)
+          epoch_time: Epoch time of the end of the averaging window in seconds (float)
+          queue_length: Mean number of vehicles on the lane (float)
+          dwell_time: Mean time the vehicles spent on the lane in seconds, None if not known (float)
+        """
+        from BusinessTampereTrafficMonitoring.iot_ticket.client import client as iot_client
+
+        dwell = f", {dwell_time:.1f} s on the lane" if dwell_time is not None else ""
+        print(f"[{datetime.fromtimestamp(epoch_time):%H:%M:%S}] {queue_length:.1f} cars on average on lane "
+              f"{lane_id}{dwell}")
+        iot_client.post_lane_statistics(
+            device_id=camera_id,
+            lane=lane_id,
+            queue_length=queue_length,
+            dwell_time=dwell_time,
+            timestamp=epoch_time)
+
+    def save_image_for_debugging(self, img, camera_id, transform, sgroup, vehicle_count, boxes, detections,
+                                 timestamp):
         """
         Draws detected objects in a frame and saves the image on disk.
         # Parameters:
           img: Numpy array representing the image (numpy.ndarray)
+          camera_id: Camera id, as in config.json (str)
+          transform: Frame coordinate transform of the stream reader (FrameTransform)
           sgroup: Signal group id, for example "A" or "RV1" (str)
           vehicle_count: Number of vehicles detected (int)
           boxes: List of boxes with four coordinates (x0, y0, x1, y1) (List[float])
           points: List of detections to be drawn in the image. (List[Tuple[float, float]])
           timestamp: Epoch time in seconds (float)
         """
+        # frames from the stream reader are read-only views into its cache
+        img = img.copy()
+
         directory = os.path.abspath("./frames")
         if not os.path.exists(directory):
             os.makedirs(directory)
 
-        lanes = self.config["lanes"]
-        for lane in lanes:
-            vertices = [tuple(xy) for xy in lane["vertices"]]
+        # boxes, points and lanes are in source coordinates, the image may be cropped or scaled
+        boxes = transform.to_frame(boxes)
+        detections = transform.to_frame(detections)
+
+        for lane in self.lane_index.lanes_for_camera(camera_id):
+            vertices = [(round(x), round(y)) for x, y in transform.to_frame(lane.polygon.vertices)]
             color = (255, 0, 255)  # in BGR (not RGB)
-            if sgroup in lane["signal_groups"]:
+            if sgroup in lane.signal_groups:
                 thickness = 3
             else:
                 thickness = 1
             for start_point, end_point in zip(vertices, vertices[1:] + [vertices[0]]):
                 img = cv2.line(img, start_point, end_point, color, thickness)
 
+        roi = self.rois[camera_id]
+        color = (255, 255, 0)  # in BGR (not RGB)
+        img = cv2.rectangle(img, (roi.x0, roi.y0), (roi.x1 - 1, roi.y1 - 1), color, 1)
+
         color = (0, 255, 255)  # in BGR (not RGB)
         for x0, y0, x1, y1 in boxes:
             start_point = (round(x0), round(y0))
@@ -156,7 +418,7 @@ class ObjectDetector:
             center = (round(x), round(y))
             img = cv2.circle(img, center, radius, color, 3)
 
-        file_name = f"{datetime.fromtimestamp(timestamp):%H%M%S}-{vehicle_count}_vehicles_on_lanes.jpg"
+        file_name = f"{datetime.fromtimestamp(timestamp):%H%M%S}-{camera_id}-{vehicle_count}_vehicles_on_lanes.jpg"
         file_path = os.path.join(directory, file_name)
 
         if cv2.imwrite(file_path, img):
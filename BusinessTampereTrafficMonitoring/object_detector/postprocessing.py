@@ -0,0 +1,53 @@
+import numpy as np
+
+# COCO classes counted as vehicles: bicycle, car, motorbike, bus and truck
+ALLOWED_CLASSES = [1, 2, 3, 5, 7]
+
+
+def lower_center_from_bbox(boxes):
+    """
+    # Parameters:
+      boxes: Box (x0, y0, x1, y1) or boxes (numpy.ndarray of shape (..., 4))
+    # Returns:
+      Lower center point (x, y) of each box (numpy.ndarray of shape (..., 2))
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    return np.stack(((boxes[..., 0] + boxes[..., 2]) / 2, boxes[..., 3]), axis=-1)
+
+
+def select_detections(boxes, classes, valid_detections, allowed_classes=ALLOWED_CLASSES):
+    """
+    Drops the zero padding after the valid detections of a YOLOv4 output and
+    finds the detections of allowed classes.
+    # Parameters:
+      boxes: Boxes of one image (numpy.ndarray of shape (max_boxes, 4))
+      classes: Class of each box (numpy.ndarray of max_boxes numbers)
+      valid_detections: Number of valid boxes at the start of the arrays (int)
+      allowed_classes: Classes to keep (List[int])
+    # Returns:
+      Valid boxes and a mask of the allowed ones among them
+      (Tuple[numpy.ndarray of shape (N, 4), numpy.ndarray of N bools])
+    """
+    boxes = boxes[:valid_detections]
+    classes = np.asarray(classes[:valid_detections]).astype(np.int64)
+    return boxes, np.isin(classes, allowed_classes)
+
+
+def to_source_boxes(prediction, transform, roi, input_size):
+    """
+    Maps the boxes of a model output for a region of interest to source coordinates:
+    from the letterboxed model input to the region, from the region to the frame
+    and from the frame to the original video.
+    # Parameters:
+      prediction: Model output for the region (Prediction)
+      transform: Frame coordinate transform of the stream reader (FrameTransform)
+      roi: Region of the frame the detection was run on (Region)
+      input_size: Width and height of the model input (int)
+    # Returns:
+      Valid boxes (x0, y0, x1, y1) in source coordinates and a mask of the vehicles among them
+      (Tuple[numpy.ndarray of shape (N, 4), numpy.ndarray of N bools])
+    """
+    boxes, vehicles = select_detections(prediction.boxes, prediction.classes, prediction.valid_detections)
+    # boxes are relative to the model input
+    boxes = prediction.placement.to_image(boxes * input_size) + [roi.x0, roi.y0, roi.x0, roi.y0]
+    return transform.to_source(boxes), vehicles
@@ -0,0 +1,119 @@
+import math
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+# YOLOv4 downsamples the input by 32, so the input size has to be a multiple of it
+STRIDE = 32
+# Gray used for the letterbox borders
+PAD_VALUE = 128
+
+
+class Region(NamedTuple):
+    x0: int
+    y0: int
+    x1: int
+    y1: int
+
+    @property
+    def width(self):
+        return self.x1 - self.x0
+
+    @property
+    def height(self):
+        return self.y1 - self.y0
+
+    def crop(self, frame):
+        """
+        # Returns:
+          View of the region in the frame (numpy.ndarray)
+        """
+        return frame[self.y0:self.y1, self.x0:self.x1]
+
+
+def _expand(start, end, limit, padding):
+    """
+    Pads the range [start, end) and grows it to a multiple of STRIDE within [0, limit).
+    """
+    start = max(0, math.floor(start) - padding)
+    end = min(limit, math.ceil(end) + padding)
+    size = min(limit, math.ceil((end - start) / STRIDE) * STRIDE)
+    # grow to the right (or down) and shift back if the region would not fit
+    start = max(0, min(start, limit - size))
+    return start, start + size
+
+
+def region_of_interest(points, frame_size, padding=64) -> Region:
+    """
+    Bounding box of the points, padded and grown so that its size is a multiple
+    of STRIDE (unless the frame is smaller), clamped to the frame.
+    # Parameters:
+      points: Coordinates (x, y) in the frame, for example lane vertices (numpy.ndarray of shape (N, 2))
+      frame_size: Width and height of the frame (Tuple[int, int])
+      padding: Margin around the points in pixels (int)
+    # Returns:
+      Region of interest (Region)
+    """
+    width, height = frame_size
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) == 0:
+        return Region(0, 0, width, height)
+    x0, y0 = points.min(axis=0)
+    x1, y1 = points.max(axis=0)
+    x0, x1 = _expand(x0, x1, width, padding)
+    y0, y1 = _expand(y0, y1, height, padding)
+    return Region(x0, y0, x1, y1)
+
+
+class Letterbox(NamedTuple):
+    """
+    Placement of an image inside a letterboxed model input:
+        input_x = left + scale * image_x
+        input_y = top + scale * image_y
+    """
+    scale: float
+    left: int
+    top: int
+
+    def to_image(self, boxes):
+        """
+        Converts boxes (x0, y0, x1, y1) in model input pixels to image pixels.
+        """
+        offset = (self.left, self.top, self.left, self.top)
+        return (np.asarray(boxes, dtype=np.float64) - offset) / self.scale
+
+
+def letterbox(image, out) -> Letterbox:
+    """
+    Resizes an image to fit the output buffer while preserving its aspect ratio
+    and fills the remaining area with gray.
+    # Parameters:
+      image: Image to resize (numpy.ndarray of shape (H, W, 3))
+      out: Preallocated square model input (numpy.ndarray of shape (S, S, 3))
+    # Returns:
+      Placement of the image in the output (Letterbox)
+    """
+    height, width = image.shape[:2]
+    size = out.shape[0]
+    scale = min(size / width, size / height)
+    new_width, new_height = round(width * scale), round(height * scale)
+    left, top = (size - new_width) // 2, (size - new_height) // 2
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    out[:] = PAD_VALUE
+    out[top:top + new_height, left:left + new_width] = cv2.resize(image, (new_width, new_height),
+                                                                  interpolation=interpolation)
+    return Letterbox(scale, left, top)
+
+
+def normalize(image, out):
+    """
+    Scales a uint8 image to [0, 1] into a preallocated float32 buffer,
+    without allocating any intermediate arrays.
+    # Parameters:
+      image: Model input image (numpy.ndarray of uint8)
+      out: Buffer of the same shape (numpy.ndarray of float32)
+    # Returns:
+      The output buffer (numpy.ndarray)
+    """
+    return np.multiply(image, np.float32(1 / 255), out=out, casting="unsafe")
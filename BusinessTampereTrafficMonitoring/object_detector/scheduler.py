@@ -0,0 +1,144 @@
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import NamedTuple
+
+import numpy as np
+
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import Letterbox
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import letterbox
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import normalize
+
+# Lower values are detected first
+PRIORITY_EVENT = 0
+PRIORITY_BACKGROUND = 1
+# Queued before any image
+_STOP = -1
+
+
+class Prediction(NamedTuple):
+    placement: Letterbox
+    boxes: np.ndarray
+    scores: np.ndarray
+    classes: np.ndarray
+    valid_detections: int
+
+
+class InferenceScheduler:
+    def __init__(self, backend, input_size: int, batch_size: int = 4, max_wait: float = 0.02):
+        """
+        Runs the detector backend in a single worker thread. Images submitted within max_wait
+        of each other, from any thread or camera, are letterboxed into one batch
+        and go through the model in one forward pass.
+
+        # Parameters:
+          backend: Loaded YOLOv4 model with a square input (DetectorBackend)
+          input_size: Width and height of the model input (int)
+          batch_size: Maximum number of images in one forward pass (int)
+          max_wait: Time to wait for more images after the first one in seconds (float)
+        """
+        if batch_size < 1:
+            raise ValueError("Batch size has to be at least one")
+        if max_wait < 0:
+            raise ValueError("Maximum wait can not be negative")
+        self.backend = backend
+        self.input_size = input_size
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        # Model inputs are written into the same buffers on every batch
+        self.images = np.empty((batch_size, input_size, input_size, 3), dtype=np.uint8)
+        self.batch = np.empty((batch_size, input_size, input_size, 3), dtype=np.float32)
+        self.__queue = queue.PriorityQueue()
+        # ties are broken by submission order, images themselves are never compared
+        self.__order = itertools.count()
+        self.__stopped = False
+        self.__worker = threading.Thread(target=self.__run, daemon=True)
+        self.__worker.start()
+
+    def submit(self, image, priority: int = PRIORITY_EVENT) -> Future:
+        """
+        Queues an image for detection. The image is read by the worker thread,
+        so it must not be modified until the future is done. Images with a
+        lower priority value are detected first.
+
+        # Parameters:
+          image: Image of any size (numpy.ndarray of shape (H, W, 3))
+          priority: PRIORITY_EVENT or PRIORITY_BACKGROUND (int)
+        # Returns:
+          Future of the model output for the image (concurrent.futures.Future[Prediction])
+        """
+        if self.__stopped:
+            raise RuntimeError("Inference scheduler has been stopped")
+        future = Future()
+        self.__queue.put((priority, next(self.__order), image, future))
+        return future
+
+    def predict(self, image) -> Prediction:
+        """
+        Blocking version of submit().
+        """
+        return self.submit(image).result()
+
+    def stop(self):
+        """
+        Stops the worker thread after the current batch. Images still waiting are cancelled.
+        """
+        self.__stopped = True
+        self.__queue.put((_STOP, next(self.__order), None, None))
+        self.__worker.join()
+
+    def __collect(self):
+        """
+        Waits for the first image and then up to max_wait for more.
+        # Returns:
+          Queued items (List[Tuple[numpy.ndarray, Future]]) or None when stopped
+        """
+        item = self.__queue.get()
+        if item[0] == _STOP:
+            return None
+        items = [item[2:]]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.batch_size:
+            try:
+                item = self.__queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item[0] == _STOP:
+                # finish the batch, stop on the next round
+                self.__queue.put(item)
+                break
+            items.append(item[2:])
+        return items
+
+    def __run(self):
+        while True:
+            items = self.__collect()
+            if items is None:
+                break
+            items = [(image, future) for image, future in items if future.set_running_or_notify_cancel()]
+            if not items:
+                continue
+            try:
+                placements = []
+                for i, (image, _) in enumerate(items):
+                    placements.append(letterbox(image, self.images[i]))
+                    normalize(self.images[i], self.batch[i])
+                boxes, scores, classes, detections = self.backend.infer(self.batch[:len(items)])
+            except Exception as err:
+                for _, future in items:
+                    future.set_exception(err)
+                continue
+            boxes, scores, classes, detections = (np.asarray(output) for output in (boxes, scores, classes, detections))
+            for i, (_, future) in enumerate(items):
+                future.set_result(Prediction(placements[i], boxes[i], scores[i], classes[i], int(detections[i])))
+
+        # cancel the images submitted after stop()
+        while True:
+            try:
+                item = self.__queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[0] != _STOP:
+                item[3].cancel()
@@ -0,0 +1,353 @@
+import threading
+from collections import deque
+from functools import partial
+from typing import NamedTuple
+
+import numpy as np
+
+from BusinessTampereTrafficMonitoring.object_detector.postprocessing import lower_center_from_bbox
+from BusinessTampereTrafficMonitoring.object_detector.postprocessing import to_source_boxes
+from BusinessTampereTrafficMonitoring.object_detector.scheduler import PRIORITY_BACKGROUND
+from BusinessTampereTrafficMonitoring.traffic_lights.event_bus import EventBus
+
+# Topics published by LaneTracker:
+# camera id (str), frame timestamp (float) and the number of vehicles on each lane of the camera (Dict[str, int])
+LANE_COUNTS = "lane_counts"
+# camera id (str) and the time a vehicle spent on a lane (DwellTime)
+DWELL_TIME = "dwell_time"
+
+# Kalman filter of SORT (Bewley et al. 2016): the state is the box center (u, v),
+# area s and aspect ratio r, plus the velocities of u, v and s. Noise is given per
+# second, the filter is advanced by the time between frames.
+_STATE_NOISE = np.diag([10.0, 10.0, 10.0, 10.0, 1e4, 1e4, 1e4])
+_PROCESS_NOISE = np.diag([1.0, 1.0, 1.0, 1.0, 0.01, 0.01, 0.0001])
+_MEASUREMENT_NOISE = np.diag([1.0, 1.0, 10.0, 10.0])
+_MEASUREMENT = np.eye(4, 7)
+
+
+def iou(boxes_a, boxes_b) -> np.ndarray:
+    """
+    # Parameters:
+      boxes_a: Boxes (x0, y0, x1, y1) (numpy.ndarray of shape (N, 4))
+      boxes_b: Boxes (x0, y0, x1, y1) (numpy.ndarray of shape (M, 4))
+    # Returns:
+      Intersection over union of every pair of boxes (numpy.ndarray of shape (N, M))
+    """
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(1, -1, 4)
+    width = (np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0])).clip(0)
+    height = (np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1])).clip(0)
+    intersection = width * height
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union = area_a + area_b - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def greedy_match(scores, threshold):
+    """
+    Pairs rows and columns in decreasing order of score.
+    # Parameters:
+      scores: Score of every pair (numpy.ndarray of shape (N, M))
+      threshold: Minimum score of a pair (float)
+    # Returns:
+      Row and column indices of the pairs (Tuple[numpy.ndarray, numpy.ndarray])
+    """
+    rows, columns = [], []
+    used_rows, used_columns = set(), set()
+    for flat in np.argsort(scores, axis=None)[::-1]:
+        row, column = np.unravel_index(flat, scores.shape)
+        if scores[row, column] < threshold:
+            break
+        if row in used_rows or column in used_columns:
+            continue
+        used_rows.add(row)
+        used_columns.add(column)
+        rows.append(row)
+        columns.append(column)
+    return np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64)
+
+
+def _to_measurement(boxes):
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    width = boxes[:, 2] - boxes[:, 0]
+    height = boxes[:, 3] - boxes[:, 1]
+    return np.column_stack(((boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2,
+                            width * height, width / np.maximum(height, 1e-6)))
+
+
+def _to_boxes(states):
+    width = np.sqrt(np.maximum(states[:, 2] * states[:, 3], 0))
+    height = states[:, 2] / np.maximum(width, 1e-6)
+    return np.column_stack((states[:, 0] - width / 2, states[:, 1] - height / 2,
+                            states[:, 0] + width / 2, states[:, 1] + height / 2))
+
+
+class Tracks(NamedTuple):
+    ids: np.ndarray
+    boxes: np.ndarray
+
+
+class Tracker:
+    def __init__(self, max_age=3.0, iou_threshold=0.3):
+        """
+        SORT style multiple object tracker: a constant velocity Kalman filter per
+        box and greedy IoU matching, computed for all tracks at once with NumPy.
+
+        # Parameters:
+          max_age: Time a track is kept without matching detections in seconds (float)
+          iou_threshold: Minimum IoU between a predicted box and a detection (float)
+        """
+        self.max_age = max_age
+        self.iou_threshold = iou_threshold
+        self.ids = np.empty(0, dtype=np.int64)
+        self.states = np.empty((0, 7))
+        self.covariances = np.empty((0, 7, 7))
+        self.last_update = np.empty(0)
+        self.timestamp = None
+        self.__next_id = 0
+
+    def __predict(self, timestamp):
+        dt = 0.0 if self.timestamp is None else max(0.0, timestamp - self.timestamp)
+        self.timestamp = timestamp
+        transition = np.eye(7)
+        transition[[0, 1, 2], [4, 5, 6]] = dt
+        # the area can not become negative
+        shrinking = self.states[:, 2] + dt * self.states[:, 6] <= 0
+        self.states[shrinking, 6] = 0
+        self.states = self.states @ transition.T
+        self.covariances = transition @ self.covariances @ transition.T + _PROCESS_NOISE * max(dt, 1e-3)
+
+    def __prune(self, timestamp):
+        alive = timestamp - self.last_update <= self.max_age
+        self.ids, self.states, self.covariances, self.last_update = (
+            self.ids[alive], self.states[alive], self.covariances[alive], self.last_update[alive])
+
+    def tracks(self) -> Tracks:
+        return Tracks(self.ids.copy(), _to_boxes(self.states))
+
+    def predict(self, timestamp: float) -> Tracks:
+        """
+        Moves the tracks to a frame without detections.
+        # Parameters:
+          timestamp: Timestamp of the frame (float)
+        # Returns:
+          Tracks at the time of the frame (Tracks)
+        """
+        self.__predict(timestamp)
+        self.__prune(timestamp)
+        return self.tracks()
+
+    def update(self, timestamp: float, boxes) -> Tracks:
+        """
+        Moves the tracks to a frame and corrects them with the detections of the frame.
+        Unmatched detections start new tracks.
+        # Parameters:
+          timestamp: Timestamp of the frame (float)
+          boxes: Detected boxes (x0, y0, x1, y1) (numpy.ndarray of shape (N, 4))
+        # Returns:
+          Tracks at the time of the frame (Tracks)
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.__predict(timestamp)
+        tracked, detected = greedy_match(iou(_to_boxes(self.states), boxes), self.iou_threshold)
+
+        # Kalman update of the matched tracks
+        if len(tracked):
+            measurements = _to_measurement(boxes[detected])
+            covariances = self.covariances[tracked]
+            innovation = measurements - self.states[tracked] @ _MEASUREMENT.T
+            innovation_covariance = _MEASUREMENT @ covariances @ _MEASUREMENT.T + _MEASUREMENT_NOISE
+            gain = covariances @ _MEASUREMENT.T @ np.linalg.inv(innovation_covariance)
+            self.states[tracked] += (gain @ innovation[:, :, None])[:, :, 0]
+            self.covariances[tracked] = (np.eye(7) - gain @ _MEASUREMENT) @ covariances
+            self.last_update[tracked] = timestamp
+
+        # new tracks for the unmatched detections
+        new = np.setdiff1d(np.arange(len(boxes)), detected)
+        states = np.zeros((len(new), 7))
+        states[:, :4] = _to_measurement(boxes[new])
+        self.ids = np.concatenate((self.ids, np.arange(self.__next_id, self.__next_id + len(new))))
+        self.__next_id += len(new)
+        self.states = np.concatenate((self.states, states))
+        self.covariances = np.concatenate((self.covariances, np.broadcast_to(_STATE_NOISE, (len(new), 7, 7))))
+        self.last_update = np.concatenate((self.last_update, np.full(len(new), timestamp)))
+
+        self.__prune(timestamp)
+        return self.tracks()
+
+
+class DwellTime(NamedTuple):
+    track_id: int
+    lane_id: str
+    start: float
+    end: float
+
+
+class LaneTracker:
+    def __init__(self, camera_id, stream_reader, roi, lane_index, scheduler, detection_cache, input_size,
+                 detect_every=5, interval=0.5, max_age=3.0, iou_threshold=0.3, history=10000, event_bus=None):
+        """
+        Per-lane vehicle counts for every sampled frame of a camera. The model is
+        run on every detect_every-th frame and the boxes of the vehicles are tracked in between.
+
+        The counts of each frame are published to the event bus (self.events) as
+        LANE_COUNTS and the time each track spent on a lane as DWELL_TIME. The last
+        `history` of them are also kept in `counts` as (timestamp, {lane id: cars})
+        and in `dwell_times`.
+
+        # Parameters:
+          camera_id: Camera id (str)
+          stream_reader: Stream reader of the camera (StreamReader)
+          roi: Region of interest of the camera (Region)
+          lane_index: Lanes of all cameras (LaneIndex)
+          scheduler: Inference scheduler (InferenceScheduler)
+          detection_cache: Cache of detection results (DetectionCache)
+          input_size: Width and height of the model input (int)
+          detect_every: Run the model on every nth sampled frame (int)
+          interval: Time between checks for new frames in seconds (float)
+          max_age: Time a track is kept without matching detections in seconds (float)
+          iou_threshold: Minimum IoU between a tracked box and a detection (float)
+          history: Number of counts and dwell times kept (int)
+          event_bus: Bus the counts and dwell times are published to, None for a new one (EventBus)
+        """
+        if detect_every < 1:
+            raise ValueError("detect_every has to be at least one")
+        self.camera_id = camera_id
+        self.stream_reader = stream_reader
+        self.roi = roi
+        self.lane_index = lane_index
+        self.lanes = lane_index.lanes_for_camera(camera_id)
+        self.scheduler = scheduler
+        self.detection_cache = detection_cache
+        self.input_size = input_size
+        self.detect_every = detect_every
+        self.interval = interval
+        self.tracker = Tracker(max_age, iou_threshold)
+        self.counts = deque(maxlen=history)
+        self.dwell_times = deque(maxlen=history)
+        self.events = event_bus if event_bus is not None else EventBus()
+        self.frames = 0
+        self.detections = 0
+        # track id -> (lane index, time the track was first seen on the lane, time last seen)
+        self.__on_lane = {}
+        self.__last_timestamp = None
+        self.__stopped = threading.Event()
+
+    def step(self):
+        """
+        Counts the vehicles on every frame cached since the previous step, oldest first.
+        # Returns:
+          Whether or not there were new frames (bool)
+        """
+        try:
+            frames = self.stream_reader.get_timestamped_frames_since(self.__last_timestamp)
+        except LookupError:
+            # the frame cache of a camera process is not available
+            return False
+        for timestamp, frame in frames:
+            self.__step(timestamp, frame)
+            self.__last_timestamp = timestamp
+        return len(frames) > 0
+
+    def __step(self, timestamp, frame):
+        if self.frames % self.detect_every == 0:
+            future = self.detection_cache.get_or_submit(
+                self.camera_id, timestamp, partial(self.scheduler.submit, self.roi.crop(frame), PRIORITY_BACKGROUND))
+            boxes, vehicles = to_source_boxes(future.result(), self.stream_reader.get_transform(), self.roi,
+                                              self.input_size)
+            tracks = self.tracker.update(timestamp, boxes[vehicles])
+            self.detections += 1
+        else:
+            tracks = self.tracker.predict(timestamp)
+        self.frames += 1
+        self.__count(timestamp, tracks)
+
+    def __count(self, timestamp, tracks):
+        lanes = self.lane_index.lookup(self.camera_id, lower_center_from_bbox(tracks.boxes))
+        counts = np.bincount(lanes[lanes >= 0], minlength=len(self.lane_index.lanes))
+        lane_counts = {lane.lane_id: int(counts[lane.index]) for lane in self.lanes}
+        self.counts.append((timestamp, lane_counts))
+        self.events.publish(LANE_COUNTS, self.camera_id, timestamp, lane_counts)
+
+        on_lane = {}
+        for track_id, lane in zip(tracks.ids.tolist(), lanes.tolist()):
+            if lane < 0:
+                continue
+            previous = self.__on_lane.get(track_id)
+            start = previous[1] if previous is not None and previous[0] == lane else timestamp
+            on_lane[track_id] = (lane, start, timestamp)
+        # tracks that left their lane or were lost
+        for track_id, (lane, start, end) in self.__on_lane.items():
+            if on_lane.get(track_id, (None,))[0] != lane:
+                dwell_time = DwellTime(track_id, self.lane_index.lanes[lane].lane_id, start, end)
+                self.dwell_times.append(dwell_time)
+                self.events.publish(DWELL_TIME, self.camera_id, dwell_time)
+        self.__on_lane = on_lane
+
+    def run(self):
+        """
+        Counts new frames until stop() is called.
+        It is intended to be called in a new thread.
+        """
+        while not self.__stopped.wait(self.interval):
+            try:
+                self.step()
+            except RuntimeError as err:
+                # the scheduler has been stopped
+                print(f"[object_detector] Tracking of camera {self.camera_id} stopped: {err}", flush=True)
+                return
+
+    def stop(self):
+        self.__stopped.set()
+
+
+class LaneStatistics:
+    def __init__(self, post, window=60.0):
+        """
+        Averages the LANE_COUNTS and DWELL_TIME events of the lane trackers over windows
+        of frame time. At the end of each window of a camera, post is called for every
+        lane of the camera with the mean number of vehicles on the lane and the mean time
+        the vehicles that left the lane during the window spent on it.
+
+        # Parameters:
+          post: Called with the camera id, lane id, end of the window, mean number of vehicles
+                and mean dwell time in seconds, None if no vehicle left the lane (Callable)
+          window: Length of a window in seconds (float)
+        """
+        if window <= 0:
+            raise ValueError("Window has to be greater than zero")
+        self.post = post
+        self.window = window
+        # camera id -> start of the window, number of frames, lane id -> sum of the counts
+        # and lane id -> dwell times
+        self.__windows = {}
+        self.__lock = threading.Lock()
+
+    def add_counts(self, camera_id, timestamp, counts):
+        """
+        Subscriber of LANE_COUNTS.
+        """
+        closed = None
+        with self.__lock:
+            start, frames, sums, dwell_times = self.__windows.get(camera_id, (timestamp, 0, {}, {}))
+            if frames and timestamp - start >= self.window:
+                closed = [(camera_id, lane_id, timestamp, cars / frames,
+                           float(np.mean(dwell_times[lane_id])) if lane_id in dwell_times else None)
+                          for lane_id, cars in sums.items()]
+                start, frames, sums, dwell_times = timestamp, 0, {}, {}
+            for lane_id, cars in counts.items():
+                sums[lane_id] = sums.get(lane_id, 0) + cars
+            self.__windows[camera_id] = (start, frames + 1, sums, dwell_times)
+        # posting may take a while, the other cameras are not blocked
+        for statistics in closed or ():
+            self.post(*statistics)
+
+    def add_dwell_time(self, camera_id, dwell_time: DwellTime):
+        """
+        Subscriber of DWELL_TIME.
+        """
+        with self.__lock:
+            if camera_id in self.__windows:
+                dwell_times = self.__windows[camera_id][3]
+                dwell_times.setdefault(dwell_time.lane_id, []).append(dwell_time.end - dwell_time.start)
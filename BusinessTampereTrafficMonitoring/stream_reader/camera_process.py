@@ -0,0 +1,196 @@
+import multiprocessing
+import threading
+import time
+from multiprocessing import shared_memory
+
+from .factory import create_stream_reader
+from .frame_cache import FrameCache
+from .log import logger
+from .stream_reader import FrameTransform
+from .supervisor import StreamHealth
+
+HEALTH_CODES = list(StreamHealth)
+
+
+def attach_shared_memory(name: str):
+    """
+    Attaches to a shared memory block created by the parent process.
+    The parent process is responsible for removing the block.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 always registers the block to the resource tracker, which is
+        # shared with the parent process, so the registration is cleared when the
+        # parent process removes the block
+        return shared_memory.SharedMemory(name=name)
+
+
+def run_camera(video_location, options, lock, connection, health, stopped):
+    """
+    Entry point of a camera process. Reads the stream into a frame cache that
+    lives in shared memory until stopped is set. The shared memory is created
+    by the parent process once the size of the frames is known.
+
+    # Parameters:
+      video_location: URL or path of the video stream (str)
+      options: Keyword arguments for create_stream_reader() (Dict)
+      lock: Lock shared with the reading process (multiprocessing.Lock)
+      connection: Pipe for exchanging the cache description with the parent process (multiprocessing.Connection)
+      health: Index of the current StreamHealth in HEALTH_CODES (multiprocessing.Value)
+      stopped: Set by the parent process to stop the camera (multiprocessing.Event)
+    """
+    try:
+        reader = create_stream_reader(video_location, **options)
+    except (IOError, ValueError, TypeError) as err:
+        connection.send(("error", str(err)))
+        return
+
+    capacity = reader.cache.capacity
+    shape = reader.cache.frames.shape[1:]
+    connection.send(("ok", capacity, shape, reader.get_constants(), tuple(reader.get_transform())))
+    try:
+        name = connection.recv()
+    except EOFError:
+        # the parent process gave up
+        return
+    # the reader writes directly into shared memory, which is unmapped when this process exits
+    shm = attach_shared_memory(name)
+    reader.cache = FrameCache(capacity, shape, buffers=FrameCache.allocate(capacity, shape, buffer=shm.buf), lock=lock)
+
+    reading = threading.Thread(target=reader.read_stream, daemon=True)
+    reading.start()
+    while not stopped.wait(0.5):
+        health.value = HEALTH_CODES.index(reader.health)
+    reader.stop()
+    reading.join(timeout=10)
+
+
+class CameraProcess:
+    def __init__(self, video_location, startup_timeout=60.0, lock_timeout=1.0, **options):
+        """
+        Runs a stream reader in a separate process. Frames are published into a
+        frame cache in shared memory and read from there without copying.
+        The shared memory is owned by this process and removed by stop(), so it
+        does not outlive a camera process that is terminated.
+
+        Has the same interface as StreamReader.
+
+        # Parameters:
+          video_location: URL or path of the video stream (str)
+          startup_timeout: Maximum time to wait for the stream to open in seconds (float)
+          lock_timeout: Maximum time to wait for the cache lock in seconds, a camera process
+                        killed while holding the lock makes the reads raise LookupError (float)
+          options: Keyword arguments for create_stream_reader()
+        """
+        context = multiprocessing.get_context("spawn")
+        self.video_location = video_location
+        self.__lock = context.Lock()
+        self.__health = context.Value("i", HEALTH_CODES.index(StreamHealth.CONNECTING), lock=False)
+        self.__stopped = context.Event()
+        connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=run_camera,
+            args=(video_location, options, self.__lock, child_connection, self.__health, self.__stopped),
+            daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+
+        try:
+            if not connection.poll(startup_timeout):
+                raise EOFError("timed out")
+            message = connection.recv()
+        except EOFError as err:
+            self.process.terminate()
+            logger.error(f"Camera process did not start: {err}")
+            raise IOError("Couldnt open stream") from err
+        if message[0] != "ok":
+            self.process.join()
+            logger.error(f"Camera process failed: {message[1]}")
+            raise IOError(message[1])
+
+        _, capacity, shape, (self.WIDTH, self.HEIGHT), transform = message
+        self.transform = FrameTransform(*transform)
+        self.__shm = shared_memory.SharedMemory(create=True, size=FrameCache.nbytes(capacity, shape))
+        self.cache = FrameCache(capacity, shape, buffers=FrameCache.allocate(capacity, shape, buffer=self.__shm.buf),
+                                lock=self.__lock, lock_timeout=lock_timeout)
+        connection.send(self.__shm.name)
+        connection.close()
+
+    @property
+    def health(self) -> StreamHealth:
+        if not self.process.is_alive():
+            return StreamHealth.DOWN
+        return HEALTH_CODES[self.__health.value]
+
+    def get_constants(self):
+        return self.WIDTH, self.HEIGHT
+
+    def get_transform(self):
+        return self.transform
+
+    def get_frame(self, epoch_time=None):
+        """
+        Returns the cached frame closest to epoch_time (defaults to now).
+        The frame is a read-only view into shared memory, copy it before modifying.
+        """
+        return self.get_timestamped_frame(epoch_time)[1]
+
+    def get_timestamped_frame(self, epoch_time=None):
+        """
+        Returns the cached frame closest to epoch_time (defaults to now).
+        The frame is a read-only view into shared memory, copy it before modifying.
+        # Returns:
+          Timestamp of the frame and the frame (Tuple[float, numpy.ndarray])
+        """
+        if epoch_time is None:
+            epoch_time = time.time()
+        return self.cache.get(epoch_time)
+
+    def get_timestamped_frames(self, epoch_time=None, count=1):
+        """
+        Returns count consecutive cached frames centered on the frame closest to epoch_time.
+        The frames are read-only views into shared memory, copy them before modifying.
+        # Returns:
+          Timestamps of the frames and the frames, oldest first (List[Tuple[float, numpy.ndarray]])
+        """
+        if epoch_time is None:
+            epoch_time = time.time()
+        return self.cache.window(epoch_time, count)
+
+    def get_timestamped_frames_since(self, epoch_time=None):
+        """
+        Returns the cached frames newer than epoch_time, all of them if it is None.
+        The frames are read-only views into shared memory, copy them before modifying.
+        # Returns:
+          Timestamps of the frames and the frames, oldest first (List[Tuple[float, numpy.ndarray]])
+        """
+        return self.cache.since(epoch_time)
+
+    def read_stream(self):
+        """
+        The stream is read by the camera process, this waits until the process exits.
+        """
+        self.process.join()
+
+    def stop(self):
+        """
+        Stops the camera process.
+        """
+        self.__stopped.set()
+        self.process.join(timeout=15)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=5)
+        if self.__shm is None:
+            return
+        # the frames are gone, readers get an empty cache from now on
+        self.cache = FrameCache(1, self.cache.frames.shape[1:])
+        try:
+            self.__shm.close()
+        except BufferError:
+            # frames are still referenced by a reader, the block is unmapped when they are released
+            pass
+        self.__shm.unlink()
+        self.__shm = None
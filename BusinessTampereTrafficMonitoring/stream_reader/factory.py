@@ -0,0 +1,22 @@
+from .ffmpeg_reader import FFmpegStreamReader
+from .stream_reader import StreamReader
+
+BACKENDS = {
+    "opencv": StreamReader,
+    "ffmpeg": FFmpegStreamReader,
+}
+
+
+def create_stream_reader(video_location, backend="opencv", **options):
+    """
+    Creates a stream reader using the selected decoding backend.
+    # Parameters:
+      video_location: URL or path of the video stream (str)
+      backend: Either "opencv" (StreamReader) or "ffmpeg" (FFmpegStreamReader) (str)
+      options: Keyword arguments for the reader class
+    # Returns:
+      StreamReader or FFmpegStreamReader
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown stream reader backend: '{backend}'")
+    return BACKENDS[backend](video_location, **options)
@@ -0,0 +1,201 @@
+import re
+import subprocess
+import time
+
+from .frame_cache import FrameCache
+from .log import logger
+from .stream_reader import FrameTransform
+from .supervisor import Backoff
+from .supervisor import StreamHealth
+from .supervisor import StreamSupervisor
+
+
+class FFmpegStreamReader:
+    def __init__(self, video_location, cache_size=200, sample_interval=0.5, crop=None, scale=None,
+                 ffmpeg="ffmpeg", stall_timeout=5.0, reconnect_delay=1.0, max_reconnect_delay=60.0, down_after=30.0,
+                 buffer_size=None):
+        """
+        Reads a video stream through an ffmpeg subprocess. Frame rate reduction,
+        cropping and scaling are done by ffmpeg filters, so only the frames that
+        are going to be cached are decoded into Python.
+
+        Has the same interface as StreamReader.
+
+        # Parameters:
+          video_location: URL or path of the video stream (str)
+          cache_size: Number of frames kept in the cache (int)
+          sample_interval: Time between cached frames in seconds (float)
+          crop: Area of the video to keep as [width, height, x, y] in source
+                coordinates, None keeps the whole frame (List[int])
+          scale: Output frame size as [width, height], either one may be -1 to
+                 preserve the aspect ratio, None keeps the size (List[int])
+          ffmpeg: Path of the ffmpeg executable (str)
+          stall_timeout: Seconds without data before ffmpeg gives up on an RTSP stream (float)
+          reconnect_delay: Initial delay between reconnection attempts in seconds (float)
+          max_reconnect_delay: Maximum delay between reconnection attempts in seconds (float)
+          down_after: Seconds without frames before the stream health is DOWN (float)
+          buffer_size: Ignored, frames are read from ffmpeg straight into the cache. Accepted so that
+                       the stream_reader options of config.json work with both backends (int)
+        """
+        if sample_interval <= 0:
+            raise ValueError("Sampling interval has to be greater than zero")
+        self.video_location = video_location
+        self.sample_interval = sample_interval
+        self.ffmpeg = ffmpeg
+        self.stall_timeout = stall_timeout
+        self.process = None
+
+        source_width, source_height = self.probe_size(ffmpeg, video_location)
+        crop_width, crop_height, crop_x, crop_y = crop or (source_width, source_height, 0, 0)
+        width, height = scale or (crop_width, crop_height)
+        if width <= 0 and height <= 0:
+            raise ValueError("Only one of the scaled dimensions can be -1")
+        if width <= 0:
+            width = 2 * round(crop_width * height / crop_height / 2)
+        if height <= 0:
+            height = 2 * round(crop_height * width / crop_width / 2)
+        self.WIDTH, self.HEIGHT = width, height
+
+        self.filters = [f"fps=fps={1 / sample_interval}"]
+        if crop is not None:
+            self.filters.append(f"crop={crop_width}:{crop_height}:{crop_x}:{crop_y}")
+        if (width, height) != (crop_width, crop_height):
+            self.filters.append(f"scale={width}:{height}")
+        self.transform = FrameTransform(crop_x, crop_y, crop_width / width, crop_height / height)
+
+        self.cache = FrameCache(cache_size, (self.HEIGHT, self.WIDTH, 3))
+
+        self.supervisor = StreamSupervisor(
+            connect=self.connect,
+            disconnect=self.disconnect,
+            workers=[self.read_pipe_to_cache],
+            interrupt=self.disconnect,
+            backoff=Backoff(reconnect_delay, max_reconnect_delay),
+            down_after=down_after,
+        )
+
+    @staticmethod
+    def probe_size(ffmpeg, video_location):
+        """
+        Reads the resolution of the first video stream from ffmpeg's input description.
+        # Returns:
+          Width and height of the video (Tuple[int, int])
+        """
+        try:
+            result = subprocess.run([ffmpeg, "-hide_banner", "-nostdin", "-i", video_location],  # nosec
+                                    capture_output=True, text=True, timeout=30)
+        except (OSError, subprocess.TimeoutExpired) as err:
+            logger.error(f"Couldnt probe stream: {err}")
+            raise IOError("Couldnt open stream") from err
+        match = re.search(r"Video:.*?, (\d+)x(\d+)", result.stderr)
+        if match is None:
+            logger.error('Couldnt open stream')
+            raise IOError('Couldnt open stream')
+        return int(match.group(1)), int(match.group(2))
+
+    @property
+    def health(self) -> StreamHealth:
+        return self.supervisor.health
+
+    def get_constants(self):
+        return self.WIDTH, self.HEIGHT
+
+    def get_transform(self):
+        """
+        Maps frame coordinates back to the coordinates of the uncropped, unscaled video.
+        """
+        return self.transform
+
+    def get_frame(self, epoch_time=None):
+        """
+        Returns the cached frame closest to epoch_time (defaults to now).
+        The frame is a read-only view into the cache, copy it before modifying.
+        """
+        return self.get_timestamped_frame(epoch_time)[1]
+
+    def get_timestamped_frame(self, epoch_time=None):
+        """
+        Returns the cached frame closest to epoch_time (defaults to now).
+        The frame is a read-only view into the cache, copy it before modifying.
+        # Returns:
+          Timestamp of the frame and the frame (Tuple[float, numpy.ndarray])
+        """
+        if epoch_time is None:
+            epoch_time = time.time()
+        return self.cache.get(epoch_time)
+
+    def get_timestamped_frames(self, epoch_time=None, count=1):
+        """
+        Returns count consecutive cached frames centered on the frame closest to epoch_time.
+        The frames are read-only views into the cache, copy them before modifying.
+        # Returns:
+          Timestamps of the frames and the frames, oldest first (List[Tuple[float, numpy.ndarray]])
+        """
+        if epoch_time is None:
+            epoch_time = time.time()
+        return self.cache.window(epoch_time, count)
+
+    def get_timestamped_frames_since(self, epoch_time=None):
+        """
+        Returns the cached frames newer than epoch_time, all of them if it is None.
+        The frames are read-only views into the cache, copy them before modifying.
+        # Returns:
+          Timestamps of the frames and the frames, oldest first (List[Tuple[float, numpy.ndarray]])
+        """
+        return self.cache.since(epoch_time)
+
+    def command(self):
+        """
+        # Returns:
+          Command line for the ffmpeg decoding process (List[str])
+        """
+        cmd = [self.ffmpeg, "-hide_banner", "-nostdin", "-loglevel", "error"]
+        if self.video_location.startswith("rtsp://"):
+            cmd += ["-rtsp_transport", "tcp", "-timeout", str(int(self.stall_timeout * 1e6))]
+        cmd += ["-i", self.video_location, "-an", "-vf", ",".join(self.filters),
+                "-pix_fmt", "bgr24", "-f", "rawvideo", "pipe:1"]
+        return cmd
+
+    def connect(self):
+        """
+        Starts the ffmpeg process.
+        """
+        try:
+            self.process = subprocess.Popen(self.command(), stdout=subprocess.PIPE)  # nosec
+        except OSError as err:
+            raise IOError(f"Couldnt start ffmpeg: {err}") from err
+
+    def disconnect(self):
+        """
+        Stops the ffmpeg process.
+        """
+        process = self.process
+        if process is not None and process.poll() is None:
+            process.kill()
+            process.wait()
+
+    def read_pipe_to_cache(self, restart):
+        """
+        Reads frames from ffmpeg directly into the cache until ffmpeg exits or restart is set.
+        """
+        while not restart.is_set():
+            frame = memoryview(self.cache.reserve()).cast("B")
+            received = 0
+            while received < len(frame):
+                n = self.process.stdout.readinto(frame[received:])
+                if not n:
+                    logger.error("ffmpeg stopped sending frames.")
+                    return
+                received += n
+            self.cache.commit(time.time())
+            self.supervisor.mark_streaming()
+
+    def read_stream(self):
+        """
+        Reads the stream, restarting ffmpeg when it fails, until stop() is called.
+        It is intended to be called in a new thread.
+        """
+        self.supervisor.run()
+
+    def stop(self):
+        self.supervisor.stop()
@@ -0,0 +1,229 @@
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class FrameCache:
+    def __init__(self, capacity: int, shape, dtype=np.uint8, buffers=None, lock=None, lock_timeout=None):
+        """
+        Ring buffer of timestamped frames backed by one preallocated array.
+
+        Frames are handed out as read-only views into the buffer instead of copies.
+        A view stays valid until the slot is reused, i.e. until `capacity` newer
+        frames have been stored, so callers that hold on to a frame for longer
+        than that should copy it.
+
+        # Parameters:
+          capacity: Maximum number of frames kept in the cache (int)
+          shape: Shape of a single frame, for example (HEIGHT, WIDTH, 3) (Tuple[int, ...])
+          dtype: Data type of the frames (numpy.dtype)
+          buffers: Existing arrays to use instead of allocating new ones, as returned
+                   by allocate(), for example views into shared memory (Tuple[numpy.ndarray, ...])
+          lock: Lock shared by all users of the buffers (threading.Lock or multiprocessing.Lock)
+          lock_timeout: Maximum time to wait for the lock in seconds, None to wait forever. With a
+                        timeout, a writer in another process that died holding the lock makes the
+                        reads raise LookupError instead of blocking (float)
+        """
+        if capacity < 1:
+            raise ValueError("Frame cache capacity has to be at least one")
+        self.capacity = capacity
+        if buffers is None:
+            buffers = self.allocate(capacity, shape, dtype)
+        # Frames with logical indices bounds[0] <= i < bounds[1] are valid,
+        # logical index i is stored in slot i % capacity
+        self.bounds, self.timestamps, self.frames = buffers
+        self.__lock = lock or threading.Lock()
+        self.lock_timeout = lock_timeout
+
+    @contextmanager
+    def __locked(self):
+        if self.lock_timeout is None:
+            with self.__lock:
+                yield
+            return
+        # threading.Lock and multiprocessing.Lock take the timeout as the second argument
+        if not self.__lock.acquire(True, self.lock_timeout):
+            raise LookupError("Frame cache is locked, the writing process may have died")
+        try:
+            yield
+        finally:
+            self.__lock.release()
+
+    @staticmethod
+    def layout(capacity: int, shape, dtype=np.uint8):
+        """
+        # Returns:
+          Shapes and data types of the arrays that back a cache (List[Tuple[tuple, numpy.dtype]])
+        """
+        return [((2,), np.dtype(np.int64)), ((capacity,), np.dtype(np.float64)), ((capacity, *shape), np.dtype(dtype))]
+
+    @classmethod
+    def allocate(cls, capacity: int, shape, dtype=np.uint8, buffer=None):
+        """
+        Allocates the arrays of a cache, optionally inside an existing buffer
+        (for example multiprocessing.shared_memory.SharedMemory.buf).
+
+        # Returns:
+          Bounds, timestamps and frames arrays (Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray])
+        """
+        if buffer is None:
+            return tuple(np.zeros(array_shape, array_dtype)
+                         for array_shape, array_dtype in cls.layout(capacity, shape, dtype))
+        arrays = []
+        offset = 0
+        for array_shape, array_dtype in cls.layout(capacity, shape, dtype):
+            arrays.append(np.ndarray(array_shape, array_dtype, buffer=buffer, offset=offset))
+            offset += arrays[-1].nbytes
+        return tuple(arrays)
+
+    @classmethod
+    def nbytes(cls, capacity: int, shape, dtype=np.uint8):
+        """
+        # Returns:
+          Size of the buffer needed by allocate() in bytes (int)
+        """
+        return sum(int(np.prod(array_shape)) * array_dtype.itemsize
+                   for array_shape, array_dtype in cls.layout(capacity, shape, dtype))
+
+    def __len__(self):
+        start, end = self.bounds
+        return int(end - start)
+
+    def oldest(self):
+        """
+        # Returns:
+          Timestamp of the oldest frame in the cache, None if the cache is empty (Optional[float])
+        """
+        with self.__locked():
+            start, end = self.bounds
+            if end == start:
+                return None
+            return float(self.timestamps[start % self.capacity])
+
+    def reserve(self):
+        """
+        Returns a writable view of the slot where the next frame will be stored.
+        The oldest frame is evicted if the cache is full. The frame becomes
+        visible to readers once commit() is called.
+
+        # Returns:
+          Writable frame buffer (numpy.ndarray)
+        """
+        with self.__locked():
+            start, end = self.bounds
+            if end - start == self.capacity:
+                self.bounds[0] += 1
+            return self.frames[end % self.capacity]
+
+    def commit(self, timestamp: float):
+        """
+        Publishes the frame written to the slot returned by reserve().
+
+        # Parameters:
+          timestamp: UNIX timestamp of the frame, has to be greater than or equal
+                     to the timestamp of the previous frame (float)
+        """
+        with self.__locked():
+            start, end = self.bounds
+            if end > start and timestamp < self.timestamps[(end - 1) % self.capacity]:
+                raise ValueError("Frame timestamps have to be monotonic")
+            self.timestamps[end % self.capacity] = timestamp
+            self.bounds[1] += 1
+
+    def store(self, timestamp: float, frame):
+        """
+        Copies a frame into the cache.
+
+        # Parameters:
+          timestamp: UNIX timestamp of the frame (float)
+          frame: Frame with the shape given to the constructor (numpy.ndarray)
+        """
+        np.copyto(self.reserve(), frame)
+        self.commit(timestamp)
+
+    def __nearest(self, timestamp, start, end):
+        """
+        Logical index of the frame closest to timestamp. Binary search over
+        the monotonic timestamps, O(log n). The lock has to be held.
+        """
+        lo, hi = start, end
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamps[mid % self.capacity] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        # lo is now the first frame at or after timestamp, the previous one may be closer
+        if lo == end or (lo > start and timestamp - self.timestamps[(lo - 1) % self.capacity]
+                         <= self.timestamps[lo % self.capacity] - timestamp):
+            lo -= 1
+        return lo
+
+    def __view(self, index):
+        slot = index % self.capacity
+        frame = self.frames[slot].view()
+        frame.flags.writeable = False
+        return float(self.timestamps[slot]), frame
+
+    def get(self, timestamp: float):
+        """
+        Returns the frame with the timestamp closest to the given one.
+        Binary search over the monotonic timestamps, O(log n).
+
+        # Parameters:
+          timestamp: UNIX timestamp (float)
+        # Returns:
+          Tuple of the frame timestamp and a read-only view of the frame (Tuple[float, numpy.ndarray])
+        """
+        with self.__locked():
+            start, end = (int(i) for i in self.bounds)
+            if end == start:
+                raise LookupError("Frame cache is empty")
+            return self.__view(self.__nearest(timestamp, start, end))
+
+    def window(self, timestamp: float, count: int):
+        """
+        Returns consecutive frames centered on the frame closest to the given
+        timestamp. Near the ends of the cache the window is shifted, and it is
+        shorter if the cache holds fewer frames.
+
+        # Parameters:
+          timestamp: UNIX timestamp (float)
+          count: Number of frames (int)
+        # Returns:
+          Frame timestamps and read-only views of the frames, oldest first (List[Tuple[float, numpy.ndarray]])
+        """
+        if count < 1:
+            raise ValueError("Window has to contain at least one frame")
+        with self.__locked():
+            start, end = (int(i) for i in self.bounds)
+            if end == start:
+                raise LookupError("Frame cache is empty")
+            first = self.__nearest(timestamp, start, end) - (count - 1) // 2
+            first = max(start, min(first, end - count))
+            return [self.__view(i) for i in range(first, min(end, first + count))]
+
+    def since(self, timestamp=None):
+        """
+        Returns the frames stored after the given timestamp, for example to process
+        every frame once. Binary search over the monotonic timestamps, O(log n).
+
+        # Parameters:
+          timestamp: UNIX timestamp, None for all cached frames (float)
+        # Returns:
+          Frame timestamps and read-only views of the frames, oldest first (List[Tuple[float, numpy.ndarray]])
+        """
+        with self.__locked():
+            start, end = (int(i) for i in self.bounds)
+            first = start
+            if timestamp is not None:
+                lo, hi = start, end
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if self.timestamps[mid % self.capacity] <= timestamp:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                first = lo
+            return [self.__view(i) for i in range(first, end)]
@@ -0,0 +1,30 @@
+import logging
+import sys
+
+
+logger = logging.getLogger(__package__)
+logger.setLevel(logging.ERROR)
+
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(message)s')
+
+stream_handler = logging.StreamHandler(sys.stderr)
+stream_handler.setLevel(logging.ERROR)
+stream_handler.setFormatter(formatter)
+
+logger.addHandler(stream_handler)
+
+
+def log_to_file(path='stream_reader-log'):
+    """
+    Also writes the stream reader log into a file. Called by the application,
+    so that importing the package does not create files in the working directory.
+
+    # Parameters:
+      path: Path of the log file (str)
+    # Returns:
+      The added handler (logging.FileHandler)
+    """
+    file_handler = logging.FileHandler(path)
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+    return file_handler
@@ -1,38 +1,75 @@
-import logging
 import queue
-import sys
 import time
-from collections import deque
-from threading import Thread
+from typing import NamedTuple
 
 import cv2
 import numpy as np
 
+from .frame_cache import FrameCache
+from .log import logger
+from .supervisor import Backoff
+from .supervisor import StreamHealth
+from .supervisor import StreamSupervisor
+
+
+class FrameTransform(NamedTuple):
+    """
+    Maps coordinates in decoded frames to coordinates in the original video,
+    for readers that crop or scale the video while decoding it:
+        source_x = x_offset + x_scale * frame_x
+        source_y = y_offset + y_scale * frame_y
+    """
+    x_offset: float = 0.0
+    y_offset: float = 0.0
+    x_scale: float = 1.0
+    y_scale: float = 1.0
+
+    def to_source(self, coords):
+        """
+        Converts frame coordinates to source coordinates.
+        # Parameters:
+          coords: Array with (x, y) pairs on the last axis, for example
+                  points (N, 2) or boxes (N, 4) (numpy.ndarray)
+        # Returns:
+          Converted coordinates (numpy.ndarray)
+        """
+        coords = np.asarray(coords, dtype=np.float64)
+        pairs = coords.shape[-1] // 2
+        return coords * ((self.x_scale, self.y_scale) * pairs) + ((self.x_offset, self.y_offset) * pairs)
 
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.ERROR)
-
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(message)s')
-
-stream_handler = logging.StreamHandler(sys.stderr)
-stream_handler.setLevel(logging.ERROR)
-stream_handler.setFormatter(formatter)
-
-file_handler = logging.FileHandler('stream_reader-log')
-file_handler.setFormatter(formatter)
-
-logger.addHandler(stream_handler)
-logger.addHandler(file_handler)
+    def to_frame(self, coords):
+        """
+        Converts source coordinates to frame coordinates, inverse of to_source().
+        """
+        coords = np.asarray(coords, dtype=np.float64)
+        pairs = coords.shape[-1] // 2
+        return (coords - ((self.x_offset, self.y_offset) * pairs)) / ((self.x_scale, self.y_scale) * pairs)
 
 
 class StreamReader:
-    def __init__(self, video_location):
-
-        self.buffer = queue.Queue()
-        self.cache = dict()
+    def __init__(self, video_location, cache_size=200, sample_interval=0.5, buffer_size=4, stall_timeout=5.0,
+                 reconnect_delay=1.0, max_reconnect_delay=60.0, down_after=30.0):
+        """
+        Opens a video stream. Frames are read by read_stream() and sampled into a cache.
+
+        # Parameters:
+          video_location: URL or path of the video stream (str)
+          cache_size: Number of frames kept in the cache (int)
+          sample_interval: Minimum time between cached frames in seconds,
+                           0 decodes and caches every frame (float)
+          buffer_size: Number of decoded frames waiting to be cached, the oldest
+                       frame is dropped when the buffer is full (int)
+          stall_timeout: Seconds without new frames before the stream is reopened (float)
+          reconnect_delay: Initial delay between reconnection attempts in seconds (float)
+          max_reconnect_delay: Maximum delay between reconnection attempts in seconds (float)
+          down_after: Seconds without frames before the stream health is DOWN (float)
+        """
+        self.buffer = queue.Queue(maxsize=buffer_size)
+        self.dropped_frames = 0
 
-        self.timestamps = deque([])
         self.t_latest_frame = 0
+        self.sample_interval = sample_interval
+        self.stall_timeout = stall_timeout
         self.video_location = video_location
 
         self.cap = cv2.VideoCapture(self.video_location, apiPreference=cv2.CAP_FFMPEG)
@@ -42,9 +79,42 @@ class StreamReader:
         self.WIDTH = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         self.HEIGHT = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
+        self.cache = FrameCache(cache_size, (self.HEIGHT, self.WIDTH, 3))
+
+        self.supervisor = StreamSupervisor(
+            connect=self.connect,
+            disconnect=self.disconnect,
+            workers=[self.read_stream_to_buffer, self.read_buffer_to_cache],
+            backoff=Backoff(reconnect_delay, max_reconnect_delay),
+            down_after=down_after,
+        )
+
+    @property
+    def health(self) -> StreamHealth:
+        return self.supervisor.health
+
+    def connect(self):
+        """
+        Reopens the stream if it has been closed.
+        """
+        if not self.cap.isOpened():
+            self.cap = cv2.VideoCapture(self.video_location, apiPreference=cv2.CAP_FFMPEG)
+            if not self.cap.isOpened():
+                raise IOError('Couldnt open stream')
+
+    def disconnect(self):
+        self.cap.release()
+
     def get_constants(self):
         return self.WIDTH, self.HEIGHT
 
+    @staticmethod
+    def get_transform():
+        """
+        Frames are decoded at the native resolution of the video.
+        """
+        return FrameTransform()
+
     @staticmethod
     def find_nearest(array, value):
         """
@@ -61,51 +131,108 @@ class StreamReader:
             time: UNIX time stamp
             frame: frame read using CV2, no operations done prior
         """
-        if len(self.timestamps) == 200:
-            self.cache.pop(self.timestamps[0])
-            self.timestamps.popleft()
-        self.cache[timestamp] = frame
-        self.timestamps.append(timestamp)
+        self.cache.store(timestamp, frame)
 
     def get_frame(self, epoch_time=None):
+        """
+        Returns the cached frame closest to epoch_time (defaults to now).
+        The frame is a read-only view into the cache, copy it before modifying.
+        """
+        return self.get_timestamped_frame(epoch_time)[1]
+
+    def get_timestamped_frame(self, epoch_time=None):
+        """
+        Returns the cached frame closest to epoch_time (defaults to now).
+        The frame is a read-only view into the cache, copy it before modifying.
+        # Returns:
+          Timestamp of the frame and the frame (Tuple[float, numpy.ndarray])
+        """
+        if epoch_time is None:
+            epoch_time = time.time()
+        return self.cache.get(epoch_time)
+
+    def get_timestamped_frames(self, epoch_time=None, count=1):
+        """
+        Returns count consecutive cached frames centered on the frame closest to epoch_time.
+        The frames are read-only views into the cache, copy them before modifying.
+        # Returns:
+          Timestamps of the frames and the frames, oldest first (List[Tuple[float, numpy.ndarray]])
+        """
         if epoch_time is None:
             epoch_time = time.time()
-        return np.copy(self.cache[self.find_nearest(self.timestamps, epoch_time)])
+        return self.cache.window(epoch_time, count)
+
+    def get_timestamped_frames_since(self, epoch_time=None):
+        """
+        Returns the cached frames newer than epoch_time, all of them if it is None.
+        The frames are read-only views into the cache, copy them before modifying.
+        # Returns:
+          Timestamps of the frames and the frames, oldest first (List[Tuple[float, numpy.ndarray]])
+        """
+        return self.cache.since(epoch_time)
 
-    def read_stream_to_buffer(self):
+    def put_frame(self, timestamp, frame):
+        """
+        Hands a decoded frame over to the cache thread. If the buffer is full
+        the oldest frame in it is dropped to make room for the new one.
+        """
         while True:
-            success, frame = self.cap.read()
+            try:
+                self.buffer.put_nowait((timestamp, frame))
+                return
+            except queue.Full:
+                try:
+                    self.buffer.get_nowait()
+                    self.buffer.task_done()
+                    self.dropped_frames += 1
+                    logger.warning("Frame buffer full, dropped the oldest frame.")
+                except queue.Empty:
+                    pass
+
+    def read_stream_to_buffer(self, restart):
+        """
+        Grabs every packet from the stream but decodes only the frames that
+        are going to be cached, i.e. one frame per sample_interval.
+        Returns when the stream stalls or restart is set.
+        """
+        t_latest_grab = time.time()
+        while not restart.is_set():
+            if not self.cap.grab():
+                if time.time() - t_latest_grab > self.stall_timeout:
+                    logger.error("No frames received, reopening the stream.")
+                    return
+                self.supervisor.mark_degraded()
+                restart.wait(0.1)
+                continue
+            t = t_latest_grab = time.time()
+            if t - self.t_latest_frame < self.sample_interval:
+                continue
+            success, frame = self.cap.retrieve()
             if success:
-                self.buffer.put(frame)
+                self.t_latest_frame = t
+                self.put_frame(t, frame)
 
-    def read_buffer_to_cache(self):
-        while True:
+    def read_buffer_to_cache(self, restart):
+        """
+        Stores frames from the buffer to the cache until restart is set.
+        """
+        while not restart.is_set():
             try:
-                t = time.time()
-                frame = self.buffer.get(timeout=2, block=True)
-                if t - self.t_latest_frame >= 0.5:
-                    self.t_latest_frame = t
-                    self.store_frame(t, frame)
-                self.buffer.task_done()
+                t, frame = self.buffer.get(timeout=0.5, block=True)
             except queue.Empty:
-                logger.error("Unexpected error happened, reinitializing VideoCapture.")
-                self.cap.release()
-                self.cap = cv2.VideoCapture(self.video_location, apiPreference=cv2.CAP_FFMPEG)
-                while not self.cap.isOpened():
-                    logger.error("Reinitialization failed, trying again.")
-                    self.cap.release()
-                    self.cap = cv2.VideoCapture(self.video_location, apiPreference=cv2.CAP_FFMPEG)
-                    time.sleep(0.5)
-                    if time.time() - self.t_latest_frame > 5:
-                        logger.error("Couldn't recover from lost stream.")
-                        return -1
+                if time.time() - self.t_latest_frame > self.sample_interval + self.stall_timeout:
+                    self.supervisor.mark_degraded()
+                continue
+            self.store_frame(t, frame)
+            self.buffer.task_done()
+            self.supervisor.mark_streaming()
 
     def read_stream(self):
-        generator = Thread(target=self.read_stream_to_buffer)
-        consumer = Thread(target=self.read_buffer_to_cache)
-
-        generator.start()
-        consumer.start()
+        """
+        Reads the stream, reconnecting when it fails, until stop() is called.
+        It is intended to be called in a new thread.
+        """
+        self.supervisor.run()
 
-        generator.join()
-        consumer.join()
+    def stop(self):
+        self.supervisor.stop()
@@ -0,0 +1,144 @@
+import random
+import threading
+import time
+from enum import Enum
+from typing import Callable
+from typing import List
+from typing import Optional
+
+from .log import logger
+
+
+class StreamHealth(Enum):
+    CONNECTING = "connecting"
+    STREAMING = "streaming"
+    DEGRADED = "degraded"
+    DOWN = "down"
+
+
+class Backoff:
+    def __init__(self, initial: float = 1.0, maximum: float = 60.0, factor: float = 2.0, jitter: float = 0.5):
+        """
+        Exponential backoff with random jitter.
+
+        # Parameters:
+          initial: First delay in seconds (float)
+          maximum: Upper limit for the delay in seconds (float)
+          factor: Multiplier applied to the delay after every attempt (float)
+          jitter: Fraction of the delay that is randomized, 0 disables jitter (float)
+        """
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.attempts = 0
+
+    def reset(self):
+        self.attempts = 0
+
+    def next_delay(self) -> float:
+        """
+        # Returns:
+          Time to wait before the next attempt in seconds (float)
+        """
+        delay = min(self.maximum, self.initial * self.factor ** self.attempts)
+        self.attempts += 1
+        return delay * (1 - self.jitter * random.random())  # nosec
+
+
+class StreamSupervisor:
+    def __init__(self, connect: Callable, disconnect: Callable, workers: List[Callable],
+                 interrupt: Optional[Callable] = None, backoff: Optional[Backoff] = None, down_after: float = 30.0):
+        """
+        Keeps a stream running: connects, runs the worker threads and, when any
+        of them stops, stops the rest and reconnects after a backoff delay.
+
+        # Parameters:
+          connect: Opens the stream, raises IOError on failure (Callable[[], None])
+          disconnect: Closes the stream (Callable[[], None])
+          workers: Functions that process the stream until it fails or the given
+                   event is set (List[Callable[[threading.Event], None]])
+          interrupt: Unblocks workers waiting for data when stop() is called (Callable[[], None])
+          backoff: Delays between reconnection attempts (Backoff)
+          down_after: Seconds without a working stream before the health is DOWN (float)
+        """
+        self.connect = connect
+        self.disconnect = disconnect
+        self.workers = workers
+        self.interrupt = interrupt
+        self.backoff = backoff or Backoff()
+        self.down_after = down_after
+        self.health = StreamHealth.CONNECTING
+        self.t_healthy = time.time()
+        self.__stopped = threading.Event()
+        self.__restart = threading.Event()
+
+    def mark_streaming(self):
+        """
+        Called by the workers when data is flowing.
+        """
+        self.t_healthy = time.time()
+        if self.health != StreamHealth.STREAMING:
+            self.health = StreamHealth.STREAMING
+            self.backoff.reset()
+
+    def mark_degraded(self):
+        """
+        Called by the workers when the stream is up but data is not flowing as expected.
+        """
+        if self.health == StreamHealth.STREAMING:
+            logger.error("Stream degraded.")
+            self.health = StreamHealth.DEGRADED
+
+    def __run_worker(self, worker, restart):
+        try:
+            worker(restart)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Stream worker failed.")
+        finally:
+            # when one worker stops, the others have to be restarted too
+            restart.set()
+
+    def __wait_before_retry(self):
+        if time.time() - self.t_healthy > self.down_after:
+            self.health = StreamHealth.DOWN
+        elif self.health != StreamHealth.DOWN:
+            self.health = StreamHealth.CONNECTING
+        delay = self.backoff.next_delay()
+        logger.error(f"Stream {self.health.value}, reconnecting in {delay:.1f} s.")
+        self.__stopped.wait(delay)
+
+    def run(self):
+        """
+        Runs until stop() is called. It is intended to be called in a new thread.
+        """
+        while not self.__stopped.is_set():
+            try:
+                self.connect()
+            except IOError as err:
+                logger.error(f"Couldnt open stream: {err}")
+                self.__wait_before_retry()
+                continue
+
+            self.__restart = threading.Event()
+            if self.__stopped.is_set():
+                self.__restart.set()
+            threads = [threading.Thread(target=self.__run_worker, args=(worker, self.__restart))
+                       for worker in self.workers]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.disconnect()
+
+            if not self.__stopped.is_set():
+                self.__wait_before_retry()
+
+    def stop(self):
+        """
+        Stops the workers and the supervisor.
+        """
+        self.__stopped.set()
+        self.__restart.set()
+        if self.interrupt is not None:
+            self.interrupt()
@@ -0,0 +1,138 @@
+import argparse
+import json
+import timeit
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+
+from BusinessTampereTrafficMonitoring.traffic_lights import decoding
+from BusinessTampereTrafficMonitoring.traffic_lights.status import Status
+
+
+def read_args():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of decoding traffic light API responses",
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="Example usage:\n $ python -m BusinessTampereTrafficMonitoring.tools."
+                                            "benchmark_decoding --devices 200")
+
+    parser.add_argument("--devices",
+                        type=int,
+                        default=100,
+                        help="Number of simulated device states, each with 36 signal groups")
+
+    parser.add_argument("--repeat",
+                        type=int,
+                        default=5,
+                        help="Number of timing runs, the fastest one is reported")
+
+    return vars(parser.parse_args())
+
+
+def legacy_decode(status_str):
+    """
+    Status.decode before the lookup table.
+    """
+    if len(status_str) != 1 or status_str < '0' or status_str > 'J':
+        raise ValueError(f"Invalid traffic light status code: '{status_str}'")
+    if status_str in "?@ABCDEFGH90":
+        return Status.RED
+    elif status_str in "1345678:<>":
+        return Status.GREEN
+    else:
+        return Status.OTHER
+
+
+def legacy_parse_date(dstr):
+    """
+    Timestamp parsing of the API client before decoding.parse_timestamp.
+    """
+    return datetime.strptime(dstr, "%Y-%m-%dT%H:%M:%S%z")
+
+
+def device_states(count, groups=36, start=datetime(2021, 10, 8, 2, 56, 55, tzinfo=timezone(timedelta(hours=3)))):
+    """
+    # Returns:
+      Response bodies of count polls, one second apart (List[bytes])
+    """
+    codes = "0123456789:;<=>?@ABCDEFGHIJ"
+    states = []
+    for poll in range(count):
+        timestamp = (start + timedelta(seconds=poll)).strftime("%Y-%m-%dT%H:%M:%S%z")
+        # the API writes the offset with a colon
+        timestamp = f"{timestamp[:-2]}:{timestamp[-2:]}"
+        states.append(json.dumps({
+            "responseTs": timestamp,
+            "device": "TRE401",
+            "timestamp": timestamp,
+            "signalGroup": [{"idx": i, "name": f"SG{i}", "status": codes[(poll + i) % len(codes)]}
+                            for i in range(groups)],
+        }).encode())
+    return states
+
+
+def legacy_decode_state(body):
+    obj = json.loads(body)
+    epoch_time = legacy_parse_date(obj["timestamp"]).timestamp()
+    return epoch_time, [legacy_decode(sgroup["status"]) for sgroup in obj["signalGroup"]]
+
+
+def decode_state(body):
+    obj = decoding.loads(body)
+    epoch_time = decoding.parse_epoch_time(obj["timestamp"])
+    return epoch_time, [Status.decode(sgroup["status"]) for sgroup in obj["signalGroup"]]
+
+
+def best_time(function, items, repeat):
+    """
+    # Returns:
+      Fastest time per item in microseconds (float)
+    """
+    def run():
+        for item in items:
+            function(item)
+    return min(timeit.repeat(run, number=1, repeat=repeat)) / len(items) * 1e6
+
+
+def benchmark(devices, repeat):
+    """
+    # Returns:
+      Name, legacy time and current time per call in microseconds of each benchmark (List[Tuple[str, float, float]])
+    """
+    bodies = device_states(devices)
+    objs = [json.loads(body) for body in bodies]
+    codes = [sgroup["status"] for obj in objs for sgroup in obj["signalGroup"]]
+    timestamps = [obj["timestamp"] for obj in objs]
+
+    def parse_uncached(dstr):
+        decoding.parse_timestamp.cache_clear()
+        return decoding.parse_timestamp(dstr)
+
+    results = [
+        ("Status.decode", best_time(legacy_decode, codes, repeat), best_time(Status.decode, codes, repeat)),
+        ("timestamp, first parse", best_time(legacy_parse_date, timestamps, repeat),
+         best_time(parse_uncached, timestamps, repeat)),
+        # a stored cycle parses three timestamps seen in earlier polls
+        ("timestamp, stored cycle", best_time(legacy_parse_date, timestamps * 3, repeat),
+         best_time(decoding.parse_timestamp, timestamps * 3, repeat)),
+        ("JSON" + (" (orjson)" if decoding.orjson is not None else " (orjson not installed)"),
+         best_time(json.loads, bodies, repeat), best_time(decoding.loads, bodies, repeat)),
+    ]
+
+    def decode_uncached(body):
+        decoding.parse_epoch_time.cache_clear()
+        return decode_state(body)
+
+    results.append(("device state", best_time(legacy_decode_state, bodies, repeat),
+                    best_time(decode_uncached, bodies, repeat)))
+    return results
+
+
+def main():
+    args = read_args()
+    print(f"{'benchmark':<40}{'legacy µs':>12}{'current µs':>12}{'speedup':>10}")
+    for name, legacy, current in benchmark(args["devices"], args["repeat"]):
+        print(f"{name:<40}{legacy:>12.2f}{current:>12.2f}{legacy / current:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
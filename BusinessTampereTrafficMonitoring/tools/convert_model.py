@@ -0,0 +1,156 @@
+import argparse
+
+import cv2
+import numpy as np
+
+from BusinessTampereTrafficMonitoring.object_detector.backends import TensorFlowBackend
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import letterbox
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import normalize
+
+
+def read_args():
+    parser = argparse.ArgumentParser(description="Tool to convert the YOLOv4 weights to ONNX or TensorFlow Lite",
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="Example usage:\n $ python convert_model.py yolov4.h5 yolov4-int8.tflite "
+                                            "--format tflite --quantize int8 --calibration traffic.mp4")
+
+    parser.add_argument("weights", help="Keras weights of tf2_yolov4 (yolov4.h5)")
+
+    parser.add_argument("output", help="Path of the converted model")
+
+    parser.add_argument("--format",
+                        choices=["onnx", "tflite"],
+                        default="onnx",
+                        help="Model format")
+
+    parser.add_argument("--size",
+                        type=int,
+                        default=608,
+                        help="Width and height of the model input (detector.inference_size in config.json)")
+
+    parser.add_argument("--quantize",
+                        choices=["none", "fp16", "int8"],
+                        default="none",
+                        help="Quantization of the weights, int8 needs calibration frames")
+
+    parser.add_argument("--calibration",
+                        action="append",
+                        help="Video or image files used to calibrate int8 quantization")
+
+    parser.add_argument("--calibration-frames",
+                        type=int,
+                        default=100,
+                        help="Number of frames used to calibrate int8 quantization")
+
+    return vars(parser.parse_args())
+
+
+def calibration_batches(paths, size, count):
+    """
+    Yields frames of videos or images as model inputs, one frame per batch.
+    # Parameters:
+      paths: Video or image files (List[str])
+      size: Width and height of the model input (int)
+      count: Maximum number of frames (int)
+    """
+    image = np.empty((size, size, 3), dtype=np.uint8)
+    produced = 0
+    for path in paths:
+        capture = cv2.VideoCapture(path)
+        while produced < count:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            letterbox(frame, image)
+            batch = np.empty((1, size, size, 3), dtype=np.float32)
+            yield normalize(image, batch[0])[None]
+            produced += 1
+        capture.release()
+
+
+def convert_onnx(model, output, quantize, calibration):
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = (tf.TensorSpec((None, *model.input_shape[1:]), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=13, output_path=output)
+    if quantize == "fp16":
+        import onnx
+        from onnxconverter_common import float16
+
+        onnx.save(float16.convert_float_to_float16(onnx.load(output)), output)
+    elif quantize == "int8":
+        from onnxruntime.quantization import CalibrationDataReader
+        from onnxruntime.quantization import quantize_static
+
+        class Reader(CalibrationDataReader):
+            def __init__(self):
+                self.batches = iter(calibration())
+
+            def get_next(self):
+                batch = next(self.batches, None)
+                return None if batch is None else {"input": batch}
+
+        quantize_static(output, output, Reader())
+
+
+def without_nms(model):
+    """
+    The model without its last layer, the non-maximum suppression, which is not a TensorFlow
+    Lite builtin. The outputs are the boxes (x0, y0, x1, y1) of every anchor relative to the
+    input size and the score of every class of every anchor, the scores being the objectness
+    times the class probabilities like in the suppression layer.
+    # Returns:
+      Model with the outputs of shape (N, anchors, 4) and (N, anchors, classes) (tf.keras.Model)
+    """
+    import tensorflow as tf
+
+    boxes, scores = [], []
+    # the suppression layer takes the boxes, objectness and class probabilities of each output scale
+    for scale_boxes, objectness, class_probs in model.layers[-1].input:
+        anchors = scale_boxes.shape[1] * scale_boxes.shape[2] * scale_boxes.shape[3]
+        boxes.append(tf.reshape(scale_boxes, (-1, anchors, 4)))
+        scores.append(tf.reshape(objectness * class_probs, (-1, anchors, class_probs.shape[-1])))
+    return tf.keras.Model(model.input, [tf.concat(boxes, axis=1), tf.concat(scores, axis=1)])
+
+
+def convert_tflite(model, output, quantize, calibration):
+    import tensorflow as tf
+
+    # the suppression is done by TFLiteBackend, so the model runs on tflite-runtime without Flex ops
+    converter = tf.lite.TFLiteConverter.from_keras_model(without_nms(model))
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS]
+    if quantize == "fp16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantize == "int8":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([batch] for batch in calibration())
+    with open(output, "wb") as model_file:
+        model_file.write(converter.convert())
+
+
+CONVERTERS = {
+    "onnx": convert_onnx,
+    "tflite": convert_tflite,
+}
+
+
+def main():
+    args = read_args()
+    if args["quantize"] == "int8" and not args["calibration"]:
+        print("int8 quantization needs calibration frames (--calibration)")
+        return 1
+
+    model = TensorFlowBackend(args["weights"], args["size"]).build()
+
+    def calibration():
+        return calibration_batches(args["calibration"], args["size"], args["calibration_frames"])
+
+    CONVERTERS[args["format"]](model, args["output"], args["quantize"], calibration)
+    print(f"Saved {args['format']} model to {args['output']}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,6 +1,9 @@
 from typing import List
+from typing import Sequence
 from typing import Tuple
 
+import numpy as np
+
 
 COLINEAR = 0
 CLOCKWISE = 1
@@ -28,41 +31,32 @@ def orientation(p1: Tuple[float, float], p2: Tuple[float, float], p3: Tuple[floa
 
 def convex_hull(points: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
     """
-    Returns the convex hull of a set of 2D points.
+    Returns the convex hull of a set of 2D points, starting from the leftmost
+    point and going counterclockwise (in a coordinate system where y points up).
+    Points on the edges of the hull are not included.
     # Parameters:
       points: Coordinates of the points (x, y) (List[Tuple[float,float]])
     # Returns:
       Convex hull (List[Tuple[float,float]])
     """
     # remove duplicates
-    points = list(set(points))
+    points = sorted(set(points))
 
-    if len(points) < 4:
+    if len(points) < 3:
         return points
 
-    # Gift wrapping algorithm, adapted to Python from
-    # https://iq.opengenus.org/gift-wrap-jarvis-march-algorithm-convex-hull/
-
-    hull = []
-    leftmost = min(points)
-    current = leftmost
-    while True:
-        hull.append(current)
-
-        best = points[0]
-
-        for point in points:
-            # Checking best == current is necessary because orientation function
-            # is unreliable if the two points are the same
-            if best == current or orientation(current, point, best) == COUNTERCLOCKWISE:
-                best = point
+    # Andrew's monotone chain algorithm, O(n log n)
+    def half_hull(sorted_points):
+        hull = []
+        for point in sorted_points:
+            while len(hull) >= 2 and orientation(hull[-2], hull[-1], point) != COUNTERCLOCKWISE:
+                hull.pop()
+            hull.append(point)
+        return hull
 
-        current = best
-
-        if current == leftmost:
-            break
-
-    return hull
+    lower = half_hull(points)
+    upper = half_hull(reversed(points))
+    return lower[:-1] + upper[:-1]
 
 
 def point_inside(point: Tuple[float, float], hull: List[Tuple[float, float]]):
@@ -75,5 +69,88 @@ def point_inside(point: Tuple[float, float], hull: List[Tuple[float, float]]):
     # Returns:
       Whether or not the point is inside the convex hull (bool)
     """
-    points = hull + [point]
-    return point not in convex_hull(points)
+    return bool(Polygon(hull).contains([point])[0])
+
+
+class Polygon:
+    def __init__(self, vertices: Sequence[Sequence[float]]):
+        """
+        Convex polygon (the convex hull of the given vertices) compiled into
+        edge half-planes a * x + b * y + c >= 0 for fast point tests.
+        # Parameters:
+          vertices: Coordinates of the vertices (x, y) (Sequence[Sequence[float]])
+        """
+        self.vertices = np.array(convex_hull([tuple(xy) for xy in vertices]), dtype=np.float64).reshape(-1, 2)
+        if len(self.vertices) < 3:
+            # degenerate polygons do not contain any points
+            self.edges = np.array([[0.0, 0.0, -1.0]])
+            return
+        start = self.vertices
+        end = np.roll(self.vertices, -1, axis=0)
+        dx, dy = (end - start).T
+        # the hull is counterclockwise, so the inside is on the left side of every edge
+        self.edges = np.column_stack((-dy, dx, dy * start[:, 0] - dx * start[:, 1]))
+
+    def contains(self, points) -> np.ndarray:
+        """
+        # Parameters:
+          points: Coordinates of the points (x, y) (numpy.ndarray of shape (N, 2))
+        # Returns:
+          Whether or not each point is inside the polygon (numpy.ndarray of N bools)
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        values = points @ self.edges[:, :2].T + self.edges[:, 2]
+        return (values >= 0).all(axis=1)
+
+
+class LaneSet:
+    def __init__(self, polygons: Sequence):
+        """
+        A set of convex polygons that are tested against all points at once.
+        # Parameters:
+          polygons: Polygons or lists of their vertices (Sequence[Union[Polygon, Sequence[Sequence[float]]]])
+        """
+        self.polygons = [p if isinstance(p, Polygon) else Polygon(p) for p in polygons]
+        # Half-plane coefficients padded to the same number of edges,
+        # padding edges (0, 0, 0) contain every point
+        max_edges = max((len(p.edges) for p in self.polygons), default=1)
+        self.edges = np.zeros((len(self.polygons), max_edges, 3))
+        for i, polygon in enumerate(self.polygons):
+            self.edges[i, :len(polygon.edges)] = polygon.edges
+
+    def __len__(self):
+        return len(self.polygons)
+
+    def points_in_polygons(self, points) -> np.ndarray:
+        """
+        Finds the first polygon that contains each point.
+        # Parameters:
+          points: Coordinates of the points (x, y) (numpy.ndarray of shape (N, 2))
+        # Returns:
+          Index of the polygon for each point, -1 if the point is outside all polygons
+          (numpy.ndarray of N ints)
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        # (N, P, E) = (N, 1, 1) * (P, E) + ...
+        values = (points[:, 0, None, None] * self.edges[:, :, 0]
+                  + points[:, 1, None, None] * self.edges[:, :, 1]
+                  + self.edges[:, :, 2])
+        inside = (values >= 0).all(axis=2)
+        return np.where(inside.any(axis=1), inside.argmax(axis=1), -1)
+
+    def count(self, points) -> np.ndarray:
+        """
+        # Parameters:
+          points: Coordinates of the points (x, y) (numpy.ndarray of shape (N, 2))
+        # Returns:
+          Number of points in each polygon, every point is counted only once (numpy.ndarray of ints)
+        """
+        indices = self.points_in_polygons(points)
+        return np.bincount(indices[indices >= 0], minlength=len(self.polygons))
+
+
+def points_in_polygons(points, polygons) -> np.ndarray:
+    """
+    Shorthand for LaneSet(polygons).points_in_polygons(points)
+    """
+    return LaneSet(polygons).points_in_polygons(points)
@@ -1,17 +1,30 @@
+import asyncio
+import queue
+import threading
 import time
-from datetime import datetime
 from typing import Callable
 from typing import List
+from typing import Optional
 
 import httpx
 import sqlalchemy
 from sqlalchemy import Column
 from sqlalchemy import Integer
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import StaticPool
 from sqlalchemy.sql.sqltypes import TIMESTAMP
 from sqlalchemy.sql.sqltypes import VARCHAR
 
-from .signal_group import SignalGroup
+from .decoding import format_timestamp
+from .decoding import loads
+from .decoding import parse_epoch_time
+from .decoding import parse_timestamp
+from .event_bus import CYCLE_COMPLETED
+from .event_bus import DEVICE_STATE
+from .event_bus import EventBus
+from .event_bus import LIGHT_CHANGED
+from .event_bus import POLL_FAILED
+from .signal_group_table import SignalGroupTable
 
 Base = declarative_base()
 
@@ -27,7 +40,8 @@ class TrafficLightCycle(Base):
 
 
 class TrafficLightAPIClient:
-    def __init__(self, url: str, monitored_devices: List[str], db: str):
+    def __init__(self, url: str, monitored_devices: List[str], db: str,
+                 timeout=5.0, retries=2, retry_delay=0.2, max_connections=20, event_bus=None):
         """
         Initializes TrafficLightAPIClient.
 
@@ -35,47 +49,94 @@ class TrafficLightAPIClient:
           url: URL of the traffic light API (str), for example  "http://trafficlights.tampere.fi/api/v1/deviceState/"
           monitored_devices: list of intersections, for example ["TRE401", "TRE428"] (List[str])
           db: database connection URL in SQL Alchemy format (str)
+          timeout: Maximum time of one request for the state of a device in seconds (float)
+          retries: Number of times a failed request is retried within a poll (int)
+          retry_delay: Time before the first retry in seconds, doubled for each further retry (float)
+          max_connections: Maximum number of concurrent connections to the API (int)
+          event_bus: Bus the polled states and events are published to, None for a new one (EventBus)
         """
         self.url = url
         self.monitored_devices = monitored_devices
         self.active = False
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.max_connections = max_connections
+        self.events = event_bus if event_bus is not None else EventBus()
 
         # future=True flag enables sqlalchemy 2.0 style usage
-        self.database = sqlalchemy.create_engine(db, future=True)
+        options = {}
+        url = sqlalchemy.engine.make_url(db)
+        if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+            # an in-memory database exists per connection, share one between the polling and other threads
+            options = {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+        self.database = sqlalchemy.create_engine(db, future=True, **options)
         self.db_table = TrafficLightCycle.__table__
         Base.metadata.create_all(bind=self.database)
 
-        # self.__signal_groups is Dict[(str, str), SignalGroup]
-        self.__signal_groups = {}
+        self.__signal_groups = SignalGroupTable()
+        self.__lock = threading.Lock()
+        self.__polling = False
+        # interval and schedule of the running poll()
+        self.__poll_args = None
+        self.__stopped = threading.Event()
+        # cycle events waiting to be stored by the storing thread
+        self.__cycles = queue.Queue()
+        self.__storing = None
 
     def update_device_state(self, device: str):
         """
         GETs the state of a device from the API and returns a list of completed events.
+        The state and the events are also published like in poll().
 
         # Parameters:
           device: device name (str)
         # Returns:
           List of traffic light cycle events that were completed as a result of
-          updating the device state. (List[Tuple[str,str,str,str,str]])
+          updating the device state, empty if the state could not be fetched.
+          (List[Tuple[str,str,str,str,str]])
         """
-        resp = httpx.get(f"{self.url}{device}")
+        try:
+            resp = httpx.get(f"{self.url}{device}", timeout=self.timeout)
+        except httpx.HTTPError as e:
+            return self.__poll_failed(device, str(e) or type(e).__name__)
         if resp.status_code != httpx.codes.OK:
-            print(f"[traffic_lights] Error fetching data: HTTP {resp.status_code}", flush=True)
-            return
-        obj = resp.json()
+            return self.__poll_failed(device, f"HTTP {resp.status_code}")
+        return self.__process_state(loads(resp.content))
+
+    def __poll_failed(self, device, error):
+        print(f"[traffic_lights] Error fetching data from {self.url}{device}: {error}", flush=True)
+        self.events.publish(POLL_FAILED, device, error)
+        return []
+
+    def __process_state(self, obj):
+        """
+        Updates the signal groups of a device from its state and publishes the state,
+        the light changes and the completed cycles.
+
+        # Returns:
+          Completed traffic light cycle events (List[Tuple[str,str,str,str,str]])
+        """
         timestamp = obj["timestamp"]
+        epoch_time = parse_epoch_time(timestamp)
         device = obj["device"]
-        events = []
+        names = [sgroup["name"] for sgroup in obj["signalGroup"]]
+        codes = [sgroup["status"] for sgroup in obj["signalGroup"]]
 
-        for sgroup in obj["signalGroup"]:
-            sg = (device, sgroup["name"])
-            status = sgroup["status"]
-            if sg not in self.__signal_groups:
-                self.__signal_groups[sg] = SignalGroup(*sg, timestamp, status)
-            else:
-                event = self.__signal_groups[sg].update_state(timestamp, status)
-                if event is not None:
-                    events.append(event)
+        with self.__lock:
+            transitions = self.__signal_groups.apply_snapshot(device, names, codes, round(epoch_time * 1000))
+        changes = [(device, name, epoch_time, status) for name, status in transitions.changes]
+        # cycle events keep the timestamp format of the API
+        tzinfo = parse_timestamp(timestamp).tzinfo
+        events = [(device, name, format_timestamp(t_start, tzinfo), format_timestamp(t_green, tzinfo),
+                   format_timestamp(t_end, tzinfo)) for device, name, t_start, t_green, t_end in transitions.cycles]
+
+        # subscribers are called without holding the lock
+        self.events.publish(DEVICE_STATE, obj)
+        for change in changes:
+            self.events.publish(LIGHT_CHANGED, *change)
+        for event in events:
+            self.events.publish(CYCLE_COMPLETED, event)
         return events
 
     def store(self, events: List):
@@ -92,74 +153,208 @@ class TrafficLightAPIClient:
                 stmt = self.db_table.insert().values(
                     device=device,
                     signal_group=signal_group,
-                    t_start=_parse_date(t_start),
-                    t_green=_parse_date(t_green),
-                    t_end=_parse_date(t_end))
+                    t_start=parse_timestamp(t_start),
+                    t_green=parse_timestamp(t_green),
+                    t_end=parse_timestamp(t_end))
                 db_conn.execute(stmt)
             db_conn.commit()
 
-    def start_polling(self, interval: float):
+    def store_later(self, event):
         """
-        Periodically updates device states and stores events to database.
+        Queues a traffic light cycle event to be stored into the database by a
+        background thread, so that polling is not blocked by the database. The
+        events queued while the previous ones were stored are stored together.
+
+        # Parameters:
+          event: Event to be stored (Tuple[str,str,str,str,str])
+        """
+        with self.__lock:
+            if self.__storing is None:
+                self.__storing = threading.Thread(target=self.__store_queued, daemon=True)
+                self.__storing.start()
+        self.__cycles.put(event)
+
+    def __store_queued(self, batch_size=100):
+        while True:
+            events = [self.__cycles.get()]
+            while len(events) < batch_size:
+                try:
+                    events.append(self.__cycles.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.store(events)
+            except sqlalchemy.exc.SQLAlchemyError as e:
+                print(f"[traffic_lights] Storing {len(events)} cycles failed: {e!r}", flush=True)
+            finally:
+                for _ in events:
+                    self.__cycles.task_done()
+
+    def wait_until_stored(self):
+        """
+        Waits until the events queued with store_later() have been stored.
+        """
+        self.__cycles.join()
+
+    async def fetch_device_state(self, client: httpx.AsyncClient, device: str) -> Optional[dict]:
+        """
+        GETs the state of a device from the API. Failed requests and server errors
+        are retried, each request is given at most timeout seconds.
+
+        # Parameters:
+          client: HTTP client (httpx.AsyncClient)
+          device: device name (str)
+        # Returns:
+          State of the device as returned by the API, None if it could not be fetched (Optional[dict])
+        """
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+            try:
+                resp = await asyncio.wait_for(client.get(f"{self.url}{device}"), self.timeout)
+            except asyncio.TimeoutError:
+                error = f"no response in {self.timeout} s"
+                continue
+            except httpx.TransportError as e:
+                error = str(e) or type(e).__name__
+                continue
+            if resp.status_code == httpx.codes.OK:
+                try:
+                    return loads(resp.content)
+                except ValueError as e:
+                    error = f"invalid response: {e}"
+                    break
+            error = f"HTTP {resp.status_code}"
+            # client errors will not go away by retrying
+            if resp.status_code < 500:
+                break
+        self.__poll_failed(device, error)
+        return None
+
+    async def fetch_device_states(self, client: httpx.AsyncClient) -> List[dict]:
+        """
+        GETs the states of all monitored devices concurrently.
+
+        # Parameters:
+          client: HTTP client (httpx.AsyncClient)
+        # Returns:
+          States of the devices that could be fetched (List[dict])
+        """
+        states = await asyncio.gather(*(self.fetch_device_state(client, device) for device in self.monitored_devices))
+        return [state for state in states if state is not None]
+
+    def poll(self, interval: float, schedule=None):
+        """
+        Polls the states of all monitored devices and publishes them to the event bus
+        (self.events), with the light changes and the completed cycles they contain.
+        Each response is parsed once, whatever the number of subscribers.
+
+        All devices are polled concurrently, each every interval seconds measured from
+        the start of its previous poll, or when the schedule predicts a light change
+        (see AdaptivePollSchedule). A device that can not be fetched is skipped until
+        its next poll. Connections to the API are kept alive between polls. Subscribers
+        are called in the polling thread, so they should return quickly.
+
+        If another thread is already polling with the same interval and schedule, this
+        waits until polling is stopped instead of polling the API again; the subscribers
+        get the events of that thread. Different arguments raise a ValueError, as they
+        would be ignored. Returns once the cycles queued with store_later() are stored.
 
         This method never returns unless another thread calls stop_polling().
         It is intended to be called in a new thread.
 
         # Parameters:
-          interval: The time to wait between polling the API (float)
+          interval: The time between the starts of consecutive polls of a device (float)
+          schedule: Decides the time between polls of each device instead of interval (AdaptivePollSchedule)
         """
         if interval <= 0:
             raise ValueError("Polling interval has to be greater than zero")
-        self.active = True
+        with self.__lock:
+            polling = self.__polling
+            if polling and self.__poll_args != (interval, schedule):
+                interval, schedule = self.__poll_args
+                raise ValueError(f"Already polling with interval {interval} and schedule {schedule!r}")
+            self.__polling = True
+            self.__poll_args = (interval, schedule)
+            self.active = True
+            if not polling:
+                self.__stopped.clear()
+        if polling:
+            self.__stopped.wait()
+            return
+        try:
+            asyncio.run(self.__poll_loop(interval, schedule))
+        finally:
+            self.wait_until_stored()
+            with self.__lock:
+                self.__polling = False
+                self.__poll_args = None
+                self.__stopped.set()
+
+    async def __poll_loop(self, interval, schedule):
+        limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+        async with httpx.AsyncClient(limits=limits) as client:
+            await asyncio.gather(*(self.__poll_device(client, device, interval, schedule)
+                                   for device in self.monitored_devices))
+
+    async def __poll_device(self, client, device, interval, schedule):
+        next_poll = time.monotonic()
         while self.active:
-            # keep track of completed cycles in all signal groups
-            events = []
-            for device in self.monitored_devices:
-                events.extend(self.update_device_state(device))
-            # store all completed cycles in database
-            self.store(events)
-            time.sleep(interval)
+            state = await self.fetch_device_state(client, device)
+            if state is not None:
+                try:
+                    if schedule is not None:
+                        schedule.observe(state)
+                    self.__process_state(state)
+                except (KeyError, TypeError, ValueError) as e:
+                    print(f"[traffic_lights] Invalid state of {device}: {e!r}", flush=True)
+            next_poll += interval if schedule is None else schedule.interval(device, next_poll)
+            delay = next_poll - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                # the poll took longer than the interval, skip the missed polls
+                print(f"[traffic_lights] Polling of {device} is {-delay:.1f} s behind schedule", flush=True)
+                next_poll = time.monotonic()
+
+    def __poll_with(self, topic, subscriber, interval, schedule=None):
+        self.events.subscribe(topic, subscriber)
+        try:
+            self.poll(interval, schedule)
+        finally:
+            self.events.unsubscribe(topic, subscriber)
+
+    def start_polling(self, interval: float):
+        """
+        Periodically updates device states and stores events to database.
+        Same as subscribing store_later() to CYCLE_COMPLETED and calling poll().
+
+        This method never returns unless another thread calls stop_polling().
+        It is intended to be called in a new thread.
+
+        # Parameters:
+          interval: The time between the starts of consecutive polls of the API (float)
+        """
+        self.__poll_with(CYCLE_COMPLETED, self.store_later, interval)
 
-    def listen_for_light_change_events(self, interval: float, callback: Callable):
+    def listen_for_light_change_events(self, interval: float, callback: Callable, schedule=None):
         """
         Calls the callback function every time a light changes state from green to
-        red or red to green.
+        red or red to green. Same as subscribing the callback to LIGHT_CHANGED and
+        calling poll().
+
+        The callback is called in the polling thread, so it should return quickly,
+        for example by queueing the event (see LightChangeQueue).
 
         This method never returns unless another thread calls stop_polling().
         It is intended to be called in a new thread.
 
         # Parameters:
-          interval: The time to wait between polling the API (float)
+          interval: The time between the starts of consecutive polls of the API (float)
           callback: callback function (Callable)
+          schedule: Decides the time between polls of each device instead of interval (AdaptivePollSchedule)
         """
-        if interval <= 0:
-            raise ValueError("Polling interval has to be greater than zero")
-        self.active = True
-        while self.active:
-            for device in self.monitored_devices:
-                try:
-                    resp = httpx.get(f"{self.url}{device}")
-                except httpx.ReadError as e:
-                    print(f"[traffic_lights] Error fetching data from {self.url}{device}: {e}", flush=True)
-                    return
-                if resp.status_code != httpx.codes.OK:
-                    print(f"[traffic_lights] Error fetching data: HTTP {resp.status_code}", flush=True)
-                    return
-                obj = resp.json()
-                timestamp = _parse_date(obj["timestamp"]).timestamp()
-                device = obj["device"]
-
-                for sgroup in obj["signalGroup"]:
-                    sg = (device, sgroup["name"])
-                    status = sgroup["status"]
-                    if sg not in self.__signal_groups:
-                        self.__signal_groups[sg] = SignalGroup(*sg, timestamp, status)
-                    else:
-                        old_status = self.__signal_groups[sg].status
-                        self.__signal_groups[sg].update_state(timestamp, status)
-                        new_status = self.__signal_groups[sg].status
-                        if old_status != new_status:
-                            callback(device, sgroup["name"], timestamp, new_status)
+        self.__poll_with(LIGHT_CHANGED, callback, interval, schedule)
 
     def stop_polling(self):
         """
@@ -168,7 +363,3 @@ class TrafficLightAPIClient:
         """
         if self.active:
             self.active = False
-
-
-def _parse_date(dstr):
-    return datetime.strptime(dstr, "%Y-%m-%dT%H:%M:%S%z")
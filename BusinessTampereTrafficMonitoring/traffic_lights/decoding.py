@@ -0,0 +1,84 @@
+import json
+import re
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+_TIMESTAMP = re.compile(r"(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)([+-])(\d\d):(\d\d)", re.ASCII)
+
+
+def loads(content: bytes):
+    """
+    Parses a JSON response body, with orjson when it is installed.
+
+    # Parameters:
+      content: Response body (bytes)
+    # Returns:
+      Parsed JSON
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+@lru_cache(maxsize=32)
+def _timezone(sign: str, hours: int, minutes: int) -> timezone:
+    offset = timedelta(hours=hours, minutes=minutes)
+    return timezone(-offset if sign == "-" else offset)
+
+
+@lru_cache(maxsize=1024)
+def parse_timestamp(dstr: str) -> datetime:
+    """
+    Parses a timestamp of the traffic light API, for example "2021-10-08T02:56:55+03:00".
+
+    Timestamps in exactly that layout are split with a regular expression, anything else is left
+    to datetime.strptime. Results are memoized: a poll has the same timestamp for every
+    signal group and the timestamps of a cycle are parsed again when it is stored.
+
+    # Parameters:
+      dstr: Timestamp (str)
+    # Returns:
+      Timezone aware time (datetime)
+    """
+    match = _TIMESTAMP.fullmatch(dstr)
+    if match is not None:
+        year, month, day, hour, minute, second, sign, offset_hours, offset_minutes = match.groups()
+        try:
+            return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                            tzinfo=_timezone(sign, int(offset_hours), int(offset_minutes)))
+        except ValueError:
+            # out of range fields, strptime raises the error
+            pass
+    return datetime.strptime(dstr, TIMESTAMP_FORMAT)
+
+
+@lru_cache(maxsize=1024)
+def parse_epoch_time(dstr: str) -> float:
+    """
+    # Parameters:
+      dstr: Timestamp of the traffic light API (str)
+    # Returns:
+      Epoch time in seconds (float)
+    """
+    return parse_timestamp(dstr).timestamp()
+
+
+def format_timestamp(epoch_ms: int, tzinfo) -> str:
+    """
+    Formats a time like the traffic light API, for example "2021-10-08T02:56:55+03:00".
+
+    # Parameters:
+      epoch_ms: Epoch time in milliseconds, whole seconds (int)
+      tzinfo: Timezone of the result (datetime.tzinfo)
+    # Returns:
+      Timestamp (str)
+    """
+    return datetime.fromtimestamp(epoch_ms / 1000, tzinfo).isoformat(timespec="seconds")
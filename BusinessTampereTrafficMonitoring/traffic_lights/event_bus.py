@@ -0,0 +1,56 @@
+import threading
+from typing import Callable
+
+# Topics published by TrafficLightAPIClient.poll():
+# device state as returned by the API (dict)
+DEVICE_STATE = "device_state"
+# device (str) and the error (str) when the state of a device could not be fetched
+POLL_FAILED = "poll_failed"
+# device (str), signal group (str), epoch time (float) and the new status (Status) of a light
+LIGHT_CHANGED = "light_changed"
+# completed traffic light cycle (Tuple[str, str, str, str, str]), see SignalGroup.update_state
+CYCLE_COMPLETED = "cycle_completed"
+
+
+class EventBus:
+    def __init__(self):
+        """
+        In-process publish/subscribe of events. Subscribers are called in the
+        publishing thread, in the order they subscribed, so they should return
+        quickly. An exception in a subscriber is logged and does not affect the
+        publisher or the other subscribers.
+        """
+        # topic -> subscribers
+        self.__subscribers = {}
+        self.__lock = threading.Lock()
+
+    def subscribe(self, topic: str, subscriber: Callable):
+        """
+        # Parameters:
+          topic: Topic, for example LIGHT_CHANGED (str)
+          subscriber: Called with the arguments of each event of the topic (Callable)
+        """
+        with self.__lock:
+            self.__subscribers[topic] = self.__subscribers.get(topic, ()) + (subscriber,)
+
+    def unsubscribe(self, topic: str, subscriber: Callable):
+        with self.__lock:
+            subscribers = list(self.__subscribers.get(topic, ()))
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+            self.__subscribers[topic] = tuple(subscribers)
+
+    def publish(self, topic: str, *event):
+        """
+        Calls the subscribers of the topic with the event.
+
+        # Parameters:
+          topic: Topic of the event (str)
+          event: Arguments passed to the subscribers
+        """
+        # subscribers are kept in tuples, so they can be called without holding the lock
+        for subscriber in self.__subscribers.get(topic, ()):
+            try:
+                subscriber(*event)
+            except Exception as err:  # pylint: disable=broad-except
+                print(f"[traffic_lights] Subscriber of {topic} failed: {err!r}", flush=True)
@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import deque
+from typing import Callable
+from typing import NamedTuple
+
+from .status import Status
+
+
+class LightChange(NamedTuple):
+    device: str
+    signal_group: str
+    timestamp: float
+    status: Status
+    deadline: float
+
+
+class LightChangeQueue:
+    def __init__(self, handler: Callable, workers=4, capacity=32, max_delay=60.0):
+        """
+        Bounded queue of light change events between the polling thread and a pool
+        of worker threads, so that slow handling of one event never delays polling.
+
+        Each event gets a deadline of max_delay seconds after the light change.
+        Events that are still queued at their deadline are dropped, as are the
+        oldest events when the queue is full.
+
+        # Parameters:
+          handler: Called with device, signal group, epoch time and status of each event (Callable)
+          workers: Number of worker threads (int)
+          capacity: Maximum number of queued events (int)
+          max_delay: Time after the light change an event can still be handled in seconds (float)
+        """
+        if workers < 1:
+            raise ValueError("The number of workers has to be at least one")
+        if capacity < 1:
+            raise ValueError("Queue capacity has to be at least one")
+        self.handler = handler
+        self.max_delay = max_delay
+        self.handled = 0
+        self.dropped_full = 0
+        self.dropped_stale = 0
+        self.__events = deque(maxlen=capacity)
+        self.__condition = threading.Condition()
+        self.__stopped = False
+        self.__workers = [threading.Thread(target=self.__work, daemon=True) for _ in range(workers)]
+        for worker in self.__workers:
+            worker.start()
+
+    def put(self, device: str, signal_group: str, timestamp: float, status: Status) -> bool:
+        """
+        Queues a light change event without blocking. Has the signature of the
+        callback of TrafficLightAPIClient.listen_for_light_change_events.
+
+        # Parameters:
+          device: Intersection id, for example "TRE401" (str)
+          signal_group: Signal group id, for example "A" or "RV1" (str)
+          timestamp: Epoch time of the light change in seconds (float)
+          status: New status of the light (Status)
+        # Returns:
+          Whether or not the event was queued (bool)
+        """
+        event = LightChange(device, signal_group, timestamp, status, timestamp + self.max_delay)
+        with self.__condition:
+            if self.__stopped:
+                return False
+            if len(self.__events) == self.__events.maxlen:
+                dropped = self.__events.popleft()
+                self.dropped_full += 1
+                self.__log(dropped, "queue is full")
+            self.__events.append(event)
+            self.__condition.notify()
+        return True
+
+    def __next(self):
+        """
+        # Returns:
+          Next event that is not past its deadline, None when the queue is stopped (Optional[LightChange])
+        """
+        with self.__condition:
+            while True:
+                while not self.__events and not self.__stopped:
+                    self.__condition.wait()
+                if self.__stopped:
+                    return None
+                event = self.__events.popleft()
+                if time.time() <= event.deadline:
+                    return event
+                self.dropped_stale += 1
+                self.__log(event, f"{time.time() - event.timestamp:.1f} s old")
+
+    def __work(self):
+        while True:
+            event = self.__next()
+            if event is None:
+                return
+            # a failing event must not stop the worker
+            try:
+                self.handler(event.device, event.signal_group, event.timestamp, event.status)
+            except Exception as err:  # pylint: disable=broad-except
+                print(f"[traffic_lights] Handling the light change of {event.device} {event.signal_group} "
+                      f"failed: {err!r}", flush=True)
+            with self.__condition:
+                self.handled += 1
+
+    def pending(self) -> int:
+        """
+        # Returns:
+          Number of queued events (int)
+        """
+        with self.__condition:
+            return len(self.__events)
+
+    def stop(self, wait=True):
+        """
+        Stops the workers. Queued events are discarded, events that are being
+        handled are finished.
+
+        # Parameters:
+          wait: Wait for the workers to finish (bool)
+        """
+        with self.__condition:
+            self.__stopped = True
+            self.__events.clear()
+            self.__condition.notify_all()
+        if wait:
+            for worker in self.__workers:
+                worker.join()
+
+    def __log(self, event, reason):
+        print(f"[traffic_lights] Dropped the light change of {event.device} {event.signal_group} ({reason}) "
+              f"- {self.dropped_full + self.dropped_stale} dropped", flush=True)
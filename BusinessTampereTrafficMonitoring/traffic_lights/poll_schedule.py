@@ -0,0 +1,187 @@
+import threading
+import time
+
+from .decoding import parse_epoch_time
+from .status import Status
+
+# API timestamps are whole seconds
+_TIMESTAMP_RESOLUTION = 1.0
+
+
+class _Phase:
+    """
+    Current phase of a signal group and the learned phase durations.
+    """
+    def __init__(self, status, start):
+        self.status = status
+        # API time when the current phase started, None if it started before the first poll
+        self.start = start
+        # status -> smoothed duration and smoothed absolute prediction error in seconds
+        self.durations = {}
+        self.deviations = {}
+
+
+class AdaptivePollSchedule:
+    def __init__(self, min_interval=0.2, max_interval=4.0, margin=0.5, polls_per_change=10, smoothing=0.25,
+                 signal_groups=None, budget_interval=None, max_saved_polls=10, untracked_interval=None):
+        """
+        Decides when to poll each device next from the predicted light changes.
+
+        The duration of each phase (red, green, other) of each signal group is learned
+        from the observed transitions as an exponentially weighted moving average,
+        together with the average error of the prediction. While a change of one of
+        the signal groups of a device is expected, that is within margin plus twice the
+        average error of the predicted change, the device is polled polls_per_change
+        times but at most every min_interval seconds. Otherwise it is polled every
+        max_interval seconds, also until a phase duration has been observed and once
+        a phase has lasted longer than expected.
+
+        With a budget_interval, a device is polled at most as often as it would be
+        every budget_interval seconds: a poll is earned every budget_interval seconds
+        and the polls saved in the middle of the phases, up to max_saved_polls, are
+        spent around the predicted changes. The dense windows of several signal groups
+        of a device then share the budget instead of adding up.
+
+        Devices with none of the signal_groups, for example intersections monitored only
+        for cycle statistics, are polled every untracked_interval seconds.
+
+        # Parameters:
+          min_interval: Minimum time between polls around a predicted change in seconds (float)
+          max_interval: Time between polls in the middle of a phase in seconds (float)
+          margin: Minimum time polled densely before and after a predicted change in seconds (float)
+          polls_per_change: Number of polls spread over the time a change is expected (int)
+          smoothing: Weight of the newest observed duration (float)
+          signal_groups: (device, signal group) pairs whose changes are predicted, None for all (Set[Tuple[str, str]])
+          budget_interval: Time between polls of fixed interval polling that a device may not exceed
+                           in the number of polls, None for no limit (float)
+          max_saved_polls: Maximum number of polls saved for later (float)
+          untracked_interval: Time between polls of devices without signal_groups in seconds,
+                              None for max_interval (float)
+        """
+        if not 0 < min_interval <= max_interval:
+            raise ValueError("Polling intervals have to be greater than zero and min_interval at most max_interval")
+        if not 0 < smoothing <= 1:
+            raise ValueError("Smoothing has to be in (0, 1]")
+        if budget_interval is not None and budget_interval <= 0:
+            raise ValueError("Budget interval has to be greater than zero")
+        if untracked_interval is not None and untracked_interval <= 0:
+            raise ValueError("Untracked interval has to be greater than zero")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.margin = margin
+        self.polls_per_change = polls_per_change
+        self.smoothing = smoothing
+        self.signal_groups = None if signal_groups is None else set(signal_groups)
+        self.budget_interval = budget_interval
+        self.max_saved_polls = max_saved_polls
+        self.untracked_interval = max_interval if untracked_interval is None else untracked_interval
+        self.__tracked_devices = None if signal_groups is None else {device for device, _ in signal_groups}
+        # (device, signal group) -> _Phase
+        self.__phases = {}
+        # device -> smallest local monotonic time minus API time of a state, the API time
+        # is truncated to seconds so the smallest difference is closest to the clock offset
+        self.__offsets = {}
+        # device -> polls available after the previous poll (negative when spent in advance) and its time
+        self.__budgets = {}
+        self.__lock = threading.Lock()
+
+    def __getstate__(self):
+        # copies are sent to polling processes, see ShardedPoller
+        state = self.__dict__.copy()
+        del state["_AdaptivePollSchedule__lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__lock = threading.Lock()
+
+    def observe(self, state: dict, received=None):
+        """
+        Learns from a device state returned by the API.
+
+        # Parameters:
+          state: Device state with "device", "timestamp" and "signalGroup" (dict)
+          received: Monotonic time when the state was received, None for now (float)
+        """
+        received = time.monotonic() if received is None else received
+        device = state["device"]
+        timestamp = parse_epoch_time(state["timestamp"])
+        with self.__lock:
+            self.__offsets[device] = min(self.__offsets.get(device, float("inf")), received - timestamp)
+            for sgroup in state["signalGroup"]:
+                key = (device, sgroup["name"])
+                if self.signal_groups is not None and key not in self.signal_groups:
+                    continue
+                self.__observe_status(key, timestamp, Status.decode(sgroup["status"]))
+
+    def __observe_status(self, key, timestamp, status):
+        phase = self.__phases.get(key)
+        if phase is None:
+            self.__phases[key] = _Phase(status, None)
+            return
+        if status == phase.status:
+            return
+        if phase.start is not None:
+            self.__learn(phase, timestamp - phase.start)
+        phase.status = status
+        phase.start = timestamp
+
+    def __learn(self, phase, duration):
+        expected = phase.durations.get(phase.status)
+        if expected is None:
+            phase.durations[phase.status] = duration
+            phase.deviations[phase.status] = 0.0
+            return
+        phase.deviations[phase.status] += self.smoothing * (abs(duration - expected) - phase.deviations[phase.status])
+        phase.durations[phase.status] += self.smoothing * (duration - expected)
+
+    def predicted_changes(self, device: str):
+        """
+        # Parameters:
+          device: device name (str)
+        # Returns:
+          Predicted local monotonic time of the next change and its uncertainty in seconds
+          for each signal group of the device with a learned phase duration (List[Tuple[float, float]])
+        """
+        with self.__lock:
+            offset = self.__offsets.get(device)
+            predictions = []
+            for (phase_device, _), phase in self.__phases.items():
+                if phase_device != device or phase.start is None or phase.status not in phase.durations:
+                    continue
+                # the change happens within the second after the predicted API time
+                predictions.append((phase.start + phase.durations[phase.status] + offset + _TIMESTAMP_RESOLUTION / 2,
+                                    self.margin + _TIMESTAMP_RESOLUTION / 2 + 2 * phase.deviations[phase.status]))
+            return predictions
+
+    def interval(self, device: str, now=None) -> float:
+        """
+        Called once for each poll of the device.
+
+        # Parameters:
+          device: device name (str)
+          now: Monotonic time of the current poll, None for now (float)
+        # Returns:
+          Time until the next poll of the device in seconds (float)
+        """
+        now = time.monotonic() if now is None else now
+        interval = self.__interval(device, now)
+        if self.budget_interval is None:
+            return interval
+        with self.__lock:
+            polls, previous = self.__budgets.get(device, (0.0, now))
+            polls = min(self.max_saved_polls, polls + (now - previous) / self.budget_interval) - 1
+            self.__budgets[device] = (polls, now)
+        # the next poll waits until the polls spent in advance have been earned
+        return max(interval, -polls * self.budget_interval)
+
+    def __interval(self, device, now):
+        if self.__tracked_devices is not None and device not in self.__tracked_devices:
+            return self.untracked_interval
+        interval = self.max_interval
+        for change, uncertainty in self.predicted_changes(device):
+            if change - uncertainty <= now <= change + uncertainty:
+                return max(self.min_interval, 2 * uncertainty / self.polls_per_change)
+            if now < change - uncertainty:
+                interval = min(interval, change - uncertainty - now)
+        return max(interval, self.min_interval)
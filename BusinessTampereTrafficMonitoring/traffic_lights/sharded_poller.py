@@ -0,0 +1,268 @@
+import hashlib
+import multiprocessing
+import threading
+import time
+from bisect import bisect
+from multiprocessing.connection import wait
+from typing import Dict
+from typing import Iterable
+from typing import List
+
+from .api_client import TrafficLightAPIClient
+from .event_bus import CYCLE_COMPLETED
+from .event_bus import LIGHT_CHANGED
+from .event_bus import POLL_FAILED
+
+# Topics forwarded from the polling processes, the device states stay in the processes
+FORWARDED_TOPICS = (LIGHT_CHANGED, CYCLE_COMPLETED, POLL_FAILED)
+
+
+def _hash(key: str) -> int:
+    # the same in every process and run, unlike hash()
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, nodes: Iterable[str], replicas=64):
+        """
+        Consistent hashing of keys to nodes. Every node is placed on a ring at replicas
+        points and a key belongs to the node of the first point after the hash of the key.
+        Adding or removing a node only moves the keys of that node.
+
+        # Parameters:
+          nodes: Names of the nodes (Iterable[str])
+          replicas: Number of points of each node, more points spread the keys more evenly (int)
+        """
+        if replicas < 1:
+            raise ValueError("Every node needs at least one point on the ring")
+        self.replicas = replicas
+        self.nodes = []
+        self.__points = []
+        self.__owners = []
+        for node in nodes:
+            self.add(node)
+
+    def __build(self):
+        ring = sorted((_hash(f"{node}#{replica}"), node) for node in self.nodes for replica in range(self.replicas))
+        self.__points = [point for point, _ in ring]
+        self.__owners = [node for _, node in ring]
+
+    def add(self, node: str):
+        if node not in self.nodes:
+            self.nodes.append(node)
+            self.__build()
+
+    def remove(self, node: str):
+        if node in self.nodes:
+            self.nodes.remove(node)
+            self.__build()
+
+    def node(self, key: str) -> str:
+        """
+        # Parameters:
+          key: Key, for example a device id (str)
+        # Returns:
+          Node the key belongs to (str)
+        """
+        if not self.__points:
+            raise ValueError("The ring has no nodes")
+        return self.__owners[bisect(self.__points, _hash(key)) % len(self.__points)]
+
+    def assign(self, keys: Iterable[str]) -> Dict[str, List[str]]:
+        """
+        # Parameters:
+          keys: Keys to distribute (Iterable[str])
+        # Returns:
+          Keys of each node, in the order given (Dict[str, List[str]])
+        """
+        assignment = {node: [] for node in self.nodes}
+        for key in keys:
+            assignment[self.node(key)].append(key)
+        return assignment
+
+
+def run_shard(url, devices, options, interval, schedule, connection, stopped):
+    """
+    Entry point of a polling process. Polls the devices with a TrafficLightAPIClient and
+    sends the events of FORWARDED_TOPICS to the parent process until stopped is set.
+
+    # Parameters:
+      url: URL of the traffic light API (str)
+      devices: Devices polled by this process (List[str])
+      options: Keyword arguments for TrafficLightAPIClient (Dict)
+      interval: Time between polls of a device (float)
+      schedule: Decides the time between polls instead of interval (AdaptivePollSchedule)
+      connection: Pipe for sending (topic, event) to the parent process (multiprocessing.Connection)
+      stopped: Set by the parent process to stop polling (multiprocessing.Event)
+    """
+    # the cycles are stored by the parent process
+    client = TrafficLightAPIClient(url, devices, "sqlite://", **options)
+
+    def forward(topic):
+        def send(*event):
+            try:
+                connection.send((topic, event))
+            except OSError:
+                # the parent process is gone
+                client.stop_polling()
+        return send
+
+    for topic in FORWARDED_TOPICS:
+        client.events.subscribe(topic, forward(topic))
+
+    def stop():
+        stopped.wait()
+        client.stop_polling()
+
+    threading.Thread(target=stop, daemon=True).start()
+    try:
+        client.poll(interval, schedule)
+    finally:
+        connection.close()
+
+
+class ShardedPoller:
+    def __init__(self, client: TrafficLightAPIClient, workers=4, replicas=64, restart_delay=1.0,
+                 max_restart_delay=60.0):
+        """
+        Polls the monitored devices of a client in several processes. The devices are
+        distributed to the processes with consistent hashing, so a device is always polled
+        by the same process, also after the process is restarted, and changing the number
+        of processes only moves the devices of the added or removed processes.
+
+        The light changes, completed cycles and failed polls are sent to this process
+        and published to the event bus of the client (client.events), like in
+        TrafficLightAPIClient.poll(). A process that exits is restarted after restart_delay
+        seconds, doubled for each consecutive restart up to max_restart_delay.
+
+        # Parameters:
+          client: Client with the monitored devices and the options of the polling clients (TrafficLightAPIClient)
+          workers: Number of polling processes, each with at most client.max_connections connections (int)
+          replicas: Points of each process on the hash ring (int)
+          restart_delay: Time before restarting a process that exited in seconds (float)
+          max_restart_delay: Maximum time before restarting a process in seconds (float)
+        """
+        if workers < 1:
+            raise ValueError("At least one polling process is needed")
+        self.client = client
+        self.events = client.events
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.ring = HashRing([f"shard-{i}" for i in range(workers)], replicas)
+        # shard -> devices, shards without devices are not started
+        self.shards = {shard: devices for shard, devices in self.ring.assign(client.monitored_devices).items()
+                       if devices}
+        # shard -> running process
+        self.processes = {}
+        # shard -> number of times the process has been restarted
+        self.restarts = {shard: 0 for shard in self.shards}
+        self.active = False
+        self.__context = multiprocessing.get_context("spawn")
+        # shard -> event stopping the process, a process killed while waiting for a shared
+        # event would leave it in a state where setting it blocks
+        self.__stopped = {}
+        self.__connections = {}
+        self.__started = {}
+        self.__failures = {shard: 0 for shard in self.shards}
+
+    def __start(self, shard, interval, schedule):
+        options = {"timeout": self.client.timeout, "retries": self.client.retries,
+                   "retry_delay": self.client.retry_delay, "max_connections": self.client.max_connections}
+        connection, child_connection = self.__context.Pipe(duplex=False)
+        stopped = self.__stopped[shard] = self.__context.Event()
+        process = self.__context.Process(
+            target=run_shard,
+            args=(self.client.url, self.shards[shard], options, interval, schedule, child_connection, stopped),
+            name=f"traffic-lights-{shard}",
+            daemon=True,
+        )
+        process.start()
+        child_connection.close()
+        self.processes[shard] = process
+        self.__connections[connection] = shard
+        self.__started[shard] = time.monotonic()
+
+    def __exited(self, shard):
+        """
+        # Returns:
+          Time until the process of the shard is restarted in seconds (float)
+        """
+        process = self.processes[shard]
+        process.join(timeout=5)
+        if time.monotonic() - self.__started[shard] > self.max_restart_delay:
+            # the process ran long enough, this is not a restart loop
+            self.__failures[shard] = 0
+        delay = min(self.max_restart_delay, self.restart_delay * 2 ** self.__failures[shard])
+        self.__failures[shard] += 1
+        print(f"[traffic_lights] Polling process of {shard} exited with code {process.exitcode}, "
+              f"restarting in {delay:.1f} s", flush=True)
+        return delay
+
+    def poll(self, interval: float, schedule=None):
+        """
+        Starts the polling processes and publishes their events until stop_polling() is called.
+        Subscribers are called in the thread calling this method, so they should return quickly.
+
+        This method never returns unless another thread calls stop_polling().
+        It is intended to be called in a new thread.
+
+        # Parameters:
+          interval: The time between the starts of consecutive polls of a device (float)
+          schedule: Decides the time between polls of each device instead of interval, each
+                    process learns with its own copy (AdaptivePollSchedule)
+        """
+        if interval <= 0:
+            raise ValueError("Polling interval has to be greater than zero")
+        self.active = True
+        for shard in self.shards:
+            self.__start(shard, interval, schedule)
+        # shard -> monotonic time of the restart
+        restarts = {}
+        try:
+            while self.active:
+                timeout = min([0.5] + [restart - time.monotonic() for restart in restarts.values()])
+                for connection in wait(list(self.__connections), max(0.0, timeout)):
+                    try:
+                        topic, event = connection.recv()
+                    except EOFError:
+                        # the process has exited
+                        shard = self.__connections.pop(connection)
+                        connection.close()
+                        restarts[shard] = time.monotonic() + self.__exited(shard)
+                        continue
+                    self.events.publish(topic, *event)
+                for shard, restart in list(restarts.items()):
+                    if restart <= time.monotonic() and self.active:
+                        del restarts[shard]
+                        self.restarts[shard] += 1
+                        self.__start(shard, interval, schedule)
+        finally:
+            self.__stop_processes()
+
+    def __stop_processes(self):
+        for stopped in self.__stopped.values():
+            stopped.set()
+        # the processes finish their current polls, keep reading so that they are not blocked on a full pipe
+        deadline = time.monotonic() + 15
+        while self.__connections and time.monotonic() < deadline:
+            for connection in wait(list(self.__connections), 0.5):
+                try:
+                    topic, event = connection.recv()
+                except EOFError:
+                    del self.__connections[connection]
+                    connection.close()
+                    continue
+                self.events.publish(topic, *event)
+        for process in self.processes.values():
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        for connection in self.__connections:
+            connection.close()
+        self.__connections.clear()
+
+    def stop_polling(self):
+        """
+        Stops the polling processes. It may take up to interval seconds for them to finish.
+        """
+        self.active = False
@@ -0,0 +1,226 @@
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+
+from .status import Status
+
+# Marks a red or green start time that is not known
+NO_TIME = np.iinfo(np.int64).min
+
+
+def _status_table():
+    """
+    # Returns:
+      Status value of each character code from 0 to 255, 0 for invalid codes (bytes)
+    """
+    table = bytearray(256)
+    for code in range(256):
+        try:
+            table[code] = Status.decode(chr(code)).value
+        except ValueError:
+            pass
+    return bytes(table)
+
+
+_STATUS_OF_CODE = _status_table()
+_RED = np.int8(Status.RED.value)
+_GREEN = np.int8(Status.GREEN.value)
+_OTHER = np.int8(Status.OTHER.value)
+
+
+def _indices(rows):
+    return np.arange(rows.start, rows.stop) if isinstance(rows, slice) else rows
+
+
+class SignalGroupState(NamedTuple):
+    status: Status
+    t_red_start: Optional[int]
+    t_green_start: Optional[int]
+
+
+class Transitions(NamedTuple):
+    # signal groups whose status changed and their new status
+    changes: List[Tuple[str, Status]]
+    # completed cycles (device, signal group, red start, green start, green end) in epoch milliseconds
+    cycles: List[Tuple[str, str, int, int, int]]
+
+
+class SignalGroupTable:
+    def __init__(self, capacity=1024):
+        """
+        State of all signal groups in arrays, one row per signal group, updated a device
+        snapshot at a time with array operations. Follows the same state machine as
+        SignalGroup.update_state, with times as int64 epoch milliseconds.
+
+        # Parameters:
+          capacity: Number of rows allocated up front, doubled when full (int)
+        """
+        capacity = max(1, capacity)
+        self.status = np.zeros(capacity, dtype=np.int8)
+        self.t_red_start = np.full(capacity, NO_TIME, dtype=np.int64)
+        self.t_green_start = np.full(capacity, NO_TIME, dtype=np.int64)
+        # interned device and signal group names of each row
+        self.device = np.zeros(capacity, dtype=np.int32)
+        self.group = np.zeros(capacity, dtype=np.int32)
+        self.devices = []
+        self.groups = []
+        self.size = 0
+        self.__device_ids = {}
+        self.__group_ids = {}
+        # (device id, group id) -> row
+        self.__rows = {}
+        # device -> signal group names and rows of the previous snapshot
+        self.__layouts = {}
+
+    def __len__(self):
+        return self.size
+
+    def __intern(self, ids, names, name):
+        index = ids.get(name)
+        if index is None:
+            index = ids[name] = len(names)
+            names.append(name)
+        return index
+
+    def __grow(self, size):
+        capacity = len(self.status)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for column, fill in (("status", 0), ("t_red_start", NO_TIME), ("t_green_start", NO_TIME),
+                             ("device", 0), ("group", 0)):
+            old = getattr(self, column)
+            new = np.full(capacity, fill, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, column, new)
+
+    def __lookup(self, device, names):
+        """
+        # Returns:
+          Rows of the signal groups and a mask of the rows that were added
+          (Tuple[Union[numpy.ndarray, slice], numpy.ndarray])
+        """
+        names = tuple(names)
+        layout = self.__layouts.get(device)
+        if layout is not None and layout[0] == names:
+            return layout[1], None
+        device_id = self.__intern(self.__device_ids, self.devices, device)
+        rows = np.empty(len(names), dtype=np.int64)
+        added = np.zeros(len(names), dtype=bool)
+        for i, name in enumerate(names):
+            group_id = self.__intern(self.__group_ids, self.groups, name)
+            row = self.__rows.get((device_id, group_id))
+            if row is None:
+                row = self.__rows[(device_id, group_id)] = self.size
+                self.__grow(self.size + 1)
+                self.device[row] = device_id
+                self.group[row] = group_id
+                self.size += 1
+                added[i] = True
+            rows[i] = row
+        if len(rows) and np.array_equal(rows, np.arange(rows[0], rows[0] + len(rows))):
+            # the rows of a device are usually added at once, slices are faster than index arrays
+            rows = slice(int(rows[0]), int(rows[0]) + len(rows))
+        self.__layouts[device] = (names, rows)
+        return rows, added
+
+    def apply_snapshot(self, device: str, names: Sequence[str], codes: Sequence[str], timestamp: int) -> Transitions:
+        """
+        Updates the signal groups of a device from one state returned by the API.
+        Signal groups seen for the first time are initialized like SignalGroup.
+
+        # Parameters:
+          device: Device id, for example "TRE401" (str)
+          names: Names of the signal groups, each at most once (Sequence[str])
+          codes: GRINT status code of each signal group (Sequence[str])
+          timestamp: Time of the state in epoch milliseconds (int)
+        # Returns:
+          Status changes and completed cycles, in the order of the signal groups (Transitions)
+        """
+        if len(names) != len(codes):
+            raise ValueError("Every signal group needs a status code")
+        statuses = self.decode(codes)
+        rows, added = self.__lookup(device, names)
+        timestamp = np.int64(timestamp)
+
+        # new signal groups, like SignalGroup.__init__
+        if added is not None and added.any():
+            new_rows, new_statuses = _indices(rows)[added], statuses[added]
+            self.status[new_rows] = new_statuses
+            self.t_red_start[new_rows] = np.where(new_statuses == _RED, timestamp, NO_TIME)
+            self.t_green_start[new_rows] = NO_TIME
+
+        # status changes, like SignalGroup.update_state
+        changed = self.status[rows] != statuses
+        if not changed.any():
+            # most polls change nothing
+            return Transitions([], [])
+        if added is not None:
+            changed &= ~added
+        changed_rows, changed_statuses = _indices(rows)[changed], statuses[changed]
+
+        other = changed_rows[changed_statuses == _OTHER]
+        self.t_red_start[other] = NO_TIME
+        self.t_green_start[other] = NO_TIME
+
+        # transition directly from OTHER to GREEN leaves the cycle unstarted
+        green = changed_rows[changed_statuses == _GREEN]
+        green = green[self.t_red_start[green] != NO_TIME]
+        self.t_green_start[green] = timestamp
+
+        # transition from GREEN to RED completes the cycle
+        red = changed_rows[changed_statuses == _RED]
+        completed = red[self.t_green_start[red] != NO_TIME]
+        cycles = [(device, self.groups[group], int(red_start), int(green_start), int(timestamp))
+                  for group, red_start, green_start in zip(self.group[completed].tolist(),
+                                                           self.t_red_start[completed].tolist(),
+                                                           self.t_green_start[completed].tolist())]
+        self.t_red_start[red] = timestamp
+        self.t_green_start[red] = NO_TIME
+
+        self.status[changed_rows] = changed_statuses
+        changes = [(self.groups[group], Status(status))
+                   for group, status in zip(self.group[changed_rows].tolist(), changed_statuses.tolist())]
+        return Transitions(changes, cycles)
+
+    @staticmethod
+    def decode(codes: Sequence[str]) -> np.ndarray:
+        """
+        Decodes GRINT status codes like Status.decode, raising the same ValueError.
+
+        # Parameters:
+          codes: Status codes (Sequence[str])
+        # Returns:
+          Status values (numpy.ndarray of int8)
+        """
+        joined = "".join(codes)
+        # one character per code: as long as there are no empty codes, no code can be longer either
+        if len(joined) == len(codes) and "" not in codes and joined.isascii():
+            statuses = joined.encode("ascii").translate(_STATUS_OF_CODE)
+            if b"\0" not in statuses:
+                return np.frombuffer(statuses, dtype=np.int8)
+        # raises the error of the first invalid code
+        for code in codes:
+            Status.decode(code)
+        raise ValueError(f"Invalid traffic light status codes: {codes}")
+
+    def get(self, device: str, name: str) -> Optional[SignalGroupState]:
+        """
+        # Parameters:
+          device: Device id (str)
+          name: Signal group name (str)
+        # Returns:
+          State of the signal group, None if it has not been seen (Optional[SignalGroupState])
+        """
+        row = self.__rows.get((self.__device_ids.get(device), self.__group_ids.get(name)))
+        if row is None:
+            return None
+        t_red_start, t_green_start = int(self.t_red_start[row]), int(self.t_green_start[row])
+        return SignalGroupState(Status(int(self.status[row])),
+                                None if t_red_start == NO_TIME else t_red_start,
+                                None if t_green_start == NO_TIME else t_green_start)
@@ -46,11 +46,30 @@ class Status(Enum):
         # Returns:
           Either Status.RED, Status.GREEN, or Status.OTHER
         """
-        if len(status_str) != 1 or status_str < '0' or status_str > 'J':
+        try:
+            status = _DECODE_TABLE[ord(status_str)]
+        except (TypeError, IndexError):
+            # not a single character, or not a byte
+            status = None
+        if status is None:
             raise ValueError(f"Invalid traffic light status code: '{status_str}'")
-        if status_str in "?@ABCDEFGH90":  # includes amber after red
-            return Status.RED
-        elif status_str in "1345678:<>":  # includes amber after green
-            return Status.GREEN
+        return status
+
+
+def _decode_table():
+    """
+    # Returns:
+      Status of each character code from 0 to 255, None for invalid codes (Tuple[Optional[Status], ...])
+    """
+    table = [None] * 256
+    for code in range(ord('0'), ord('J') + 1):
+        if chr(code) in "?@ABCDEFGH90":  # includes amber after red
+            table[code] = Status.RED
+        elif chr(code) in "1345678:<>":  # includes amber after green
+            table[code] = Status.GREEN
         else:
-            return Status.OTHER
+            table[code] = Status.OTHER
+    return tuple(table)
+
+
+_DECODE_TABLE = _decode_table()
@@ -16,5 +16,12 @@ setup(
         "tensorflow",
         "tf2-yolov4",
     ],
+    extras_require={
+        # optional detector backends and the model conversion tool
+        "onnx": ["onnxruntime", "onnx", "onnxconverter-common", "tf2onnx"],
+        "tflite": ["tflite-runtime"],
+        # faster parsing of traffic light API responses
+        "fast": ["orjson"],
+    },
     packages=find_packages()
 )
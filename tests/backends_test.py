@@ -0,0 +1,250 @@
+import json
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from BusinessTampereTrafficMonitoring.object_detector.backends import backend_from_config
+from BusinessTampereTrafficMonitoring.object_detector.backends import BACKENDS
+from BusinessTampereTrafficMonitoring.object_detector.backends import create_backend
+from BusinessTampereTrafficMonitoring.object_detector.backends import dequantize
+from BusinessTampereTrafficMonitoring.object_detector.backends import DetectorBackend
+from BusinessTampereTrafficMonitoring.object_detector.backends import MAX_BOXES
+from BusinessTampereTrafficMonitoring.object_detector.backends import non_max_suppression
+from BusinessTampereTrafficMonitoring.object_detector.backends import quantize
+from BusinessTampereTrafficMonitoring.object_detector.backends import TensorFlowBackend
+from BusinessTampereTrafficMonitoring.object_detector.backends import TFLiteBackend
+from BusinessTampereTrafficMonitoring.object_detector.postprocessing import select_detections
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import letterbox
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import normalize
+
+# Sample video from https://sample-videos.com
+SOURCE = "tests/samples_for_tests/test.mp4"
+SIZE = 32
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        create_backend("caffe", "yolov4.h5", 608)
+
+
+def test_backends_have_to_implement_the_interface():
+    class NoInference(DetectorBackend):
+        def load(self):
+            pass
+
+    with pytest.raises(TypeError):
+        NoInference("yolov4.h5", 608)
+
+
+@pytest.mark.parametrize("name", sorted(BACKENDS))
+def test_backends_accept_the_shipped_options(name):
+    with open("config.json", "r") as configfile:
+        detector = dict(json.load(configfile)["detector"], backend=name)
+    assert type(backend_from_config(detector, 608)) is BACKENDS[name]
+
+
+def test_quantize():
+    values = np.array([-1.0, 0.0, 0.5, 1.0, 3.0], dtype=np.float32)
+    quantized = quantize(values, 1 / 127, 0, np.int8)
+    assert quantized.dtype == np.int8
+    assert quantized.tolist() == [-127, 0, 64, 127, 127]
+    assert np.allclose(dequantize(quantized, 1 / 127, 0)[:4], values[:4], atol=0.01)
+
+
+def test_non_max_suppression():
+    boxes = np.array([[[0.1, 0.1, 0.3, 0.3], [0.11, 0.1, 0.31, 0.3], [0.5, 0.5, 0.7, 0.7], [0.9, 0.9, 1.2, 1.2]]])
+    scores = np.zeros((1, 4, 3), dtype=np.float32)
+    # two overlapping cars, a truck on top of the first car, a separate car and a box below the threshold
+    scores[0, :, 2] = [0.8, 0.9, 0.6, 0.4]
+    scores[0, 0, 1] = 0.7
+    out_boxes, out_scores, classes, valid_detections = non_max_suppression(boxes, scores, max_boxes=5)
+    assert out_boxes.shape == (1, 5, 4) and out_scores.shape == classes.shape == (1, 5)
+    assert valid_detections.tolist() == [3]
+    # the best boxes of all classes first, the weaker overlapping car is suppressed
+    assert np.allclose(out_scores[0], [0.9, 0.7, 0.6, 0, 0])
+    assert classes[0].tolist() == [2, 1, 2, 0, 0]
+    assert np.allclose(out_boxes[0, :3], boxes[0, [1, 0, 2]])
+    assert not out_boxes[0, 3:].any()
+    # at most max_boxes
+    _, _, _, valid_detections = non_max_suppression(boxes, scores, max_boxes=2)
+    assert valid_detections.tolist() == [2]
+    _, _, _, valid_detections = non_max_suppression(np.zeros((2, 0, 4)), np.zeros((2, 0, 80)))
+    assert valid_detections.tolist() == [0, 0]
+
+
+class FakeInterpreter:
+    """
+    Interpreter of a model exported without the non-maximum suppression, detecting
+    a box in the middle of the image with the mean of the image as the score of a car.
+    """
+    def __init__(self):
+        self.batch = None
+
+    def get_input_details(self):
+        return [{"index": 0, "dtype": np.float32, "quantization": (0.0, 0)}]
+
+    def get_output_details(self):
+        # boxes and scores of two anchors and three classes, the order of the names is not the order of the outputs
+        return [{"index": 2, "name": "StatefulPartitionedCall:1", "quantization": (0.0, 0)},
+                {"index": 1, "name": "StatefulPartitionedCall:0", "quantization": (0.0, 0)}]
+
+    def resize_tensor_input(self, index, shape):
+        pass
+
+    def allocate_tensors(self):
+        pass
+
+    def set_tensor(self, index, batch):
+        self.batch = batch
+
+    def invoke(self):
+        pass
+
+    def get_tensor(self, index):
+        if index == 1:
+            boxes = np.array([[0.25, 0.25, 0.75, 0.75], [0.0, 0.0, 0.1, 0.1]], np.float32)
+            return np.tile(boxes, (len(self.batch), 1, 1))
+        scores = np.zeros((len(self.batch), 2, 3), np.float32)
+        scores[:, 0, 2] = self.batch.mean(axis=(1, 2, 3))
+        return scores
+
+
+def test_tflite_backend_suppresses_with_numpy():
+    backend = TFLiteBackend("yolov4.tflite", SIZE)
+    backend.interpreter = FakeInterpreter()
+    backend.batch_size = None
+    batch = np.stack([np.full((SIZE, SIZE, 3), value, np.float32) for value in (0.25, 0.75)])
+    boxes, scores, classes, valid_detections = backend.infer(batch)
+    assert boxes.shape == (2, MAX_BOXES, 4) and scores.shape == classes.shape == (2, MAX_BOXES)
+    assert valid_detections.tolist() == [0, 1]
+    assert np.allclose(boxes[1, 0], [0.25, 0.25, 0.75, 0.75])
+    assert classes[1, 0] == 2
+
+
+def mean_model(path):
+    """
+    ONNX model with the outputs of YOLOv4 that fills every output with the mean of the image.
+    """
+    onnx = pytest.importorskip("onnx")
+    from onnx import helper
+    from onnx import TensorProto
+
+    nodes = [
+        helper.make_node("ReduceMean", ["input"], ["mean"], axes=[1, 2, 3], keepdims=0),
+        helper.make_node("Constant", [], ["axes"], value=helper.make_tensor("a", TensorProto.INT64, [1], [1])),
+        helper.make_node("Unsqueeze", ["mean", "axes"], ["mean_2d"]),
+        helper.make_node("Unsqueeze", ["mean_2d", "axes"], ["mean_3d"]),
+        helper.make_node("Constant", [], ["shape_2d"],
+                         value=helper.make_tensor("s2", TensorProto.INT64, [2], [1, MAX_BOXES])),
+        helper.make_node("Constant", [], ["shape_3d"],
+                         value=helper.make_tensor("s3", TensorProto.INT64, [3], [1, MAX_BOXES, 4])),
+        helper.make_node("Expand", ["mean_3d", "shape_3d"], ["boxes"]),
+        helper.make_node("Expand", ["mean_2d", "shape_2d"], ["scores"]),
+        helper.make_node("Expand", ["mean_2d", "shape_2d"], ["classes"]),
+        helper.make_node("Cast", ["mean"], ["valid_detections"], to=TensorProto.INT32),
+    ]
+    graph = helper.make_graph(
+        nodes, "mean",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, ["batch", SIZE, SIZE, 3])],
+        [helper.make_tensor_value_info("boxes", TensorProto.FLOAT, None),
+         helper.make_tensor_value_info("scores", TensorProto.FLOAT, None),
+         helper.make_tensor_value_info("classes", TensorProto.FLOAT, None),
+         helper.make_tensor_value_info("valid_detections", TensorProto.INT32, None)],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, path)
+
+
+def test_onnxruntime_backend(tmp_path):
+    pytest.importorskip("onnxruntime")
+    path = str(tmp_path / "mean.onnx")
+    mean_model(path)
+    backend = create_backend("onnxruntime", path, SIZE)
+    backend.load()
+    backend.warmup(batch_size=2)
+    batch = np.stack([np.full((SIZE, SIZE, 3), value, np.float32) for value in (0.25, 2.0)])
+    boxes, scores, classes, valid_detections = backend.infer(batch)
+    assert boxes.shape == (2, MAX_BOXES, 4)
+    assert scores.shape == classes.shape == (2, MAX_BOXES)
+    assert np.allclose(boxes[:, 0, 0], [0.25, 2.0])
+    assert valid_detections.tolist() == [0, 2]
+
+
+def sample_batches(size, count=5):
+    capture = cv2.VideoCapture(SOURCE)
+    image = np.empty((size, size, 3), np.uint8)
+    for _ in range(count):
+        ret, frame = capture.read()
+        assert ret
+        letterbox(frame, image)
+        yield normalize(image, np.empty((1, size, size, 3), np.float32)[0])[None]
+    capture.release()
+
+
+@pytest.mark.parametrize("backend_name, model_path", [("onnxruntime", "yolov4.onnx"), ("tflite", "yolov4.tflite")])
+def test_backend_parity(backend_name, model_path):
+    """
+    Converted models have to count the same vehicles as the original one.
+    Needs the weights and the converted models (tools/convert_model.py) in the working directory.
+    """
+    pytest.importorskip("tf2_yolov4")
+    pytest.importorskip("onnxruntime" if backend_name == "onnxruntime" else "tensorflow")
+    for path in ("yolov4.h5", model_path):
+        if not os.path.exists(path):
+            pytest.skip(f"{path} not found")
+    reference = create_backend("tensorflow", "yolov4.h5", 608)
+    converted = create_backend(backend_name, model_path, 608)
+    reference.load()
+    converted.load()
+    for batch in sample_batches(608):
+        counts = []
+        for backend in (reference, converted):
+            boxes, scores, classes, valid_detections = backend.infer(batch)
+            _, vehicles = select_detections(boxes[0], classes[0], int(valid_detections[0]))
+            counts.append(int(vehicles.sum()))
+        assert counts[0] == counts[1]
+
+
+def test_artifact_path_depends_on_weights_and_shape(tmp_path):
+    weights = tmp_path / "yolov4.h5"
+    weights.write_bytes(b"weights")
+    path = create_backend("tensorflow", str(weights), 608, artifact_dir=str(tmp_path)).artifact_path()
+    assert path.startswith(str(tmp_path))
+    assert create_backend("tensorflow", str(weights), 416, artifact_dir=str(tmp_path)).artifact_path() != path
+    weights.write_bytes(b"other weights")
+    assert create_backend("tensorflow", str(weights), 608, artifact_dir=str(tmp_path)).artifact_path() != path
+
+
+class CountingBackend(TensorFlowBackend):
+    """
+    Builds a small Keras model with the outputs of YOLOv4 instead of loading the weights.
+    """
+    builds = 0
+
+    def build(self):
+        tf = pytest.importorskip("tensorflow")
+        CountingBackend.builds += 1
+        batch = tf.keras.Input((self.input_size, self.input_size, 3))
+        mean = tf.keras.layers.Lambda(lambda x: tf.reduce_mean(x, axis=[1, 2, 3]))(batch)
+        boxes = tf.keras.layers.Lambda(lambda m: tf.tile(m[:, None, None], [1, MAX_BOXES, 4]))(mean)
+        scores = tf.keras.layers.Lambda(lambda m: tf.tile(m[:, None], [1, MAX_BOXES]))(mean)
+        valid_detections = tf.keras.layers.Lambda(lambda m: tf.cast(m, tf.int32))(mean)
+        return tf.keras.Model(batch, [boxes, scores, scores, valid_detections])
+
+
+def test_compiled_model_is_reused(tmp_path):
+    pytest.importorskip("tensorflow")
+    weights = tmp_path / "yolov4.h5"
+    weights.write_bytes(b"weights")
+    artifacts = tmp_path / "model_cache"
+    for _ in range(2):
+        backend = CountingBackend(str(weights), SIZE, artifact_dir=str(artifacts))
+        backend.load()
+        backend.warmup()
+        boxes, scores, classes, valid_detections = backend.infer(np.full((2, SIZE, SIZE, 3), 2.0, np.float32))
+        assert boxes.shape == (2, MAX_BOXES, 4) and valid_detections.tolist() == [2, 2]
+    assert CountingBackend.builds == 1
+    assert len(os.listdir(artifacts)) == 1
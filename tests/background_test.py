@@ -0,0 +1,89 @@
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+
+from BusinessTampereTrafficMonitoring.object_detector.background import BackgroundDetector
+from BusinessTampereTrafficMonitoring.object_detector.background import cpu_headroom
+from BusinessTampereTrafficMonitoring.object_detector.detection_cache import DetectionCache
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import Region
+from BusinessTampereTrafficMonitoring.object_detector.scheduler import PRIORITY_BACKGROUND
+from BusinessTampereTrafficMonitoring.stream_reader.frame_cache import FrameCache
+
+FRAME = np.zeros((4, 4, 3), np.uint8)
+
+
+class FakeReader:
+    def __init__(self):
+        self.cache = FrameCache(10, (4, 4, 3))
+
+    def get_timestamped_frame(self, epoch_time=None):
+        return self.cache.get(1e12 if epoch_time is None else epoch_time)
+
+
+class FakeScheduler:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, image, priority):
+        self.submitted.append((image.shape, priority, Future()))
+        return self.submitted[-1][2]
+
+
+def make_detector(every_nth_frame=1, headroom=lambda max_load: True):
+    reader = FakeReader()
+    scheduler = FakeScheduler()
+    cache = DetectionCache(10)
+    detector = BackgroundDetector({"cam": reader}, {"cam": Region(0, 0, 2, 2)}, scheduler, cache,
+                                  every_nth_frame=every_nth_frame, headroom=headroom)
+    return detector, reader, scheduler, cache
+
+
+def test_new_frames_are_detected_once():
+    detector, reader, scheduler, cache = make_detector()
+    detector.step()
+    assert scheduler.submitted == []
+    reader.cache.store(1.0, FRAME)
+    detector.step()
+    detector.step()
+    assert len(scheduler.submitted) == 1
+    shape, priority, future = scheduler.submitted[0]
+    assert shape == (2, 2, 3) and priority == PRIORITY_BACKGROUND
+    assert cache.nearest("cam", 1.2, tolerance=0.5) == (1.0, future)
+
+
+def test_pending_detection_is_not_queued_twice():
+    detector, reader, scheduler, _ = make_detector()
+    reader.cache.store(1.0, FRAME)
+    detector.step()
+    reader.cache.store(2.0, FRAME)
+    detector.step()
+    assert len(scheduler.submitted) == 1 and detector.skipped == 1
+    scheduler.submitted[0][2].set_result(None)
+    reader.cache.store(3.0, FRAME)
+    detector.step()
+    assert len(scheduler.submitted) == 2
+
+
+def test_every_nth_frame():
+    detector, reader, scheduler, _ = make_detector(every_nth_frame=2)
+    for timestamp in range(1, 6):
+        reader.cache.store(timestamp, FRAME)
+        detector.step()
+        for _, _, future in scheduler.submitted:
+            if not future.done():
+                future.set_result(None)
+    assert detector.submitted == 3
+
+
+def test_no_detection_without_headroom():
+    detector, reader, scheduler, _ = make_detector(headroom=lambda max_load: False)
+    reader.cache.store(1.0, FRAME)
+    detector.step()
+    assert scheduler.submitted == [] and detector.skipped == 1
+
+
+def test_cpu_headroom():
+    assert cpu_headroom(float("inf"))
+    with pytest.raises(ValueError):
+        make_detector(every_nth_frame=0)
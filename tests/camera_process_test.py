@@ -0,0 +1,57 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from BusinessTampereTrafficMonitoring.stream_reader.camera_process import CameraProcess
+from BusinessTampereTrafficMonitoring.stream_reader.supervisor import StreamHealth
+
+SOURCE = "tests/samples_for_tests/test.mp4"
+
+
+def test_invalid_source():
+    with pytest.raises(IOError):
+        CameraProcess(":")
+
+
+def shared_memory_blocks():
+    # multiprocessing.shared_memory names its blocks psm_*, the semaphores of the locks are in the same directory
+    if not os.path.isdir("/dev/shm"):
+        return set()
+    return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")}
+
+
+def test_frames_from_shared_memory():
+    blocks = shared_memory_blocks()
+    camera = CameraProcess(SOURCE, cache_size=10, sample_interval=0)
+    try:
+        assert camera.get_constants() == (320, 160)
+        deadline = time.time() + 30
+        while len(camera.cache) < 10 and time.time() < deadline:
+            time.sleep(0.05)
+        assert len(camera.cache) == 10
+        assert camera.health in (StreamHealth.STREAMING, StreamHealth.DEGRADED, StreamHealth.CONNECTING)
+        frame = camera.get_frame()
+        assert frame.shape == (160, 320, 3)
+        assert frame.any()
+        assert np.shares_memory(frame, camera.cache.frames)
+        assert not frame.flags.writeable
+    finally:
+        camera.stop()
+    assert not camera.process.is_alive()
+    assert camera.health == StreamHealth.DOWN
+    assert shared_memory_blocks() == blocks
+    with pytest.raises(LookupError):
+        camera.get_frame()
+
+
+def test_shared_memory_is_removed_when_the_process_is_killed():
+    blocks = shared_memory_blocks()
+    camera = CameraProcess(SOURCE, cache_size=10, sample_interval=0)
+    if os.path.isdir("/dev/shm"):
+        assert len(shared_memory_blocks() - blocks) == 1
+    camera.process.kill()
+    camera.process.join()
+    camera.stop()
+    assert shared_memory_blocks() == blocks
@@ -0,0 +1,44 @@
+import pytest
+
+from BusinessTampereTrafficMonitoring.object_detector.consensus import consensus
+from BusinessTampereTrafficMonitoring.object_detector.lane_index import LaneCount
+from BusinessTampereTrafficMonitoring.object_detector.lane_index import LaneIndex
+
+LANES = LaneIndex([
+    {"lane": "Lane1", "intersection_id": "TRE401", "camera_id": "cam", "signal_groups": ["A"], "vertices": []},
+    {"lane": "Lane2", "intersection_id": "TRE401", "camera_id": "cam", "signal_groups": ["A"], "vertices": []},
+]).lanes
+
+
+def frames(*counts):
+    return [[LaneCount(lane, cars) for lane, cars in zip(LANES, frame_counts)] for frame_counts in counts]
+
+
+def test_median_ignores_an_outlier():
+    result = consensus(frames((4, 1), (0, 1), (5, 2)))
+    assert result.lane_counts == [LaneCount(LANES[0], 4), LaneCount(LANES[1], 1)]
+    assert result.spreads == {"Lane1": 5, "Lane2": 1}
+    assert result.frames == 3
+
+
+def test_median_rounds_halves_up():
+    result = consensus(frames((3, 0), (4, 0)))
+    assert [cars for _, cars in result.lane_counts] == [4, 0]
+
+
+def test_max():
+    result = consensus(frames((4, 1), (0, 1), (5, 2)), aggregate="max")
+    assert [cars for _, cars in result.lane_counts] == [5, 2]
+
+
+def test_single_frame():
+    result = consensus(frames((2, 3)))
+    assert [cars for _, cars in result.lane_counts] == [2, 3]
+    assert result.spreads == {"Lane1": 0, "Lane2": 0}
+
+
+def test_invalid_input():
+    with pytest.raises(ValueError):
+        consensus(frames((1, 1)), aggregate="mean")
+    with pytest.raises(ValueError):
+        consensus([])
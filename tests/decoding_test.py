@@ -0,0 +1,72 @@
+import pytest
+
+from BusinessTampereTrafficMonitoring.tools.benchmark_decoding import benchmark
+from BusinessTampereTrafficMonitoring.tools.benchmark_decoding import decode_state
+from BusinessTampereTrafficMonitoring.tools.benchmark_decoding import device_states
+from BusinessTampereTrafficMonitoring.tools.benchmark_decoding import legacy_decode
+from BusinessTampereTrafficMonitoring.tools.benchmark_decoding import legacy_decode_state
+from BusinessTampereTrafficMonitoring.tools.benchmark_decoding import legacy_parse_date
+from BusinessTampereTrafficMonitoring.traffic_lights import decoding
+from BusinessTampereTrafficMonitoring.traffic_lights.status import Status
+
+
+def test_decode_table_matches_the_rules():
+    for code in range(260):
+        try:
+            expected = legacy_decode(chr(code))
+        except ValueError:
+            with pytest.raises(ValueError):
+                Status.decode(chr(code))
+        else:
+            assert Status.decode(chr(code)) is expected
+
+
+@pytest.mark.parametrize("status_code", ["", "AB", "Ł"])
+def test_decode_invalid(status_code):
+    with pytest.raises(ValueError):
+        Status.decode(status_code)
+
+
+@pytest.mark.parametrize("timestamp", [
+    "2021-10-08T02:56:55+03:00",
+    "2021-12-31T23:59:59-05:30",
+    "2020-02-29T00:00:00+00:00",
+    # not in the layout of the API, parsed by strptime
+    "2021-10-08T02:56:55+0300",
+    "2021-10-08T02:56:55Z",
+])
+def test_parse_timestamp(timestamp):
+    assert decoding.parse_timestamp(timestamp) == legacy_parse_date(timestamp)
+    assert decoding.parse_timestamp(timestamp).utcoffset() == legacy_parse_date(timestamp).utcoffset()
+    assert decoding.parse_epoch_time(timestamp) == legacy_parse_date(timestamp).timestamp()
+
+
+@pytest.mark.parametrize("timestamp", ["2021-13-08T02:56:55+03:00", "2021-10-08T02:56:+5+03:00",
+                                       "2021-10-08 02:56:55+03:00", "2021-10-08T02:56:55"])
+def test_parse_invalid_timestamp(timestamp):
+    with pytest.raises(ValueError):
+        legacy_parse_date(timestamp)
+    with pytest.raises(ValueError):
+        decoding.parse_timestamp(timestamp)
+
+
+@pytest.mark.parametrize("orjson", [True, False])
+def test_loads(monkeypatch, orjson):
+    if orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(decoding, "orjson", None)
+    assert decoding.loads(b'{"device": "TRE401", "signalGroup": []}') == {"device": "TRE401", "signalGroup": []}
+    with pytest.raises(ValueError):
+        decoding.loads(b'{"device": ')
+
+
+def test_benchmark():
+    for body in device_states(30):
+        assert decode_state(body) == legacy_decode_state(body)
+    results = benchmark(devices=20, repeat=1)
+    names = [name for name, _, _ in results]
+    assert names[:3] == ["Status.decode", "timestamp, first parse", "timestamp, stored cycle"]
+    # memoized timestamps are not parsed again
+    _, legacy, current = results[2]
+    assert current < legacy
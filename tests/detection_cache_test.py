@@ -0,0 +1,95 @@
+from concurrent.futures import Future
+
+import pytest
+
+from BusinessTampereTrafficMonitoring.object_detector.detection_cache import DetectionCache
+
+
+class Submitter:
+    def __init__(self):
+        self.futures = []
+
+    def __call__(self):
+        self.futures.append(Future())
+        return self.futures[-1]
+
+
+def test_same_frame_is_detected_once():
+    cache = DetectionCache(4)
+    submit = Submitter()
+    first = cache.get_or_submit("cam", 10.0, submit)
+    second = cache.get_or_submit("cam", 10.0, submit)
+    assert first is second
+    assert len(submit.futures) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.get_or_submit("other", 10.0, submit)
+    assert len(submit.futures) == 2
+
+
+def test_least_recently_used_is_evicted():
+    cache = DetectionCache(2)
+    submit = Submitter()
+    cache.get_or_submit("cam", 1.0, submit)
+    cache.get_or_submit("cam", 2.0, submit)
+    cache.get_or_submit("cam", 1.0, submit)
+    cache.get_or_submit("cam", 3.0, submit)
+    assert len(cache) == 2
+    cache.get_or_submit("cam", 1.0, submit)
+    assert len(submit.futures) == 3
+    cache.get_or_submit("cam", 2.0, submit)
+    assert len(submit.futures) == 4
+
+
+def test_evicted_with_frames():
+    cache = DetectionCache(10)
+    submit = Submitter()
+    for timestamp in (1.0, 2.0, 3.0):
+        cache.get_or_submit("cam", timestamp, submit)
+    cache.get_or_submit("other", 1.0, submit)
+    cache.evict_before("cam", 2.5)
+    assert len(cache) == 2
+    cache.get_or_submit("other", 1.0, submit)
+    assert len(submit.futures) == 4
+
+
+def test_failed_results_are_not_reused():
+    cache = DetectionCache(4)
+    submit = Submitter()
+    cache.get_or_submit("cam", 1.0, submit).set_exception(RuntimeError())
+    retry = cache.get_or_submit("cam", 1.0, submit)
+    assert retry is submit.futures[1]
+
+
+def test_nearest():
+    cache = DetectionCache(10)
+    submit = Submitter()
+    for timestamp in (1.0, 2.0, 3.0):
+        cache.get_or_submit("cam", timestamp, submit)
+    assert cache.nearest("cam", 2.4, tolerance=1.0) == (2.0, submit.futures[1])
+    assert cache.nearest("cam", 4.5, tolerance=1.0) is None
+    assert cache.nearest("other", 2.0, tolerance=1.0) is None
+
+
+def test_nearest_skips_failed_and_evicted_results():
+    cache = DetectionCache(4)
+    submit = Submitter()
+    for timestamp in (1.0, 2.0, 3.0, 4.0):
+        cache.get_or_submit("cam", timestamp, submit)
+    # the least recently used result of 1.0 is evicted by a result of another camera
+    cache.get_or_submit("other", 4.0, submit)
+    assert cache.nearest("cam", 1.0, tolerance=0.5) is None
+    assert cache.nearest("other", 4.2, tolerance=0.5) == (4.0, submit.futures[4])
+    # 3.0 failed, 2.0 is the nearest usable result
+    submit.futures[2].set_exception(RuntimeError())
+    assert cache.nearest("cam", 2.9, tolerance=1.5) == (2.0, submit.futures[1])
+    assert cache.nearest("cam", 2.9, tolerance=0.5) is None
+    # ties go to the older frame
+    assert cache.nearest("cam", 3.0, tolerance=1.0) == (2.0, submit.futures[1])
+    cache.evict_before("cam", 2.5)
+    assert cache.nearest("cam", 2.0, tolerance=1.5) is None
+    assert cache.nearest("cam", 2.0, tolerance=2.5) == (4.0, submit.futures[3])
+
+
+def test_invalid_capacity():
+    with pytest.raises(ValueError):
+        DetectionCache(0)
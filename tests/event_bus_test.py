@@ -0,0 +1,42 @@
+from BusinessTampereTrafficMonitoring.traffic_lights.event_bus import EventBus
+
+
+def test_subscribers_get_the_events_of_their_topic():
+    bus = EventBus()
+    first, second, other = [], [], []
+    bus.subscribe("light_changed", lambda *event: first.append(event))
+    bus.subscribe("light_changed", lambda *event: second.append(event))
+    bus.subscribe("cycle_completed", lambda *event: other.append(event))
+    bus.publish("light_changed", "TRE401", "A")
+    assert first == second == [("TRE401", "A")]
+    assert other == []
+    # topics without subscribers
+    bus.publish("poll_failed", "TRE401", "HTTP 500")
+
+
+def test_unsubscribe():
+    bus = EventBus()
+    events = []
+
+    def subscriber(*event):
+        events.append(event)
+
+    bus.subscribe("light_changed", subscriber)
+    bus.publish("light_changed", 1)
+    bus.unsubscribe("light_changed", subscriber)
+    bus.unsubscribe("light_changed", subscriber)
+    bus.publish("light_changed", 2)
+    assert events == [(1,)]
+
+
+def test_failing_subscriber_does_not_affect_others():
+    bus = EventBus()
+    events = []
+
+    def failing(*event):
+        raise RuntimeError("database is down")
+
+    bus.subscribe("cycle_completed", failing)
+    bus.subscribe("cycle_completed", events.append)
+    bus.publish("cycle_completed", "cycle")
+    assert events == ["cycle"]
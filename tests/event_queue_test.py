@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+from BusinessTampereTrafficMonitoring.traffic_lights.event_queue import LightChangeQueue
+from BusinessTampereTrafficMonitoring.traffic_lights.status import Status
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_events_are_handled_by_workers():
+    handled = []
+    queue = LightChangeQueue(lambda *event: handled.append(event), workers=2)
+    now = time.time()
+    assert queue.put("TRE401", "A", now, Status.RED)
+    assert queue.put("TRE401", "B", now, Status.GREEN)
+    wait_until(lambda: queue.handled == 2)
+    queue.stop()
+    assert sorted(handled) == [("TRE401", "A", now, Status.RED), ("TRE401", "B", now, Status.GREEN)]
+
+
+def test_put_does_not_wait_for_the_handler():
+    release = threading.Event()
+    queue = LightChangeQueue(lambda *event: release.wait(), workers=1)
+    started = time.monotonic()
+    for name in "ABC":
+        queue.put("TRE401", name, time.time(), Status.RED)
+    assert time.monotonic() - started < 0.5
+    release.set()
+    wait_until(lambda: queue.handled == 3)
+    queue.stop()
+
+
+def test_oldest_events_are_dropped_when_full():
+    release = threading.Event()
+    handled = []
+
+    def handler(*event):
+        release.wait()
+        handled.append(event[1])
+
+    queue = LightChangeQueue(handler, workers=1, capacity=2)
+    queue.put("TRE401", "A", time.time(), Status.RED)
+    wait_until(lambda: queue.pending() == 0)
+    for name in "BCD":
+        queue.put("TRE401", name, time.time(), Status.RED)
+    assert queue.dropped_full == 1
+    release.set()
+    wait_until(lambda: queue.handled == 3)
+    queue.stop()
+    assert handled == ["A", "C", "D"]
+
+
+def test_stale_events_are_dropped():
+    handled = []
+    queue = LightChangeQueue(lambda *event: handled.append(event[1]), max_delay=10.0)
+    queue.put("TRE401", "A", time.time() - 20.0, Status.RED)
+    queue.put("TRE401", "B", time.time(), Status.RED)
+    wait_until(lambda: queue.handled == 1)
+    queue.stop()
+    assert handled == ["B"]
+    assert queue.dropped_stale == 1
+
+
+def test_failing_handler_does_not_stop_the_worker():
+    handled = []
+
+    def handler(device, signal_group, timestamp, status):
+        if signal_group == "A":
+            raise RuntimeError("detection failed")
+        handled.append(signal_group)
+
+    queue = LightChangeQueue(handler, workers=1)
+    queue.put("TRE401", "A", time.time(), Status.RED)
+    queue.put("TRE401", "B", time.time(), Status.RED)
+    wait_until(lambda: queue.handled == 2)
+    queue.stop()
+    assert handled == ["B"]
+
+
+def test_stop_discards_queued_events():
+    release = threading.Event()
+    queue = LightChangeQueue(lambda *event: release.wait(), workers=1)
+    for name in "ABC":
+        queue.put("TRE401", name, time.time(), Status.RED)
+    wait_until(lambda: queue.pending() == 2)
+    queue.stop(wait=False)
+    assert queue.pending() == 0
+    release.set()
+    queue.stop()
+    assert queue.handled == 1
+    assert not queue.put("TRE401", "D", time.time(), Status.RED)
+
+
+def test_invalid_parameters():
+    with pytest.raises(ValueError):
+        LightChangeQueue(print, workers=0)
+    with pytest.raises(ValueError):
+        LightChangeQueue(print, capacity=0)
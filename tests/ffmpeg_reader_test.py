@@ -0,0 +1,77 @@
+import json
+import shutil
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from BusinessTampereTrafficMonitoring.stream_reader.factory import create_stream_reader
+from BusinessTampereTrafficMonitoring.stream_reader.ffmpeg_reader import FFmpegStreamReader
+from BusinessTampereTrafficMonitoring.stream_reader.stream_reader import FrameTransform
+from BusinessTampereTrafficMonitoring.stream_reader.stream_reader import StreamReader
+
+SOURCE = "tests/samples_for_tests/test.mp4"
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+
+
+def test_frame_transform():
+    transform = FrameTransform(100, 50, 2, 4)
+    boxes = np.array([[0, 0, 10, 10], [1, 2, 3, 4]])
+    assert (transform.to_source(boxes) == [[100, 50, 120, 90], [102, 58, 106, 66]]).all()
+    assert np.allclose(transform.to_frame(transform.to_source(boxes)), boxes)
+    assert (FrameTransform().to_source([[3, 4]]) == [[3, 4]]).all()
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        create_stream_reader(SOURCE, backend="gstreamer")
+
+
+def test_opencv_backend():
+    assert isinstance(create_stream_reader(SOURCE, cache_size=10), StreamReader)
+
+
+@requires_ffmpeg
+def test_invalid_source():
+    with pytest.raises(IOError):
+        FFmpegStreamReader("tests/samples_for_tests/missing.mp4")
+
+
+@requires_ffmpeg
+def test_get_constants():
+    assert FFmpegStreamReader(SOURCE).get_constants() == (320, 160)
+    assert FFmpegStreamReader(SOURCE, scale=[160, -1]).get_constants() == (160, 80)
+    sr = FFmpegStreamReader(SOURCE, crop=[200, 100, 40, 20], scale=[100, 50])
+    assert sr.get_constants() == (100, 50)
+    assert sr.get_transform() == FrameTransform(40, 20, 2, 2)
+
+
+@requires_ffmpeg
+def test_read_stream():
+    sr = create_stream_reader(SOURCE, backend="ffmpeg", sample_interval=1.0, scale=[-1, 80])
+    reader = threading.Thread(target=sr.read_stream)
+    reader.start()
+    # the sample video is 15 seconds long, after that ffmpeg is restarted
+    deadline = time.time() + 30
+    while len(sr.cache) < 15 and time.time() < deadline:
+        time.sleep(0.05)
+    sr.stop()
+    reader.join(timeout=10)
+    assert not reader.is_alive()
+    assert len(sr.cache) >= 15
+    frame = sr.get_frame()
+    assert frame.shape == (80, 160, 3)
+    assert frame.any()
+
+
+@pytest.mark.parametrize("backend", ["opencv", "ffmpeg"])
+def test_backends_accept_the_shipped_options(backend, monkeypatch):
+    with open("config.json", "r") as configfile:
+        options = dict(json.load(configfile)["stream_reader"], backend=backend)
+    # the size is probed without ffmpeg, no stream is opened before read_stream()
+    monkeypatch.setattr(FFmpegStreamReader, "probe_size", staticmethod(lambda ffmpeg, video_location: (320, 160)))
+    sr = create_stream_reader(SOURCE, **options)
+    assert isinstance(sr, FFmpegStreamReader if backend == "ffmpeg" else StreamReader)
+    assert sr.get_constants() == (320, 160)
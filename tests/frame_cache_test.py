@@ -0,0 +1,105 @@
+import threading
+
+import numpy as np
+import pytest
+
+from BusinessTampereTrafficMonitoring.stream_reader.frame_cache import FrameCache
+
+
+def make_cache(timestamps, capacity=5):
+    cache = FrameCache(capacity, (2, 2, 3))
+    for t in timestamps:
+        cache.store(t, np.full((2, 2, 3), t, np.uint8))
+    return cache
+
+
+def test_empty_cache():
+    cache = FrameCache(3, (2, 2, 3))
+    assert len(cache) == 0
+    with pytest.raises(LookupError):
+        cache.get(0)
+
+
+def test_invalid_capacity():
+    with pytest.raises(ValueError):
+        FrameCache(0, (2, 2, 3))
+
+
+def test_nearest_frame():
+    cache = make_cache([1, 4, 7, 8, 12])
+    assert cache.get(3)[0] == 4
+    assert cache.get(5.5)[0] == 4
+    assert cache.get(7.6)[0] == 8
+    assert cache.get(9999)[0] == 12
+    assert cache.get(-123)[0] == 1
+    timestamp, frame = cache.get(10.5)
+    assert timestamp == 12
+    assert (frame == 12).all()
+
+
+def test_wrap_around():
+    cache = make_cache(range(1, 13), capacity=5)
+    assert len(cache) == 5
+    assert cache.get(0)[0] == 8
+    assert cache.get(10.2)[0] == 10
+    assert cache.get(100)[0] == 12
+    assert (cache.get(9)[1] == 9).all()
+
+
+def test_frames_are_read_only_views():
+    cache = make_cache([1, 2])
+    _, frame = cache.get(1)
+    assert not frame.flags.writeable
+    assert np.shares_memory(frame, cache.frames)
+    with pytest.raises(ValueError):
+        frame[0, 0, 0] = 0
+
+
+def test_timestamps_have_to_be_monotonic():
+    cache = make_cache([1, 2])
+    with pytest.raises(ValueError):
+        cache.store(1.5, np.zeros((2, 2, 3), np.uint8))
+
+
+def test_oldest():
+    assert FrameCache(3, (2, 2, 3)).oldest() is None
+    cache = make_cache([1, 4, 7, 8], capacity=3)
+    assert cache.oldest() == 4
+
+
+def test_window():
+    cache = make_cache([1, 2, 3, 4, 5, 6])
+    assert [t for t, _ in cache.window(4.2, 3)] == [3, 4, 5]
+    assert [t for t, _ in cache.window(4.2, 2)] == [4, 5]
+    # shifted at the ends of the cache
+    assert [t for t, _ in cache.window(0, 3)] == [2, 3, 4]
+    assert [t for t, _ in cache.window(100, 3)] == [4, 5, 6]
+    # shorter than requested when the cache holds fewer frames
+    assert [t for t, _ in cache.window(4, 10)] == [2, 3, 4, 5, 6]
+    assert not cache.window(4, 1)[0][1].flags.writeable
+    with pytest.raises(ValueError):
+        cache.window(4, 0)
+
+
+def test_since():
+    assert FrameCache(3, (2, 2, 3)).since() == []
+    cache = make_cache([1, 2, 3, 4, 5, 6])
+    assert [t for t, _ in cache.since()] == [2, 3, 4, 5, 6]
+    assert [t for t, _ in cache.since(4)] == [5, 6]
+    assert [t for t, _ in cache.since(4.5)] == [5, 6]
+    # evicted frames are gone
+    assert [t for t, _ in cache.since(0)] == [2, 3, 4, 5, 6]
+    assert cache.since(6) == []
+    assert (cache.since(5)[0][1] == 6).all()
+
+
+def test_lock_timeout():
+    lock = threading.Lock()
+    cache = FrameCache(3, (2, 2, 3), lock=lock, lock_timeout=0.05)
+    cache.store(1, np.zeros((2, 2, 3), np.uint8))
+    # held by a writer that died
+    lock.acquire()
+    with pytest.raises(LookupError):
+        cache.get(1)
+    lock.release()
+    assert cache.get(1)[0] == 1
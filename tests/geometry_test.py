@@ -1,4 +1,4 @@
-import pytest
+import numpy as np
 
 import BusinessTampereTrafficMonitoring.tools.geometry as geom
 
@@ -24,7 +24,6 @@ def test_duplicate_points():
     assert len(geom.convex_hull(points)) == 2
 
 
-@pytest.mark.xfail(reason="Inconsequential edge case, not implemented yet")
 def test_convex_hull_points_on_the_edge():
     # to keep polygons minimal the points on an existing edge should
     # ideally not be included in the convex hull
@@ -85,3 +84,42 @@ def test_many_points():
            (-0.3521487911717489, 0.4352656197131292), ]
     hull = geom.convex_hull(points)
     assert hull == ans
+
+
+def test_polygon_contains():
+    # vertices from config.json are lists and not necessarily in hull order
+    polygon = geom.Polygon([[1535, 401], [1257, 174], [1273, 404], [1365, 173]])
+    inside = polygon.contains([(1300, 200), (1400, 300), (1250, 300), (1500, 200), (1270, 410)])
+    assert inside.tolist() == [True, True, False, False, False]
+
+
+def test_degenerate_polygon():
+    assert not geom.Polygon([(0, 0), (1, 1)]).contains([(0.5, 0.5)]).any()
+    assert not geom.Polygon([]).contains([(0, 0)]).any()
+
+
+def test_points_in_polygons():
+    lanes = geom.LaneSet([
+        [(0, 0), (4, 0), (4, 4), (0, 4)],
+        [(4, 0), (8, 0), (8, 4), (4, 4), (6, 2)],
+        [(0, 0), (8, 0), (4, 8)],
+    ])
+    points = np.array([(1, 1), (5, 1), (4, 6), (9, 9), (1, 1)])
+    assert geom.points_in_polygons(points, lanes.polygons).tolist() == [0, 1, 2, -1, 0]
+    assert lanes.count(points).tolist() == [2, 1, 1]
+    assert lanes.count(np.empty((0, 2))).tolist() == [0, 0, 0]
+
+
+def test_points_in_polygons_matches_point_inside():
+    rng = np.random.default_rng(1)
+    polygons = [[tuple(xy) for xy in rng.uniform(0, 10, (6, 2))] for _ in range(5)]
+    points = rng.uniform(0, 10, (200, 2))
+    expected = []
+    for point in points:
+        index = -1
+        for i, polygon in enumerate(polygons):
+            if geom.point_inside(tuple(point), geom.convex_hull(polygon)):
+                index = i
+                break
+        expected.append(index)
+    assert geom.points_in_polygons(points, polygons).tolist() == expected
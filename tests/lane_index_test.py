@@ -0,0 +1,74 @@
+import json
+
+import numpy as np
+import pytest
+
+from BusinessTampereTrafficMonitoring.object_detector.lane_index import LaneIndex
+from BusinessTampereTrafficMonitoring.tools.geometry import LaneSet
+
+with open("config.json", "r") as configfile:
+    LANES = json.load(configfile)["lanes"]
+CAMERA = LANES[0]["camera_id"]
+
+
+@pytest.fixture
+def index():
+    return LaneIndex(LANES)
+
+
+def test_lanes_for_signal_group(index):
+    assert [lane.lane_id for lane in index.lanes_for_signal_group("TRE401", "B")] == ["Lane1", "Lane2"]
+    assert [lane.lane_id for lane in index.lanes_for_signal_group("TRE401", "H")] == ["Lane1"]
+    assert index.lanes_for_signal_group("TRE401", "A") == ()
+    # same signal group name in another intersection
+    assert index.lanes_for_signal_group("TRE428", "B") == ()
+
+
+def test_lanes_for_camera(index):
+    assert len(index.lanes_for_camera(CAMERA)) == 4
+    assert index.lanes_for_camera("unknown") == ()
+
+
+def test_raster_is_read_only(index):
+    raster = index.raster(CAMERA)
+    assert raster.shape == (417, 2186)
+    assert not raster.flags.writeable
+
+
+def test_lookup_matches_polygons(index):
+    rng = np.random.default_rng(0)
+    points = rng.uniform((1200, 150), (2250, 450), (2000, 2))
+    # points exactly on the edges may go either way
+    lane_set = LaneSet([lane.polygon for lane in index.lanes])
+    expected = lane_set.points_in_polygons(points)
+    found = index.lookup(CAMERA, points)
+    assert (found == expected).mean() > 0.99
+
+
+def test_lookup_outside_raster(index):
+    points = [(-10, 200), (1300, -5), (5000, 5000), (1300, 300)]
+    assert index.lookup(CAMERA, points).tolist() == [-1, -1, -1, 0]
+
+
+def test_count(index):
+    lanes = index.lanes_for_signal_group("TRE401", "B")
+    points = [(1300, 300), (1310, 300), (1500, 300), (1900, 380)]
+    counts = index.count(CAMERA, points, lanes)
+    assert [(count.lane.lane_id, count.cars) for count in counts] == [("Lane1", 2), ("Lane2", 1)]
+    assert [count.cars for count in index.count(CAMERA, np.empty((0, 2)), lanes)] == [0, 0]
+
+
+def test_raster_labels_pixel_centers():
+    lanes = [{"lane": lane_id, "intersection_id": "TRE401", "camera_id": "cam", "signal_groups": ["A"],
+              "vertices": vertices}
+             for lane_id, vertices in [("Lane1", [[10, 10], [1910, 40], [1700, 1070], [30, 900]]),
+                                       ("Lane2", [[500.5, 0], [1919.5, 500], [800, 1079.5]])]]
+    index = LaneIndex(lanes)
+    raster = index.raster("cam")
+    assert raster.shape == (1081, 1921)
+    # overlapping pixels go to the first lane
+    ys, xs = np.mgrid[0:1081:7, 0:1921:7]
+    centers = np.column_stack((xs.ravel() + 0.5, ys.ravel() + 0.5))
+    expected = LaneSet([lane.polygon for lane in index.lanes]).points_in_polygons(centers)
+    assert (raster[ys.ravel(), xs.ravel()] == expected).mean() > 0.999
+    assert set(np.unique(raster).tolist()) == {-1, 0, 1}
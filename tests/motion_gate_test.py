@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from BusinessTampereTrafficMonitoring.object_detector.lane_index import LaneCount
+from BusinessTampereTrafficMonitoring.object_detector.lane_index import LaneIndex
+from BusinessTampereTrafficMonitoring.object_detector.motion_gate import MotionGate
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import Region
+from BusinessTampereTrafficMonitoring.stream_reader.stream_reader import FrameTransform
+
+LANES = [
+    {"lane": "Left", "intersection_id": "TRE401", "camera_id": "cam", "signal_groups": ["A"],
+     "vertices": [[0, 0], [64, 0], [64, 128], [0, 128]]},
+    {"lane": "Right", "intersection_id": "TRE401", "camera_id": "cam", "signal_groups": ["B"],
+     "vertices": [[64, 0], [128, 0], [128, 128], [64, 128]]},
+]
+
+
+@pytest.fixture
+def gate():
+    index = LaneIndex(LANES)
+    return MotionGate(index, {"cam": Region(0, 0, 128, 128)}, {"cam": FrameTransform(0, 0, 1, 1)},
+                      scale=8, threshold=5.0, max_age=10.0)
+
+
+def frame(left=0, right=0):
+    image = np.zeros((128, 128, 3), np.uint8)
+    image[:, :64] = left
+    image[:, 64:] = right
+    return image
+
+
+def detect(gate, timestamp, image, left_cars, right_cars):
+    left, right = gate.lane_index.lanes
+    counts = [LaneCount(left, left_cars), LaneCount(right, right_cars)]
+    gate.update("cam", timestamp, gate.thumbnail("cam", image), counts)
+
+
+def test_first_frame_is_detected(gate):
+    assert gate.check("cam", 0.0, gate.thumbnail("cam", frame()), gate.lane_index.lanes) is None
+    assert gate.detected == 1
+
+
+def test_unchanged_lanes_reuse_counts(gate):
+    left, right = gate.lane_index.lanes
+    detect(gate, 0.0, frame(), 3, 1)
+    counts = gate.check("cam", 1.0, gate.thumbnail("cam", frame(left=2)), [left])
+    assert counts == [LaneCount(left, 3)]
+    assert gate.skipped == 1
+
+
+def test_only_requested_lanes_are_compared(gate):
+    left, right = gate.lane_index.lanes
+    detect(gate, 0.0, frame(), 3, 1)
+    thumbnail = gate.thumbnail("cam", frame(right=100))
+    assert gate.check("cam", 1.0, thumbnail, [left]) == [LaneCount(left, 3)]
+    assert gate.check("cam", 1.0, thumbnail, [right]) is None
+
+
+def test_old_counts_are_not_reused(gate):
+    detect(gate, 0.0, frame(), 3, 1)
+    assert gate.check("cam", 11.0, gate.thumbnail("cam", frame()), gate.lane_index.lanes) is None
@@ -0,0 +1,140 @@
+import sys
+import types
+
+import numpy as np
+import pytest
+
+from BusinessTampereTrafficMonitoring.object_detector import object_detector
+from BusinessTampereTrafficMonitoring.object_detector.backends import DetectorBackend
+from BusinessTampereTrafficMonitoring.object_detector.backends import MAX_BOXES
+from BusinessTampereTrafficMonitoring.object_detector.object_detector import ObjectDetector
+from BusinessTampereTrafficMonitoring.stream_reader.frame_cache import FrameCache
+from BusinessTampereTrafficMonitoring.stream_reader.stream_reader import FrameTransform
+from BusinessTampereTrafficMonitoring.stream_reader.supervisor import StreamHealth
+from BusinessTampereTrafficMonitoring.traffic_lights.status import Status
+
+INPUT_SIZE = 256
+# A 1280x720 video decoded at half the resolution. The lanes cover the region (64, 64, 576, 320)
+# of the frame, which is letterboxed into the model input scaled by half, 64 pixels from the top.
+LANES = [
+    {"lane": "Lane1", "intersection_id": "TRE401", "camera_id": "cam", "signal_groups": ["A"],
+     "vertices": [[128, 128], [640, 128], [640, 640], [128, 640]]},
+    {"lane": "Lane2", "intersection_id": "TRE401", "camera_id": "cam", "signal_groups": ["A"],
+     "vertices": [[640, 128], [1152, 128], [1152, 640], [640, 640]]},
+]
+# Vehicles in model input pixels, their lower centers are at (320, 512) and (832, 512) in the source
+LANE1_BOX = [32, 96, 64, 160]
+LANE2_BOX = [160, 96, 192, 160]
+PERSON, CAR = 0, 2
+
+
+class FakeBackend(DetectorBackend):
+    """
+    Detects as many cars on Lane1 as the value of the first pixel of the region,
+    plus one car on Lane2 and a person on Lane2.
+    """
+    def load(self):
+        pass
+
+    def infer(self, batch):
+        boxes = np.zeros((len(batch), MAX_BOXES, 4), dtype=np.float32)
+        classes = np.zeros((len(batch), MAX_BOXES), dtype=np.float32)
+        valid_detections = np.zeros(len(batch), dtype=np.int32)
+        for i, image in enumerate(batch):
+            # the region is placed 64 pixels from the top
+            cars = round(float(image[64, 0, 0]) * 255)
+            detections = [(LANE1_BOX, CAR)] * cars + [(LANE2_BOX, CAR), (LANE2_BOX, PERSON)]
+            for j, (box, cls) in enumerate(detections):
+                boxes[i, j] = np.array(box) / INPUT_SIZE
+                classes[i, j] = cls
+            valid_detections[i] = len(detections)
+        return boxes, np.ones_like(classes), classes, valid_detections
+
+
+class FakeReader:
+    health = StreamHealth.STREAMING
+
+    def __init__(self, video_location, **options):
+        self.cache = FrameCache(10, (360, 640, 3))
+
+    def get_constants(self):
+        return 640, 360
+
+    def get_transform(self):
+        return FrameTransform(x_scale=2.0, y_scale=2.0)
+
+    def get_timestamped_frame(self, epoch_time=None):
+        return self.cache.get(epoch_time)
+
+    def get_timestamped_frames(self, epoch_time=None, count=1):
+        return self.cache.window(epoch_time, count)
+
+    def stop(self):
+        pass
+
+
+@pytest.fixture
+def posted(monkeypatch, tmp_path):
+    """
+    Counts sent to IoT Ticket as (lane id, count, timestamp).
+    """
+    posted = []
+    iot_ticket = types.ModuleType("BusinessTampereTrafficMonitoring.iot_ticket.client")
+    iot_ticket.client = types.SimpleNamespace(
+        post_car_count=lambda device_id, lane, count, timestamp: posted.append((lane, count, timestamp)))
+    monkeypatch.setitem(sys.modules, "BusinessTampereTrafficMonitoring.iot_ticket.client", iot_ticket)
+    monkeypatch.setattr(object_detector, "create_stream_reader", FakeReader)
+    monkeypatch.setattr(object_detector, "backend_from_config",
+                        lambda detector, input_size: FakeBackend("fake", input_size))
+    # debug images are saved in the working directory
+    monkeypatch.chdir(tmp_path)
+    return posted
+
+
+def detector_of(frames=1, aggregate="median"):
+    config = {
+        "lanes": LANES,
+        "cameras": [{"camera_id": "cam", "url": "rtsp://camera"}],
+        "camera_processes": False,
+        "detector": {"inference_size": INPUT_SIZE, "roi_padding": 0, "max_wait": 0,
+                     "consensus": {"frames": frames, "aggregate": aggregate}},
+    }
+    return ObjectDetector(config)
+
+
+def store(detector, cars_per_frame):
+    # frame i is at time 10 + i, the first pixel of the region tells the number of cars on Lane1
+    for i, cars in enumerate(cars_per_frame):
+        frame = np.zeros((360, 640, 3), np.uint8)
+        frame[64:66, 64:66] = cars
+        detector.stream_readers["cam"].cache.store(10.0 + i, frame)
+
+
+def test_detections_are_mapped_to_source_pixels_and_lanes(posted):
+    detector = detector_of()
+    try:
+        assert detector.rois["cam"] == (64, 64, 576, 320)
+        store(detector, [2])
+        _, frame = detector.stream_readers["cam"].get_timestamped_frame(10.0)
+        points, boxes = detector.detect(frame, detector.stream_readers["cam"].get_transform(), detector.rois["cam"])
+        # the person is not a vehicle
+        assert np.allclose(points, [[320, 512], [320, 512], [832, 512]])
+        assert len(boxes) == 4
+        detector.detect_by_signal_group_and_time("TRE401", "A", 10.0, Status.RED)
+    finally:
+        detector.stop()
+    assert posted == [("Lane1", 2, 10.0), ("Lane2", 1, 10.0)]
+
+
+@pytest.mark.parametrize("aggregate, expected", [("median", 2), ("max", 5)])
+def test_counts_are_combined_over_the_frames_around_the_light_change(posted, aggregate, expected):
+    detector = detector_of(frames=3, aggregate=aggregate)
+    try:
+        store(detector, [0, 1, 2, 5, 3])
+        # the frames at 11, 12 and 13
+        detector.detect_by_signal_group_and_time("TRE401", "A", 12.2, Status.RED)
+        # light changes to green are not counted
+        detector.detect_by_signal_group_and_time("TRE401", "A", 12.2, Status.GREEN)
+    finally:
+        detector.stop()
+    assert posted == [("Lane1", expected, 12.2), ("Lane2", 1, 12.2)]
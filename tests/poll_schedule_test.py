@@ -0,0 +1,162 @@
+import math
+import pickle
+from datetime import datetime
+from datetime import timezone
+
+import pytest
+
+from BusinessTampereTrafficMonitoring.traffic_lights.poll_schedule import AdaptivePollSchedule
+
+RED_STATUS = "A"
+GREEN_STATUS = "1"
+EPOCH = 1_600_000_000
+
+
+def device_state(timestamp, statuses, device="TRE401"):
+    # the API gives whole seconds
+    api_time = datetime.fromtimestamp(EPOCH + math.floor(timestamp), timezone.utc)
+    return {
+        'device': device,
+        'timestamp': api_time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'signalGroup': [{'name': name, 'status': status} for name, status in statuses.items()],
+    }
+
+
+def test_unknown_phases_are_polled_sparsely():
+    schedule = AdaptivePollSchedule(min_interval=0.2, max_interval=4.0)
+    assert schedule.interval("TRE401", EPOCH) == 4.0
+    schedule.observe(device_state(0, {'A': RED_STATUS}), received=EPOCH)
+    # the start of the first phase is not known
+    schedule.observe(device_state(10, {'A': GREEN_STATUS}), received=EPOCH + 10)
+    assert schedule.predicted_changes("TRE401") == []
+    assert schedule.interval("TRE401", EPOCH + 10) == 4.0
+
+
+def test_phase_durations_are_learned():
+    schedule = AdaptivePollSchedule(min_interval=0.2, max_interval=4.0, margin=0.5)
+    for timestamp, status in [(0, RED_STATUS), (10, GREEN_STATUS), (30, RED_STATUS), (60, GREEN_STATUS)]:
+        schedule.observe(device_state(timestamp, {'A': status}), received=EPOCH + timestamp)
+    # green lasted 20 s, the API time is truncated to seconds
+    [(change, uncertainty)] = schedule.predicted_changes("TRE401")
+    assert change == pytest.approx(EPOCH + 80.5)
+    assert uncertainty == pytest.approx(1.0)
+    # sparse in the middle of the phase, dense around the predicted change
+    assert schedule.interval("TRE401", EPOCH + 60) == 4.0
+    assert schedule.interval("TRE401", EPOCH + 77) == pytest.approx(2.5)
+    assert schedule.interval("TRE401", EPOCH + 80) == 0.2
+    # overdue
+    assert schedule.interval("TRE401", EPOCH + 82) == 4.0
+
+
+def test_prediction_error_widens_the_window():
+    schedule = AdaptivePollSchedule(margin=0.5, smoothing=0.5)
+    for timestamp, status in [(0, RED_STATUS), (10, GREEN_STATUS), (30, RED_STATUS), (40, GREEN_STATUS),
+                              (64, RED_STATUS), (74, GREEN_STATUS)]:
+        schedule.observe(device_state(timestamp, {'A': status}), received=EPOCH + timestamp)
+    [(change, uncertainty)] = schedule.predicted_changes("TRE401")
+    # green lasted 20 s and 24 s
+    assert change == pytest.approx(EPOCH + 74 + 22 + 0.5)
+    assert uncertainty == pytest.approx(0.5 + 0.5 + 2 * 2)
+
+
+def test_only_selected_signal_groups_are_predicted():
+    schedule = AdaptivePollSchedule(signal_groups={("TRE401", "A")})
+    for timestamp, status in [(0, RED_STATUS), (10, GREEN_STATUS), (30, RED_STATUS), (60, GREEN_STATUS)]:
+        schedule.observe(device_state(timestamp, {'A': status, 'B': status}), received=EPOCH + timestamp)
+    assert len(schedule.predicted_changes("TRE401")) == 1
+    assert schedule.predicted_changes("TRE428") == []
+
+
+def test_devices_without_selected_signal_groups_have_their_own_interval():
+    schedule = AdaptivePollSchedule(max_interval=4.0, signal_groups={("TRE401", "A")}, untracked_interval=2.0)
+    schedule.observe(device_state(0, {'A': RED_STATUS}, device="TRE428"), received=EPOCH)
+    assert schedule.interval("TRE428", EPOCH) == 2.0
+    assert schedule.interval("TRE401", EPOCH) == 4.0
+    # without selected signal groups every device is tracked
+    assert AdaptivePollSchedule(max_interval=4.0, untracked_interval=2.0).interval("TRE428", EPOCH) == 4.0
+
+
+def test_invalid_parameters():
+    with pytest.raises(ValueError):
+        AdaptivePollSchedule(min_interval=0)
+    with pytest.raises(ValueError):
+        AdaptivePollSchedule(min_interval=2.0, max_interval=1.0)
+    with pytest.raises(ValueError):
+        AdaptivePollSchedule(smoothing=0)
+    with pytest.raises(ValueError):
+        AdaptivePollSchedule(budget_interval=0)
+    with pytest.raises(ValueError):
+        AdaptivePollSchedule(untracked_interval=0)
+
+
+def simulate(interval, duration=1500.0, green=20.0, red=30.0, offsets=(0.0,)):
+    """
+    Polls signal groups with a fixed cycle, the cycle of each group starting at its offset.
+    # Returns:
+      Number of polls and the mean delay from a light change to its detection
+    """
+    groups = {f"SG{i}": [5.3 + offset + cycle * (green + red) + change
+                         for cycle in range(int(duration // (green + red)) + 1) for change in (0.0, green)]
+              for i, offset in enumerate(offsets)}
+    now, polls, delays, previous = 0.0, 0, {name: [] for name in groups}, {}
+    while now < duration:
+        polls += 1
+        statuses = {}
+        for name, changes in groups.items():
+            passed = [change for change in changes if change <= now]
+            statuses[name] = GREEN_STATUS if len(passed) % 2 else RED_STATUS
+            if name in previous and statuses[name] != previous[name]:
+                delays[name].append(now - passed[-1])
+        previous = statuses
+        now += interval(now, device_state(now, statuses))
+    # the first cycles are spent learning
+    delays = [delay for group_delays in delays.values() for delay in group_delays[4:]]
+    return polls, sum(delays) / len(delays)
+
+
+def adaptive_polling(schedule):
+    def interval(now, state):
+        schedule.observe(state, received=EPOCH + now + 0.1)
+        return schedule.interval("TRE401", EPOCH + now + 0.1)
+    return interval
+
+
+def test_adaptive_polling_is_more_accurate_with_fewer_requests():
+    fixed_polls, fixed_delay = simulate(lambda now, state: 2.0)
+    adaptive_polls, adaptive_delay = simulate(adaptive_polling(AdaptivePollSchedule()))
+    assert adaptive_polls <= fixed_polls
+    assert adaptive_delay < fixed_delay / 2
+
+
+def test_budget_limits_the_requests_of_several_signal_groups():
+    # offset plans of three signal groups of one intersection
+    offsets = (0.0, 17.0, 33.0)
+    fixed_polls, fixed_delay = simulate(lambda now, state: 2.0, offsets=offsets)
+    # without a budget, the dense windows of the groups add up
+    unlimited_polls, _ = simulate(adaptive_polling(AdaptivePollSchedule()), offsets=offsets)
+    assert unlimited_polls > fixed_polls
+    budgeted_polls, budgeted_delay = simulate(adaptive_polling(AdaptivePollSchedule(budget_interval=2.0)),
+                                              offsets=offsets)
+    assert budgeted_polls <= fixed_polls
+    assert budgeted_delay < fixed_delay
+
+
+def test_budget_is_earned_over_time():
+    schedule = AdaptivePollSchedule(min_interval=0.2, max_interval=0.2, budget_interval=1.0, max_saved_polls=2)
+    # nothing saved yet, the first poll is paid back before the next one
+    assert schedule.interval("TRE401", 0.0) == pytest.approx(1.0)
+    # after a long pause at most two polls are saved
+    intervals = [schedule.interval("TRE401", 100.0)]
+    for _ in range(3):
+        intervals.append(schedule.interval("TRE401", 100.0 + sum(intervals)))
+    assert intervals == pytest.approx([0.2, 0.2, 0.6, 1.0])
+
+
+def test_copies_keep_the_learned_durations():
+    schedule = AdaptivePollSchedule()
+    for timestamp, status in [(0, RED_STATUS), (10, GREEN_STATUS), (30, RED_STATUS), (60, GREEN_STATUS)]:
+        schedule.observe(device_state(timestamp, {'A': status}), received=EPOCH + timestamp)
+    copy = pickle.loads(pickle.dumps(schedule))
+    assert copy.predicted_changes("TRE401") == schedule.predicted_changes("TRE401")
+    copy.observe(device_state(80, {'A': RED_STATUS}), received=EPOCH + 80)
+    assert copy.predicted_changes("TRE401") != schedule.predicted_changes("TRE401")
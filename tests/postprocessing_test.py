@@ -0,0 +1,50 @@
+import numpy as np
+
+from BusinessTampereTrafficMonitoring.object_detector.postprocessing import lower_center_from_bbox
+from BusinessTampereTrafficMonitoring.object_detector.postprocessing import select_detections
+from BusinessTampereTrafficMonitoring.object_detector.postprocessing import to_source_boxes
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import letterbox
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import Region
+from BusinessTampereTrafficMonitoring.object_detector.scheduler import Prediction
+from BusinessTampereTrafficMonitoring.stream_reader.stream_reader import FrameTransform
+
+
+def test_lower_center_from_bbox():
+    assert lower_center_from_bbox((10, 20, 30, 40)).tolist() == [20, 40]
+    boxes = np.array([[10, 20, 30, 40], [0, 0, 4, 2]])
+    assert lower_center_from_bbox(boxes).tolist() == [[20, 40], [2, 2]]
+
+
+def test_padding_boxes_are_dropped():
+    boxes = np.zeros((50, 4), dtype=np.float32)
+    boxes[:3] = [[0.1, 0.1, 0.2, 0.2], [0.3, 0.3, 0.4, 0.4], [0.5, 0.5, 0.6, 0.6]]
+    classes = np.zeros(50, dtype=np.float32)
+    classes[:3] = [2, 0, 7]
+    valid_boxes, vehicles = select_detections(boxes, classes, 3)
+    assert valid_boxes.shape == (3, 4)
+    assert vehicles.tolist() == [True, False, True]
+
+
+def test_no_detections():
+    valid_boxes, vehicles = select_detections(np.zeros((50, 4)), np.zeros(50), 0)
+    assert valid_boxes.shape == (0, 4)
+    assert lower_center_from_bbox(valid_boxes[vehicles]).shape == (0, 2)
+
+
+def test_boxes_are_mapped_to_source_coordinates():
+    # a 512x256 region of a frame decoded at half the source resolution
+    roi = Region(64, 64, 576, 320)
+    transform = FrameTransform(x_scale=2.0, y_scale=2.0)
+    placement = letterbox(np.zeros((roi.height, roi.width, 3), np.uint8), np.empty((256, 256, 3), np.uint8))
+    # the region is scaled by half and centered vertically
+    assert tuple(placement) == (0.5, 0, 64)
+    boxes = np.zeros((50, 4), dtype=np.float32)
+    boxes[:2] = np.array([[32, 96, 64, 160], [0, 64, 256, 192]]) / 256
+    classes = np.zeros(50, dtype=np.float32)
+    classes[:2] = [2, 0]
+    source_boxes, vehicles = to_source_boxes(Prediction(placement, boxes, np.ones(50), classes, 2), transform, roi, 256)
+    # input (x, y) -> region (2x, 2(y - 64)) -> frame (2x + 64, 2(y - 64) + 64) -> source (4x + 128, 4y - 128)
+    assert np.allclose(source_boxes, [[256, 256, 384, 512], [128, 128, 1152, 640]])
+    assert vehicles.tolist() == [True, False]
+    # the whole model input covering the region is the region in the source
+    assert np.allclose(source_boxes[1], np.array(roi) * 2)
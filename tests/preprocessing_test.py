@@ -0,0 +1,61 @@
+import numpy as np
+
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import letterbox
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import Letterbox
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import normalize
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import PAD_VALUE
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import Region
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import region_of_interest
+
+
+def test_region_of_config_lanes():
+    vertices = [(1257, 174), (2185, 416), (1653, 181)]
+    roi = region_of_interest(vertices, (2560, 1440), padding=64)
+    assert roi.x0 <= 1257 - 64 and roi.x1 >= 2185 + 64
+    assert roi.y0 <= 174 - 64 and roi.y1 >= 416 + 64
+    assert roi.width % 32 == 0 and roi.height % 32 == 0
+    assert roi.width < 1200 and roi.height < 400
+
+
+def test_region_is_clamped_to_frame():
+    roi = region_of_interest([(5, 5), (315, 150)], (320, 160), padding=20)
+    assert roi == Region(0, 0, 320, 160)
+    roi = region_of_interest([(300, 10), (310, 20)], (320, 160), padding=0)
+    assert roi == Region(288, 10, 320, 42)
+
+
+def test_region_without_points():
+    assert region_of_interest([], (320, 160)) == Region(0, 0, 320, 160)
+
+
+def test_crop_is_a_view():
+    frame = np.zeros((160, 320, 3), np.uint8)
+    crop = Region(32, 0, 96, 64).crop(frame)
+    assert crop.shape == (64, 64, 3)
+    assert np.shares_memory(crop, frame)
+
+
+def test_letterbox_wide_image():
+    image = np.full((100, 400, 3), 255, np.uint8)
+    out = np.zeros((64, 64, 3), np.uint8)
+    placement = letterbox(image, out)
+    assert placement == Letterbox(0.16, 0, 24)
+    assert (out[:24] == PAD_VALUE).all() and (out[40:] == PAD_VALUE).all()
+    assert (out[24:40] == 255).all()
+
+
+def test_letterbox_boxes_back_to_image():
+    image = np.zeros((300, 200, 3), np.uint8)
+    out = np.zeros((608, 608, 3), np.uint8)
+    placement = letterbox(image, out)
+    assert placement.top == 0 and placement.left > 0
+    box = np.array([[10, 20, 110, 220]])
+    input_box = box * placement.scale + [placement.left, placement.top, placement.left, placement.top]
+    assert np.allclose(placement.to_image(input_box), box)
+
+
+def test_normalize_writes_into_buffer():
+    image = np.array([[[0, 51, 255]]], dtype=np.uint8)
+    out = np.empty((1, 1, 3), dtype=np.float32)
+    assert normalize(image, out) is out
+    assert np.allclose(out, [[[0.0, 0.2, 1.0]]])
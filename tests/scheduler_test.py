@@ -0,0 +1,98 @@
+import threading
+
+import numpy as np
+import pytest
+
+from BusinessTampereTrafficMonitoring.object_detector.scheduler import InferenceScheduler
+from BusinessTampereTrafficMonitoring.object_detector.scheduler import PRIORITY_BACKGROUND
+
+SIZE = 64
+
+
+class FakeModel:
+    """
+    Returns one box per image, with the mean value of the image as its coordinates.
+    """
+    def __init__(self):
+        self.batch_sizes = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def infer(self, batch):
+        self.release.wait()
+        self.batch_sizes.append(len(batch))
+        n = len(batch)
+        boxes = np.zeros((n, 3, 4), np.float32)
+        boxes[:, 0] = batch.mean(axis=(1, 2, 3))[:, None]
+        return boxes, np.zeros((n, 3)), np.full((n, 3), 2.0), np.ones(n, np.int32)
+
+
+class FailingModel:
+    def infer(self, batch):
+        raise RuntimeError("out of memory")
+
+
+def image(value, shape=(32, 64, 3)):
+    return np.full(shape, value, dtype=np.uint8)
+
+
+def test_results_are_returned_to_each_image():
+    model = FakeModel()
+    scheduler = InferenceScheduler(model, SIZE, batch_size=4, max_wait=0.5)
+    model.release.clear()
+    futures = [scheduler.submit(image(value)) for value in (0, 255)]
+    model.release.set()
+    first, second = (future.result(timeout=5) for future in futures)
+    scheduler.stop()
+    # the letterbox padding is gray, so the means are between the pad value and the image
+    assert first.boxes[0, 0] < second.boxes[0, 0]
+    assert first.valid_detections == 1
+    assert first.placement.scale == 1.0 and first.placement.top == 16
+
+
+def test_simultaneous_images_share_a_batch():
+    model = FakeModel()
+    scheduler = InferenceScheduler(model, SIZE, batch_size=3, max_wait=0.5)
+    futures = [scheduler.submit(image(i)) for i in range(5)]
+    for future in futures:
+        future.result(timeout=5)
+    scheduler.stop()
+    assert model.batch_sizes == [3, 2]
+
+
+def test_light_changes_go_before_background_images():
+    model = FakeModel()
+    scheduler = InferenceScheduler(model, SIZE, batch_size=1, max_wait=0.0)
+    model.release.clear()
+    # the worker takes the first image and blocks in the model
+    first = scheduler.submit(image(0))
+    while not first.running():
+        pass
+    background = scheduler.submit(image(255), priority=PRIORITY_BACKGROUND)
+    event = scheduler.submit(image(255))
+    order = []
+    background.add_done_callback(lambda _: order.append("background"))
+    event.add_done_callback(lambda _: order.append("event"))
+    model.release.set()
+    background.result(timeout=5)
+    scheduler.stop()
+    assert order == ["event", "background"]
+
+
+def test_model_errors_are_passed_to_futures():
+    scheduler = InferenceScheduler(FailingModel(), SIZE, max_wait=0.0)
+    with pytest.raises(RuntimeError):
+        scheduler.predict(image(0))
+    scheduler.stop()
+
+
+def test_submit_after_stop():
+    scheduler = InferenceScheduler(FakeModel(), SIZE, max_wait=0.0)
+    scheduler.stop()
+    with pytest.raises(RuntimeError):
+        scheduler.submit(image(0))
+
+
+def test_invalid_batch_size():
+    with pytest.raises(ValueError):
+        InferenceScheduler(FakeModel(), SIZE, batch_size=0)
@@ -0,0 +1,136 @@
+import json
+import threading
+import time
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from BusinessTampereTrafficMonitoring.traffic_lights.api_client import TrafficLightAPIClient
+from BusinessTampereTrafficMonitoring.traffic_lights.event_bus import CYCLE_COMPLETED
+from BusinessTampereTrafficMonitoring.traffic_lights.event_bus import LIGHT_CHANGED
+from BusinessTampereTrafficMonitoring.traffic_lights.sharded_poller import HashRing
+from BusinessTampereTrafficMonitoring.traffic_lights.sharded_poller import ShardedPoller
+from BusinessTampereTrafficMonitoring.traffic_lights.status import Status
+
+DEVICES = [f"TRE{i}" for i in range(401, 409)]
+
+
+def test_every_key_has_one_node():
+    ring = HashRing(["a", "b", "c"])
+    assignment = ring.assign(DEVICES)
+    assert sorted(device for devices in assignment.values() for device in devices) == sorted(DEVICES)
+    assert all(device in assignment[ring.node(device)] for device in DEVICES)
+    # the same in every process
+    assert HashRing(["c", "b", "a"]).assign(DEVICES) == {node: assignment[node] for node in ["c", "b", "a"]}
+
+
+def test_keys_are_spread_evenly():
+    devices = [f"TRE{i}" for i in range(2000)]
+    counts = [len(keys) for keys in HashRing([f"shard-{i}" for i in range(4)]).assign(devices).values()]
+    assert min(counts) > 0.6 * len(devices) / 4
+    assert max(counts) < 1.4 * len(devices) / 4
+
+
+def test_only_the_keys_of_a_changed_node_move():
+    devices = [f"TRE{i}" for i in range(500)]
+    ring = HashRing(["a", "b", "c", "d"])
+    before = {device: ring.node(device) for device in devices}
+    ring.remove("b")
+    after = {device: ring.node(device) for device in devices}
+    assert all(after[device] == node for device, node in before.items() if node != "b")
+    ring.add("e")
+    added = {device: ring.node(device) for device in devices}
+    assert all(added[device] in (after[device], "e") for device in devices)
+    assert "e" in added.values()
+
+
+def test_invalid_ring():
+    with pytest.raises(ValueError):
+        HashRing(["a"], replicas=0)
+    with pytest.raises(ValueError):
+        HashRing([]).node("TRE401")
+
+
+class TrafficLightAPI(BaseHTTPRequestHandler):
+    """
+    Every device alternates between red and green on every second request, one second apart.
+    """
+    requests = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        device = self.path.rsplit("/", 1)[-1]
+        with self.lock:
+            count = self.requests[device] = self.requests.get(device, 0) + 1
+        timestamp = datetime(2021, 10, 8, tzinfo=timezone(timedelta(hours=3))) + timedelta(seconds=count)
+        body = json.dumps({
+            "device": device,
+            "timestamp": timestamp.isoformat(timespec="seconds"),
+            "signalGroup": [{"name": "A", "status": "A" if count // 2 % 2 else "1"}],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TrafficLightAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/api/v1/deviceState/"
+    server.shutdown()
+    server.server_close()
+
+
+def wait_for(condition, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+
+def test_events_are_forwarded_and_dead_processes_restarted(api_url):
+    client = TrafficLightAPIClient(api_url, DEVICES, "sqlite:///:memory:")
+    poller = ShardedPoller(client, workers=3, restart_delay=0.1)
+    assert sorted(device for devices in poller.shards.values() for device in devices) == sorted(DEVICES)
+    changes, cycles = [], []
+    client.events.subscribe(LIGHT_CHANGED, lambda *change: changes.append(change))
+    client.events.subscribe(CYCLE_COMPLETED, cycles.append)
+
+    polling = threading.Thread(target=poller.poll, args=(0.05,))
+    polling.start()
+    try:
+        assert wait_for(lambda: {change[0] for change in changes} == set(DEVICES))
+        assert wait_for(lambda: {cycle[0] for cycle in cycles} == set(DEVICES))
+        assert all(status in (Status.RED, Status.GREEN) for _, _, _, status in changes)
+
+        shard, process = next(iter(poller.processes.items()))
+        others = {other: poller.processes[other].pid for other in poller.processes if other != shard}
+        process.kill()
+        assert wait_for(lambda: poller.restarts[shard] == 1)
+        # the restarted process polls the same devices, the others were not touched
+        changes.clear()
+        assert wait_for(lambda: set(poller.shards[shard]) <= {change[0] for change in changes})
+        assert {other: poller.processes[other].pid for other in others} == others
+    finally:
+        poller.stop_polling()
+        polling.join(timeout=30)
+    assert not polling.is_alive()
+    assert not any(process.is_alive() for process in poller.processes.values())
+
+
+def test_invalid_parameters():
+    client = TrafficLightAPIClient("http://localhost/", DEVICES, "sqlite:///:memory:")
+    with pytest.raises(ValueError):
+        ShardedPoller(client, workers=0)
+    with pytest.raises(ValueError):
+        ShardedPoller(client).poll(0)
@@ -0,0 +1,93 @@
+import random
+
+import numpy as np
+import pytest
+
+from BusinessTampereTrafficMonitoring.traffic_lights.signal_group import SignalGroup
+from BusinessTampereTrafficMonitoring.traffic_lights.signal_group_table import SignalGroupTable
+from BusinessTampereTrafficMonitoring.traffic_lights.status import Status
+
+CODES = "0123456789:;<=>?@ABCDEFGHIJ"
+
+
+def test_same_transitions_as_signal_group():
+    rng = random.Random(4)
+    table = SignalGroupTable(capacity=4)
+    signal_groups = {}
+    devices = {f"TRE{i}": [f"SG{j}" for j in range(rng.randint(1, 12))] for i in range(20)}
+    for poll in range(300):
+        device = rng.choice(list(devices))
+        # groups appear in the middle of polling and in a different order
+        names = rng.sample(devices[device], rng.randint(1, len(devices[device])))
+        # mostly unchanged codes, like consecutive polls
+        codes = [rng.choice("A1=") if rng.random() < 0.3 else rng.choice(CODES) for _ in names]
+        timestamp = 1000 * poll
+
+        expected_changes, expected_cycles = [], []
+        for name, code in zip(names, codes):
+            signal_group = signal_groups.get((device, name))
+            if signal_group is None:
+                signal_groups[(device, name)] = SignalGroup(device, name, timestamp, code)
+                continue
+            old_status = signal_group.status
+            cycle = signal_group.update_state(timestamp, code)
+            if signal_group.status != old_status:
+                expected_changes.append((name, signal_group.status))
+            if cycle is not None:
+                expected_cycles.append(cycle)
+
+        changes, cycles = table.apply_snapshot(device, names, codes, timestamp)
+        assert changes == expected_changes
+        assert cycles == expected_cycles
+
+    for (device, name), signal_group in signal_groups.items():
+        assert table.get(device, name) == (signal_group.status, signal_group.t_red_start, signal_group.t_green_start)
+    assert len(table) == len(signal_groups)
+
+
+def test_cycle_timestamps_are_epoch_milliseconds():
+    table = SignalGroupTable()
+    assert table.apply_snapshot("TRE401", ["A", "B"], ["A", "1"], 1_633_650_000_000) == ([], [])
+    changes, cycles = table.apply_snapshot("TRE401", ["A", "B"], ["1", "1"], 1_633_650_010_000)
+    assert changes == [("A", Status.GREEN)]
+    assert cycles == []
+    changes, cycles = table.apply_snapshot("TRE401", ["A", "B"], ["A", "A"], 1_633_650_030_000)
+    assert changes == [("A", Status.RED), ("B", Status.RED)]
+    assert cycles == [("TRE401", "A", 1_633_650_000_000, 1_633_650_010_000, 1_633_650_030_000)]
+    assert table.get("TRE401", "B") == (Status.RED, 1_633_650_030_000, None)
+    assert table.get("TRE401", "C") is None
+    assert table.get("TRE428", "A") is None
+
+
+@pytest.mark.parametrize("codes", [["A", ""], ["A", "AB"], ["K"], ["/"], ["Ł"]])
+def test_invalid_codes(codes):
+    table = SignalGroupTable()
+    names = [f"SG{i}" for i in range(len(codes))]
+    with pytest.raises(ValueError, match="Invalid traffic light status code"):
+        table.apply_snapshot("TRE401", names, codes, 0)
+    # nothing was changed
+    assert len(table) == 0
+
+
+def test_names_and_codes_have_to_match():
+    with pytest.raises(ValueError):
+        SignalGroupTable().apply_snapshot("TRE401", ["A", "B"], ["A"], 0)
+
+
+def test_decode_matches_status_decode():
+    codes = [chr(code) for code in range(256)]
+    valid = [code for code in codes if code in CODES]
+    assert SignalGroupTable.decode(valid).tolist() == [Status.decode(code).value for code in valid]
+    assert SignalGroupTable.decode([]).tolist() == []
+
+
+def test_city_wide_snapshot():
+    table = SignalGroupTable()
+    names = [f"SG{i}" for i in range(40)]
+    rng = np.random.default_rng(0)
+    for poll in range(3):
+        for device in range(500):
+            codes = list(rng.choice(list("A1"), len(names)))
+            table.apply_snapshot(f"TRE{device}", names, codes, poll * 1000)
+    assert len(table) == 500 * 40
+    assert len(table.groups) == 40
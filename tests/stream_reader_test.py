@@ -1,8 +1,12 @@
 import time
+import types
 
 import numpy as np
 import pytest
 
+from BusinessTampereTrafficMonitoring.stream_reader import stream_reader
+from BusinessTampereTrafficMonitoring.stream_reader.log import log_to_file
+from BusinessTampereTrafficMonitoring.stream_reader.log import logger
 from BusinessTampereTrafficMonitoring.stream_reader.stream_reader import StreamReader
 
 # Sample video from https://sample-videos.com
@@ -48,8 +52,106 @@ def test_find_nearest_empty_array():
 
 def test_store_frame_get_frame():
     sr = StreamReader(SOURCE)
-    dummy_frame = np.ones([320, 240], int)
+    dummy_frame = np.ones([160, 320, 3], np.uint8)
     sr.store_frame(time.time(), dummy_frame)
     assert len(sr.cache) == 1
-    assert len(sr.timestamps) == 1
-    assert (sr.get_frame() == dummy_frame).all()
+    frame = sr.get_frame()
+    assert (frame == dummy_frame).all()
+    assert not frame.flags.writeable
+
+
+def test_get_timestamped_frame():
+    sr = StreamReader(SOURCE)
+    sr.store_frame(100.0, np.zeros([160, 320, 3], np.uint8))
+    sr.store_frame(100.5, np.ones([160, 320, 3], np.uint8))
+    timestamp, frame = sr.get_timestamped_frame(100.4)
+    assert timestamp == 100.5
+    assert frame.max() == 1
+
+
+def test_configurable_cache():
+    sr = StreamReader(SOURCE, cache_size=3, sample_interval=1.0)
+    assert sr.cache.capacity == 3
+    assert sr.sample_interval == 1.0
+
+
+def test_put_frame_drops_oldest():
+    sr = StreamReader(SOURCE, buffer_size=2)
+    for t in range(4):
+        sr.put_frame(t, np.zeros([160, 320, 3], np.uint8))
+    assert sr.dropped_frames == 2
+    assert sr.buffer.get_nowait()[0] == 2
+    assert sr.buffer.get_nowait()[0] == 3
+
+
+class FakeCapture:
+    """
+    Stream of `frames` packets arriving every frame_interval seconds of a fake clock,
+    after which no more packets arrive.
+    """
+    def __init__(self, clock, frames, frame_interval):
+        self.clock = clock
+        self.frames = frames
+        self.frame_interval = frame_interval
+        self.grabs = 0
+        self.retrieves = 0
+        self.last_packet = None
+
+    def grab(self):
+        if self.grabs >= self.frames:
+            return False
+        self.grabs += 1
+        self.clock.now += self.frame_interval
+        self.last_packet = self.clock.now
+        return True
+
+    def retrieve(self):
+        self.retrieves += 1
+        return True, np.zeros([160, 320, 3], np.uint8)
+
+
+class FakeRestart:
+    """
+    Restart event that is never set, waiting advances the fake clock.
+    """
+    def __init__(self, clock):
+        self.clock = clock
+
+    def is_set(self):
+        return False
+
+    def wait(self, timeout):
+        self.clock.now += timeout
+        return False
+
+
+def test_every_packet_is_grabbed_but_only_sampled_frames_decoded(monkeypatch):
+    sr = StreamReader(SOURCE, sample_interval=0.5, buffer_size=20, stall_timeout=5.0)
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(stream_reader, "time", types.SimpleNamespace(time=lambda: clock.now))
+    # 4 s of video at 25 frames per second
+    sr.cap = FakeCapture(clock, 100, 0.04)
+    sr.read_stream_to_buffer(FakeRestart(clock))
+
+    assert sr.cap.grabs == 100
+    # one frame per sample interval, i.e. every 13th packet
+    assert sr.cap.retrieves == 8
+    timestamps = [sr.buffer.get_nowait()[0] for _ in range(sr.buffer.qsize())]
+    assert len(timestamps) == 8
+    assert all(0.5 <= later - earlier < 0.5 + 0.04 for earlier, later in zip(timestamps, timestamps[1:]))
+    # returned once no packet had arrived for stall_timeout
+    assert 5.0 < clock.now - sr.cap.last_packet < 5.0 + 0.1 + 1e-6
+
+
+def test_log_is_written_to_a_file_only_on_request(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    logger.error("stream failed")
+    assert list(tmp_path.iterdir()) == []
+    handler = log_to_file(tmp_path / "stream_reader-log")
+    try:
+        logger.error("stream failed again")
+        handler.flush()
+        assert "stream failed again" in (tmp_path / "stream_reader-log").read_text()
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
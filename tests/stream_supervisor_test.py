@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+
+from BusinessTampereTrafficMonitoring.stream_reader.supervisor import Backoff
+from BusinessTampereTrafficMonitoring.stream_reader.supervisor import StreamHealth
+from BusinessTampereTrafficMonitoring.stream_reader.supervisor import StreamSupervisor
+
+
+def test_backoff_without_jitter():
+    backoff = Backoff(initial=1, maximum=10, factor=2, jitter=0)
+    assert [backoff.next_delay() for _ in range(6)] == [1, 2, 4, 8, 10, 10]
+    backoff.reset()
+    assert backoff.next_delay() == 1
+
+
+def test_backoff_jitter():
+    backoff = Backoff(initial=4, maximum=4, jitter=0.5)
+    for _ in range(100):
+        assert 2 <= backoff.next_delay() <= 4
+
+
+def test_reconnect_after_worker_stops():
+    connections = []
+    disconnections = []
+    stopped_by_restart = []
+
+    def producer(restart):
+        supervisor.mark_streaming()
+        if len(connections) == 3:
+            supervisor.stop()
+        # simulate a failing stream by returning
+
+    def consumer(restart):
+        restart.wait()
+        stopped_by_restart.append(True)
+
+    supervisor = StreamSupervisor(
+        connect=lambda: connections.append(True),
+        disconnect=lambda: disconnections.append(True),
+        workers=[producer, consumer],
+        backoff=Backoff(initial=0.01, jitter=0),
+    )
+    runner = threading.Thread(target=supervisor.run)
+    runner.start()
+    runner.join(timeout=5)
+    assert not runner.is_alive()
+    assert len(connections) == len(disconnections) == len(stopped_by_restart) == 3
+    assert supervisor.health == StreamHealth.STREAMING
+
+
+def test_health_down_when_connecting_fails():
+    attempts = []
+
+    def connect():
+        attempts.append(True)
+        if len(attempts) == 3:
+            supervisor.stop()
+        raise IOError("no stream")
+
+    supervisor = StreamSupervisor(connect, lambda: None, [], backoff=Backoff(initial=0.01, jitter=0), down_after=0)
+    supervisor.run()
+    assert len(attempts) == 3
+    assert supervisor.health == StreamHealth.DOWN
+
+
+@pytest.mark.parametrize("initial", [StreamHealth.CONNECTING, StreamHealth.DOWN])
+def test_degraded_only_after_streaming(initial):
+    supervisor = StreamSupervisor(lambda: None, lambda: None, [])
+    supervisor.health = initial
+    supervisor.mark_degraded()
+    assert supervisor.health == initial
+    supervisor.mark_streaming()
+    supervisor.mark_degraded()
+    assert supervisor.health == StreamHealth.DEGRADED
@@ -0,0 +1,196 @@
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+
+from BusinessTampereTrafficMonitoring.object_detector.detection_cache import DetectionCache
+from BusinessTampereTrafficMonitoring.object_detector.lane_index import LaneIndex
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import Letterbox
+from BusinessTampereTrafficMonitoring.object_detector.preprocessing import Region
+from BusinessTampereTrafficMonitoring.object_detector.scheduler import Prediction
+from BusinessTampereTrafficMonitoring.object_detector.tracker import DWELL_TIME
+from BusinessTampereTrafficMonitoring.object_detector.tracker import DwellTime
+from BusinessTampereTrafficMonitoring.object_detector.tracker import greedy_match
+from BusinessTampereTrafficMonitoring.object_detector.tracker import iou
+from BusinessTampereTrafficMonitoring.object_detector.tracker import LANE_COUNTS
+from BusinessTampereTrafficMonitoring.object_detector.tracker import LaneStatistics
+from BusinessTampereTrafficMonitoring.object_detector.tracker import LaneTracker
+from BusinessTampereTrafficMonitoring.object_detector.tracker import Tracker
+from BusinessTampereTrafficMonitoring.stream_reader.frame_cache import FrameCache
+from BusinessTampereTrafficMonitoring.stream_reader.stream_reader import FrameTransform
+
+
+def test_iou():
+    result = iou([[0, 0, 2, 2]], [[0, 0, 2, 2], [1, 0, 3, 2], [5, 5, 6, 6]])
+    assert result.shape == (1, 3)
+    assert np.allclose(result, [[1.0, 1 / 3, 0.0]])
+    assert iou(np.empty((0, 4)), [[0, 0, 1, 1]]).shape == (0, 1)
+
+
+def test_greedy_match():
+    scores = np.array([[0.9, 0.8], [0.85, 0.1], [0.0, 0.05]])
+    # the best pair is taken first, the other pairs above the threshold share its row or column
+    rows, columns = greedy_match(scores, 0.3)
+    assert sorted(zip(rows.tolist(), columns.tolist())) == [(0, 0)]
+    rows, columns = greedy_match(scores, 0.0)
+    assert sorted(zip(rows.tolist(), columns.tolist())) == [(0, 0), (1, 1)]
+
+
+def test_moving_box_keeps_its_id():
+    tracker = Tracker(max_age=3.0)
+    for step in range(10):
+        tracks = tracker.update(step, [[10 + 5 * step, 10, 30 + 5 * step, 30], [200, 200, 220, 220]])
+    assert sorted(tracks.ids.tolist()) == [0, 1]
+    # the box is extrapolated without detections
+    tracks = tracker.predict(10)
+    moving = tracks.boxes[tracks.ids.tolist().index(0)]
+    assert moving[0] == pytest.approx(60, abs=2)
+
+
+def test_lost_tracks_are_removed():
+    tracker = Tracker(max_age=1.0)
+    tracker.update(0.0, [[0, 0, 10, 10]])
+    assert len(tracker.predict(1.0).ids) == 1
+    assert len(tracker.predict(1.5).ids) == 0
+    tracks = tracker.update(2.0, [[0, 0, 10, 10]])
+    assert tracks.ids.tolist() == [1]
+
+
+class FakeReader:
+    def __init__(self):
+        self.cache = FrameCache(10, (4, 4, 3))
+
+    def get_timestamped_frames_since(self, epoch_time=None):
+        return self.cache.since(epoch_time)
+
+    def get_transform(self):
+        return FrameTransform(0, 0, 1, 1)
+
+
+CAR, PERSON = 2, 0
+INPUT_SIZE = 100
+
+
+class FakeScheduler:
+    def __init__(self, boxes, classes=None):
+        """
+        Detects boxes in source coordinates, cars unless other classes are given.
+        """
+        self.boxes = boxes
+        self.classes = classes
+        self.submitted = 0
+
+    def submit(self, image, priority):
+        self.submitted += 1
+        classes = [CAR] * len(self.boxes) if self.classes is None else self.classes
+        # the region is the whole frame and fills the model input unscaled
+        future = Future()
+        future.set_result(Prediction(Letterbox(1.0, 0, 0), np.asarray(self.boxes) / INPUT_SIZE,
+                                     np.ones(len(classes)), np.asarray(classes), len(classes)))
+        return future
+
+
+LANES = [{"lane": "Lane1", "intersection_id": "TRE401", "camera_id": "cam", "signal_groups": ["A"],
+          "vertices": [[0, 0], [100, 0], [100, 100], [0, 100]]}]
+
+
+def lane_tracker_of(reader, scheduler):
+    return LaneTracker("cam", reader, Region(0, 0, 4, 4), LaneIndex(LANES), scheduler, DetectionCache(10),
+                       INPUT_SIZE, detect_every=2, max_age=1.0)
+
+
+def test_lane_tracker_counts_every_frame():
+    reader = FakeReader()
+    scheduler = FakeScheduler(np.array([[40, 40, 60, 60]]))
+    lane_tracker = lane_tracker_of(reader, scheduler)
+    published = []
+    lane_tracker.events.subscribe(LANE_COUNTS, lambda *counts: published.append(counts))
+    dwell_times = []
+    lane_tracker.events.subscribe(DWELL_TIME, lambda camera_id, dwell_time: dwell_times.append(dwell_time))
+    assert not lane_tracker.step()
+    for timestamp in range(4):
+        reader.cache.store(timestamp, np.zeros((4, 4, 3), np.uint8))
+        assert lane_tracker.step()
+        assert not lane_tracker.step()
+    assert scheduler.submitted == 2
+    assert [counts for _, counts in lane_tracker.counts] == [{"Lane1": 1}] * 4
+
+    # the vehicle leaves, its track is lost after max_age and the dwell time on the lane is recorded
+    scheduler.boxes = np.empty((0, 4))
+    for timestamp in range(4, 8):
+        reader.cache.store(timestamp, np.zeros((4, 4, 3), np.uint8))
+        lane_tracker.step()
+    assert lane_tracker.counts[-1][1] == {"Lane1": 0}
+    assert [tuple(dwell) for dwell in lane_tracker.dwell_times] == [(0, "Lane1", 0, 3)]
+    assert published[:4] == [("cam", timestamp, {"Lane1": 1}) for timestamp in range(4)]
+    assert len(published) == 8
+    assert dwell_times == list(lane_tracker.dwell_times)
+
+
+def test_frames_cached_between_steps_are_counted():
+    reader = FakeReader()
+    scheduler = FakeScheduler(np.array([[40, 40, 60, 60]]))
+    lane_tracker = lane_tracker_of(reader, scheduler)
+    reader.cache.store(0, np.zeros((4, 4, 3), np.uint8))
+    assert lane_tracker.step()
+    # frames stored while a detection was running
+    for timestamp in range(1, 6):
+        reader.cache.store(timestamp, np.zeros((4, 4, 3), np.uint8))
+    assert lane_tracker.step()
+    assert not lane_tracker.step()
+    assert [timestamp for timestamp, _ in lane_tracker.counts] == list(range(6))
+    assert lane_tracker.frames == 6
+    assert scheduler.submitted == 3
+
+
+def test_only_vehicles_are_tracked():
+    reader = FakeReader()
+    # a car and a pedestrian on the same lane
+    scheduler = FakeScheduler(np.array([[40, 40, 60, 60], [70, 40, 80, 60]]), [CAR, PERSON])
+    lane_tracker = lane_tracker_of(reader, scheduler)
+    dwell_times = []
+    lane_tracker.events.subscribe(DWELL_TIME, lambda camera_id, dwell_time: dwell_times.append(dwell_time))
+    for timestamp in range(3):
+        reader.cache.store(timestamp, np.zeros((4, 4, 3), np.uint8))
+        lane_tracker.step()
+    assert [counts for _, counts in lane_tracker.counts] == [{"Lane1": 1}] * 3
+    scheduler.boxes, scheduler.classes = np.empty((0, 4)), []
+    for timestamp in range(3, 6):
+        reader.cache.store(timestamp, np.zeros((4, 4, 3), np.uint8))
+        lane_tracker.step()
+    assert [dwell.lane_id for dwell in dwell_times] == ["Lane1"]
+
+
+def test_lane_statistics_are_averaged_over_windows():
+    posted = []
+    statistics = LaneStatistics(lambda *averages: posted.append(averages), window=10.0)
+    for timestamp, cars in enumerate([1, 2, 3, 2]):
+        statistics.add_counts("cam", timestamp * 5.0, {"Lane1": cars, "Lane2": 0})
+        statistics.add_counts("other", timestamp * 5.0, {"Lane3": 1})
+    statistics.add_dwell_time("cam", DwellTime(0, "Lane1", 0.0, 4.0))
+    statistics.add_dwell_time("cam", DwellTime(1, "Lane1", 3.0, 5.0))
+    # the first window of 10 s ends with the frame at 10 s
+    assert posted == [("cam", "Lane1", 10.0, 1.5, None), ("cam", "Lane2", 10.0, 0.0, None),
+                      ("other", "Lane3", 10.0, 1.0, None)]
+    posted.clear()
+    statistics.add_counts("cam", 20.0, {"Lane1": 0, "Lane2": 0})
+    assert posted == [("cam", "Lane1", 20.0, 2.5, 3.0), ("cam", "Lane2", 20.0, 0.0, None)]
+    with pytest.raises(ValueError):
+        LaneStatistics(print, window=0)
+
+
+def test_lane_tracker_events_feed_the_statistics():
+    reader = FakeReader()
+    scheduler = FakeScheduler(np.array([[40, 40, 60, 60]]))
+    lane_tracker = lane_tracker_of(reader, scheduler)
+    posted = []
+    statistics = LaneStatistics(lambda *averages: posted.append(averages), window=4.0)
+    lane_tracker.events.subscribe(LANE_COUNTS, statistics.add_counts)
+    lane_tracker.events.subscribe(DWELL_TIME, statistics.add_dwell_time)
+    for timestamp in range(9):
+        if timestamp == 2:
+            scheduler.boxes = np.empty((0, 4))
+        reader.cache.store(timestamp, np.zeros((4, 4, 3), np.uint8))
+        lane_tracker.step()
+    # the vehicle is not detected at 2 s and its track is lost after max_age
+    assert posted == [("cam", "Lane1", 4.0, 0.5, 1.0), ("cam", "Lane1", 8.0, 0.0, None)]
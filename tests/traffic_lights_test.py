@@ -1,10 +1,22 @@
+import asyncio
 import threading
+import time
+import types
+from datetime import datetime
 
+import httpx
+import pytest
 import respx
 from httpx import Response
 
-from BusinessTampereTrafficMonitoring.traffic_lights.api_client import SignalGroup
+from BusinessTampereTrafficMonitoring.traffic_lights import api_client
 from BusinessTampereTrafficMonitoring.traffic_lights.api_client import TrafficLightAPIClient
+from BusinessTampereTrafficMonitoring.traffic_lights.decoding import parse_epoch_time
+from BusinessTampereTrafficMonitoring.traffic_lights.event_bus import CYCLE_COMPLETED
+from BusinessTampereTrafficMonitoring.traffic_lights.event_bus import LIGHT_CHANGED
+from BusinessTampereTrafficMonitoring.traffic_lights.event_bus import POLL_FAILED
+from BusinessTampereTrafficMonitoring.traffic_lights.signal_group import SignalGroup
+from BusinessTampereTrafficMonitoring.traffic_lights.signal_group_table import SignalGroupTable
 from BusinessTampereTrafficMonitoring.traffic_lights.status import Status
 
 
@@ -17,8 +29,41 @@ OTHER_STATUS = "="
 TS = [f"2020-01-01T12:00:{x:02d}+03:00" for x in range(0, 59, 3)]
 
 
-def test_signal_group_cycle():
-    sg = SignalGroup("TRE444", "A", TS[0], RED_STATUS)
+class TableSignalGroup:
+    """
+    SignalGroup interface to a signal group in a SignalGroupTable, with the timestamps of the API.
+    """
+    def __init__(self, device, name, timestamp, status_code):
+        self.device = device
+        self.name = name
+        self.table = SignalGroupTable(capacity=1)
+        self.timestamps = {None: None}
+        self.update_state(timestamp, status_code)
+
+    def update_state(self, timestamp, status_code):
+        epoch_ms = round(parse_epoch_time(timestamp) * 1000)
+        self.timestamps[epoch_ms] = timestamp
+        transitions = self.table.apply_snapshot(self.device, [self.name], [status_code], epoch_ms)
+        for device, name, t_start, t_green, t_end in transitions.cycles:
+            return device, name, self.timestamps[t_start], self.timestamps[t_green], self.timestamps[t_end]
+        return None
+
+    @property
+    def status(self):
+        return self.table.get(self.device, self.name).status
+
+    @property
+    def t_red_start(self):
+        return self.timestamps[self.table.get(self.device, self.name).t_red_start]
+
+    @property
+    def t_green_start(self):
+        return self.timestamps[self.table.get(self.device, self.name).t_green_start]
+
+
+@pytest.mark.parametrize("signal_group", [SignalGroup, TableSignalGroup])
+def test_signal_group_cycle(signal_group):
+    sg = signal_group("TRE444", "A", TS[0], RED_STATUS)
     assert sg.status == Status.RED
     assert sg.t_red_start == TS[0]
     assert sg.t_green_start is None
@@ -46,8 +91,9 @@ def test_signal_group_cycle():
     assert sg.t_green_start is None
 
 
-def test_signal_group_init_green():
-    sg = SignalGroup("TRE444", "A", TS[0], GREEN_STATUS)
+@pytest.mark.parametrize("signal_group", [SignalGroup, TableSignalGroup])
+def test_signal_group_init_green(signal_group):
+    sg = signal_group("TRE444", "A", TS[0], GREEN_STATUS)
     assert sg.status == Status.GREEN
     assert sg.t_red_start is None
     assert sg.t_green_start is None
@@ -56,8 +102,9 @@ def test_signal_group_init_green():
     assert sg.t_red_start == TS[1]
 
 
-def test_signal_group_init_other():
-    sg = SignalGroup("TRE444", "A", TS[0], OTHER_STATUS)
+@pytest.mark.parametrize("signal_group", [SignalGroup, TableSignalGroup])
+def test_signal_group_init_other(signal_group):
+    sg = signal_group("TRE444", "A", TS[0], OTHER_STATUS)
     assert sg.status == Status.OTHER
     assert sg.t_red_start is None
     assert sg.t_green_start is None
@@ -66,8 +113,9 @@ def test_signal_group_init_other():
     assert sg.t_red_start == TS[1]
 
 
-def test_signal_group_other_mid_cycle():
-    sg = SignalGroup("TRE444", "A", TS[0], RED_STATUS)
+@pytest.mark.parametrize("signal_group", [SignalGroup, TableSignalGroup])
+def test_signal_group_other_mid_cycle(signal_group):
+    sg = signal_group("TRE444", "A", TS[0], RED_STATUS)
     assert sg.update_state(TS[1], RED_STATUS) is None
     assert sg.update_state(TS[2], GREEN_STATUS) is None
     assert sg.update_state(TS[3], OTHER_STATUS) is None
@@ -137,6 +185,33 @@ def test_database_store():
         assert len(results) == 2
 
 
+def test_cycles_are_stored_in_the_background():
+    client = TrafficLightAPIClient(url="http://api.url/", monitored_devices=["TEST"], db="sqlite:///:memory:")
+    store = client.store
+    batches = []
+    first_stored = threading.Event()
+
+    def slow_store(events):
+        batches.append(list(events))
+        first_stored.wait(1.0)
+        store(events)
+
+    client.store = slow_store
+    events = [("TEST", name, TS[0], TS[2], TS[4]) for name in "ABCD"]
+    started = time.monotonic()
+    for event in events:
+        client.store_later(event)
+    # the database does not block the caller
+    assert time.monotonic() - started < 0.5
+    first_stored.set()
+    client.wait_until_stored()
+    # events queued during a store are stored together
+    assert sum(batches, []) == events
+    assert len(batches) <= 2
+    with client.database.connect() as conn:
+        assert len(conn.execute(client.db_table.select()).fetchall()) == 4
+
+
 @respx.mock
 def test_polling():
     respx.get("http://trafficlights.tampere.fi/api/v1/deviceState/TRE428").mock(
@@ -155,3 +230,258 @@ def test_polling():
     assert client.active
     client.stop_polling()
     assert not client.active
+
+
+@respx.mock
+def test_listening_continues_after_errors():
+    responses = iter([Response(200, json=TRE428_MOCK_DATA), httpx.ConnectError("connection refused"),
+                      Response(503)])
+    changed = {**TRE428_MOCK_DATA, 'timestamp': '2021-10-08T02:56:50+03:00',
+               'signalGroup': [{**sgroup, 'status': RED_STATUS} if sgroup['name'] == 'A' else sgroup
+                               for sgroup in TRE428_MOCK_DATA['signalGroup']]}
+
+    def respond(request):
+        response = next(responses, None)
+        if isinstance(response, Exception):
+            raise response
+        return response or Response(200, json=changed)
+
+    respx.get("http://api.url/TRE428").mock(side_effect=respond)
+    client = TrafficLightAPIClient(url="http://api.url/", monitored_devices=["TRE428"], db="sqlite:///:memory:",
+                                   retries=0)
+    events = []
+
+    def callback(*event):
+        events.append(event)
+        client.stop_polling()
+
+    listening = threading.Thread(target=client.listen_for_light_change_events, args=(0.01, callback), daemon=True)
+    listening.start()
+    listening.join(timeout=2.0)
+    assert not listening.is_alive()
+    assert events == [("TRE428", "A", changed_timestamp(changed), Status.RED)]
+
+
+def changed_timestamp(data):
+    return datetime.strptime(data['timestamp'], "%Y-%m-%dT%H:%M:%S%z").timestamp()
+
+
+@respx.mock
+def test_listening_keeps_its_cadence(monkeypatch):
+    clock = [0.0]
+    sleeps = []
+
+    def respond(request):
+        # each poll takes 0.3 s
+        clock[0] += 0.3
+        return Response(200, json=TRE428_MOCK_DATA)
+
+    async def sleep(delay):
+        sleeps.append(delay)
+        clock[0] += delay
+        if len(sleeps) == 3:
+            client.stop_polling()
+        await real_sleep(0)
+
+    class FakeAsyncio:
+        def __getattr__(self, name):
+            return getattr(asyncio, name)
+
+    real_sleep = asyncio.sleep
+    fake_asyncio = FakeAsyncio()
+    fake_asyncio.sleep = sleep
+    respx.get("http://api.url/TRE428").mock(side_effect=respond)
+    client = TrafficLightAPIClient(url="http://api.url/", monitored_devices=["TRE428"], db="sqlite:///:memory:")
+    # only the clock of the client is faked, not the one of the event loop
+    monkeypatch.setattr(api_client, "time", types.SimpleNamespace(monotonic=lambda: clock[0]))
+    monkeypatch.setattr(api_client, "asyncio", fake_asyncio)
+    client.listen_for_light_change_events(1.0, lambda *event: None)
+    # the time spent polling is subtracted from the interval
+    assert sleeps == pytest.approx([0.7, 0.7, 0.7])
+
+
+def fetch_device_states(client):
+    async def fetch():
+        async with httpx.AsyncClient() as http_client:
+            return await client.fetch_device_states(http_client)
+    return asyncio.run(fetch())
+
+
+@respx.mock
+def test_devices_are_fetched_concurrently():
+    async def respond(request):
+        await asyncio.sleep(0.2)
+        return Response(200, json={**TRE428_MOCK_DATA, 'device': request.url.path.split("/")[-1]})
+
+    respx.get(url__startswith="http://api.url/").mock(side_effect=respond)
+    client = TrafficLightAPIClient(url="http://api.url/", monitored_devices=["TRE401", "TRE428", "TRE430"],
+                                   db="sqlite:///:memory:")
+    started = time.monotonic()
+    states = fetch_device_states(client)
+    assert time.monotonic() - started < 0.4
+    assert [state['device'] for state in states] == ["TRE401", "TRE428", "TRE430"]
+
+
+@respx.mock
+def test_slow_and_failing_devices_are_skipped():
+    async def respond_slowly(request):
+        await asyncio.sleep(1.0)
+        return Response(200, json=TRE401_MOCK_DATA)
+
+    respx.get("http://api.url/TRE401").mock(side_effect=respond_slowly)
+    respx.get("http://api.url/TRE404").mock(Response(404))
+    respx.get("http://api.url/TRE428").mock(Response(200, json=TRE428_MOCK_DATA))
+    client = TrafficLightAPIClient(url="http://api.url/", monitored_devices=["TRE401", "TRE404", "TRE428"],
+                                   db="sqlite:///:memory:", timeout=0.1, retries=0)
+    started = time.monotonic()
+    assert fetch_device_states(client) == [TRE428_MOCK_DATA]
+    assert time.monotonic() - started < 0.5
+
+
+@respx.mock
+def test_failed_requests_are_retried():
+    route = respx.get("http://api.url/TRE428").mock(side_effect=[
+        httpx.ReadError("connection reset"), Response(502), Response(200, json=TRE428_MOCK_DATA)])
+    client = TrafficLightAPIClient(url="http://api.url/", monitored_devices=["TRE428"], db="sqlite:///:memory:",
+                                   retries=2, retry_delay=0.01)
+    assert fetch_device_states(client) == [TRE428_MOCK_DATA]
+    assert route.call_count == 3
+
+    route.side_effect = [Response(503)] * 3
+    assert fetch_device_states(client) == []
+
+
+class RecordingSchedule:
+    def __init__(self, interval):
+        self.states = []
+        self.polls = []
+        self.__interval = interval
+
+    def observe(self, state):
+        self.states.append(state)
+
+    def interval(self, device, now):
+        self.polls.append(device)
+        return self.__interval
+
+
+@respx.mock
+def test_listening_follows_the_schedule():
+    respx.get("http://api.url/TRE428").mock(Response(200, json=TRE428_MOCK_DATA))
+    client = TrafficLightAPIClient(url="http://api.url/", monitored_devices=["TRE428"], db="sqlite:///:memory:")
+    schedule = RecordingSchedule(0.01)
+    listening = threading.Thread(target=client.listen_for_light_change_events,
+                                 args=(60.0, lambda *event: None, schedule), daemon=True)
+    listening.start()
+    deadline = time.monotonic() + 2.0
+    while len(schedule.polls) < 5 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    client.stop_polling()
+    listening.join(timeout=2.0)
+    # polled every 0.01 s instead of every 60 s
+    assert len(schedule.polls) >= 5
+    assert schedule.states[0] == TRE428_MOCK_DATA
+
+
+@respx.mock
+def test_update_device_state_errors():
+    respx.get("http://api.url/TRE401").mock(Response(500))
+    respx.get("http://api.url/TRE428").mock(side_effect=httpx.ConnectError("connection refused"))
+    client = TrafficLightAPIClient(url="http://api.url/", monitored_devices=["TRE401", "TRE428"],
+                                   db="sqlite:///:memory:")
+    failures = []
+    client.events.subscribe(POLL_FAILED, lambda *failure: failures.append(failure))
+    assert client.update_device_state("TRE401") == []
+    assert client.update_device_state("TRE428") == []
+    assert failures == [("TRE401", "HTTP 500"), ("TRE428", "connection refused")]
+
+
+def cycle_responses(device, statuses):
+    """
+    Responses of a device with one signal group "A", the last one repeated.
+    """
+    states = [{'device': device, 'timestamp': TS[i], 'signalGroup': [{'idx': 0, 'name': 'A', 'status': status}]}
+              for i, status in enumerate(statuses)]
+
+    def respond(request):
+        return Response(200, json=states.pop(0) if len(states) > 1 else states[0])
+    return respond
+
+
+@respx.mock
+def test_one_poll_publishes_light_changes_and_cycles():
+    respx.get("http://api.url/TEST").mock(side_effect=cycle_responses("TEST", [RED_STATUS, GREEN_STATUS, RED_STATUS]))
+    client = TrafficLightAPIClient(url="http://api.url/", monitored_devices=["TEST"], db="sqlite:///:memory:")
+    changes, cycles = [], []
+    client.events.subscribe(LIGHT_CHANGED, lambda *change: changes.append(change[1:]))
+    client.events.subscribe(CYCLE_COMPLETED, cycles.append)
+    stored = threading.Thread(target=client.start_polling, args=(0.01,), daemon=True)
+    stored.start()
+    listening = threading.Thread(target=client.listen_for_light_change_events,
+                                 args=(0.01, lambda *change: changes.append(change[1:])), daemon=True)
+    listening.start()
+    deadline = time.monotonic() + 2.0
+    while not cycles and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    client.stop_polling()
+    stored.join(timeout=2.0)
+    listening.join(timeout=2.0)
+    assert not stored.is_alive() and not listening.is_alive()
+
+    assert cycles == [("TEST", "A", TS[0], TS[1], TS[2])]
+    # both subscribers got both changes
+    assert sorted(changes) == sorted([("A", changed_timestamp({'timestamp': TS[1]}), Status.GREEN),
+                                      ("A", changed_timestamp({'timestamp': TS[2]}), Status.RED)] * 2)
+    # the cycle was stored once by start_polling
+    with client.database.connect() as conn:
+        assert len(conn.execute(client.db_table.select()).fetchall()) == 1
+
+
+@respx.mock
+def test_concurrent_listeners_share_the_polls():
+    route = respx.get("http://api.url/TRE428").mock(Response(200, json=TRE428_MOCK_DATA))
+    client = TrafficLightAPIClient(url="http://api.url/", monitored_devices=["TRE428"], db="sqlite:///:memory:")
+    stored = threading.Thread(target=client.start_polling, args=(0.5,), daemon=True)
+    stored.start()
+    deadline = time.monotonic() + 2.0
+    while not route.called and time.monotonic() < deadline:
+        time.sleep(0.01)
+    listening = threading.Thread(target=client.listen_for_light_change_events,
+                                 args=(0.5, lambda *change: None), daemon=True)
+    listening.start()
+    time.sleep(0.1)
+    # the second thread did not poll the API again
+    assert route.call_count == 1
+    client.stop_polling()
+    stored.join(timeout=2.0)
+    listening.join(timeout=2.0)
+    assert not stored.is_alive() and not listening.is_alive()
+
+
+def test_polling_with_other_arguments_is_an_error():
+    client = TrafficLightAPIClient(url="http://api.url/", monitored_devices=[], db="sqlite:///:memory:")
+    polling = threading.Thread(target=client.poll, args=(60,), daemon=True)
+    polling.start()
+    deadline = time.monotonic() + 2.0
+    while not client.active and time.monotonic() < deadline:
+        time.sleep(0.01)
+    changes = []
+    with pytest.raises(ValueError):
+        client.listen_for_light_change_events(0.2, lambda *change: changes.append(change))
+    # the listener was not left subscribed
+    client.events.publish(LIGHT_CHANGED, "TEST", "A", 0.0, Status.RED)
+    assert changes == []
+    client.stop_polling()
+    polling.join(timeout=1.0)
+    assert not polling.is_alive()
+
+
+def test_polling_can_be_restarted():
+    client = TrafficLightAPIClient(url="http://api.url/", monitored_devices=[], db="sqlite:///:memory:")
+    for _ in range(2):
+        polling = threading.Thread(target=client.poll, args=(0.01,), daemon=True)
+        polling.start()
+        client.stop_polling()
+        polling.join(timeout=1.0)
+        assert not polling.is_alive()